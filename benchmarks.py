@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import numpy as np
+
+import random
+import time
+import torch
+
+from models.tensor_ops import reverse_sequences, soft_to_hard, to_cat
+
+#set random seeds to reproduce results
+np.random.seed(42)
+random.seed(42)
+
+def create_synthetic_hidden_reps(
+                                 n_examples:int,
+                                 seq_len:int=24,
+                                 hidden_size:int=32,
+                                 n_layers:int=6,
+):
+    """
+        - synthetic test results (hidden reps, sent pairs and answer spans) with the same structure as the results stored by test() (output_all_hiddens=True)
+        - only every other example is kept (i.e., pred_indices are a strict subset of all examples as in evaluate_estimations_and_cosines)
+    """
+    sent_pairs = [' '.join(['[CLS]'] + ['q'] * 5 + ['[SEP]'] + ['c'] * (seq_len - 8) + ['[SEP]']) for _ in range(n_examples)]
+    true_start_pos = np.random.randint(7, seq_len - 6, n_examples)
+    true_end_pos = true_start_pos + np.random.randint(1, 5, n_examples)
+    log_probs = np.log(np.random.dirichlet(np.ones(seq_len), n_examples))
+    test_results = {
+                    'predicted_answers': ['c'] * n_examples,
+                    'true_answers': ['c c'] * n_examples,
+                    'sent_pairs': sent_pairs,
+                    'true_start_pos': true_start_pos.tolist(),
+                    'true_end_pos': true_end_pos.tolist(),
+                    'start_log_probs': log_probs.tolist(),
+                    'end_log_probs': log_probs.tolist(),
+                    #NOTE: hidden reps are stored as nested lists (as in the results JSON files)
+                    'feat_reps': {'Layer_' + str(l + 1): np.random.randn(n_examples, seq_len, hidden_size).tolist() for l in range(n_layers)},
+                    }
+    pred_indices = np.arange(0, n_examples, 2)
+    #NOTE: as for real QA models, there are fewer correct than erroneous answer predictions
+    true_preds = (np.random.rand(len(pred_indices)) < .3).astype(int)
+    return test_results, pred_indices, true_preds
+
+def benchmark_similarities_across_layers(n_examples_per_run:list):
+    """
+        - time HiddenRepStore construction and compute_similarities_across_layers for increasing test set sizes
+        - time per example must remain (roughly) constant, i.e. the analysis scales linearly in the number of examples
+    """
+    #NOTE: models.utils must be imported before eval_hidden_reps (otherwise, the circular import between both modules fails)
+    import models.utils
+    from eval_hidden_reps import HiddenRepStore, compute_similarities_across_layers
+    results = {}
+    for n_examples in n_examples_per_run:
+        test_results, pred_indices, true_preds = create_synthetic_hidden_reps(n_examples)
+        start_time = time.perf_counter()
+        store = HiddenRepStore(test_results)
+        print("----- HiddenRepStore (N = {}): {} s -----".format(n_examples, round(time.perf_counter() - start_time, 3)))
+        start_time = time.perf_counter()
+        compute_similarities_across_layers(
+                                           store=store,
+                                           pred_indices=pred_indices,
+                                           true_preds=true_preds,
+                                           source='SubjQA',
+                                           version='test',
+                                           layers='all_layers',
+                                           )
+        elapsed = time.perf_counter() - start_time
+        results[n_examples] = elapsed
+        print("----- compute_similarities_across_layers (N = {}): {} s ({} ms / example) -----".format(n_examples, round(elapsed, 3), round(1e3 * elapsed / n_examples, 3)))
+    return results
+
+#NOTE: loop-based reference implementations of the label manipulations in models/tensor_ops.py (used for equivalence checks)
+def to_cat_loop(true_labels, n_labels):
+    cat_mat = torch.zeros(true_labels.size(0), n_labels)
+    for i, l in enumerate(true_labels):
+        cat_mat[i, l] += 1
+    return cat_mat
+
+def soft_to_hard_loop(probas):
+    return torch.tensor(list(map(lambda p: 1 if p >= 0.5 else 0, probas.cpu().numpy())), dtype=torch.double)
+
+def reverse_sequences_loop(batch):
+    return torch.tensor(list(map(lambda feat_reps: feat_reps[::-1], batch.cpu().numpy().tolist())), dtype=torch.double)
+
+def time_op(op, n_repeats:int):
+    start_time = time.perf_counter()
+    for _ in range(n_repeats):
+        output = op()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return output, (time.perf_counter() - start_time) / n_repeats
+
+def benchmark_tensor_ops(
+                         batch_sizes:list,
+                         n_domains:int=6,
+                         seq_len:int=24,
+                         hidden_size:int=32,
+                         n_repeats:int=20,
+):
+    """
+        - time device-native label manipulations (models/tensor_ops.py) against their loop-based reference implementations
+        - outputs of both implementations must be equal for every batch size
+    """
+    results = {}
+    for batch_size in batch_sizes:
+        labels = torch.randint(0, n_domains, (batch_size,))
+        probas = torch.rand(batch_size)
+        #NOTE: probabilities exactly at the decision threshold must be mapped onto the positive class
+        probas[0] = 0.5
+        feat_reps = torch.randn(batch_size, seq_len, hidden_size)
+        ops = {
+               'to_cat': (lambda: to_cat(labels, n_domains), lambda: to_cat_loop(labels, n_domains)),
+               'soft_to_hard': (lambda: soft_to_hard(probas), lambda: soft_to_hard_loop(probas)),
+               'reverse_sequences': (lambda: reverse_sequences(feat_reps), lambda: reverse_sequences_loop(feat_reps)),
+               }
+        for name, (op, reference_op) in ops.items():
+            output, elapsed = time_op(op, n_repeats)
+            reference_output, reference_elapsed = time_op(reference_op, n_repeats)
+            assert torch.equal(output.cpu(), reference_output), '{} deviates from its loop-based reference implementation'.format(name)
+            results[(name, batch_size)] = (elapsed, reference_elapsed)
+            print("----- {} (batch size = {}): {} ms (loop: {} ms) -----".format(name, batch_size, round(1e3 * elapsed, 3), round(1e3 * reference_elapsed, 3)))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmarks', type=str, nargs='+', default=['hidden_reps', 'tensor_ops'], choices=['hidden_reps', 'tensor_ops'],
+        help='Benchmarks to run.')
+    parser.add_argument('--n_examples', type=int, nargs='+', default=[500, 1000, 2000, 4000],
+        help='Test set sizes for which the hidden-rep analysis is timed.')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[32, 256, 2048],
+        help='Mini-batch sizes for which the label manipulations are timed.')
+    args = parser.parse_args()
+    if 'hidden_reps' in args.benchmarks:
+        benchmark_similarities_across_layers(args.n_examples)
+    if 'tensor_ops' in args.benchmarks:
+        benchmark_tensor_ops(args.batch_sizes)
@@ -3,7 +3,10 @@
 
 __all__ = [
            'get_hidden_reps',
+           'HiddenRepStore',
            'compute_ans_similarities',
+           'compute_ans_similarities_batch',
+           'compute_n_gram_features',
            'adjust_p_values',
            'shuffle_arrays',
            'compute_similarities_across_layers',
@@ -12,10 +15,13 @@ __all__ = [
 
 import argparse
 import json
+import math
 import matplotlib
+import multiprocessing
 import os
 import pickle
 import re
+import sys
 import torch
 
 import matplotlib.pyplot as plt
@@ -26,11 +32,10 @@ import torch.nn as nn
 from collections import defaultdict, Counter
 from eval_squad import compute_exact
 from joblib import dump, load
-from nltk.translate.bleu_score import sentence_bleu
 from statsmodels.stats.multitest import multipletests
 from scipy import io
 from scipy.stats import entropy, f_oneway, spearmanr, ttest_ind
-from sklearn.decomposition import PCA
+from sklearn.decomposition import IncrementalPCA, PCA
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import f1_score
 from sklearn.svm import SVC
@@ -40,6 +45,8 @@ from torch.utils.data import DataLoader, TensorDataset
 from torch.optim import Adam, SGD
 from utils import BatchGenerator
 
+from models.eval_controller import EvalController
+
 try:
     from models.utils import to_cpu, f1, soft_to_hard, accuracy
     from models.modules.NN import *
@@ -86,6 +93,127 @@ def get_hidden_reps(
 
     return results, file_name
 
+class HiddenRepStore(object):
+    """
+        Hidden reps of all examples, converted to NumPy arrays once and shared by all analyses.
+        Token hidden reps of every layer are stored in a single contiguous (T x D) array, where example i spans the rows offsets[i]:offsets[i+1].
+        Derived quantities (sep indices, predicted answer spans, question and answer mean vectors) are computed lazily and cached.
+    """
+
+    def __init__(
+                 self,
+                 test_results:dict,
+                 load_layers=None,
+    ):
+        self.predicted_answers = test_results['predicted_answers']
+        self.true_answers = test_results['true_answers']
+        self.sent_pairs = test_results['sent_pairs']
+        self.true_start_pos = np.asarray(test_results.get('true_start_pos', []))
+        self.true_end_pos = np.asarray(test_results.get('true_end_pos', []))
+        self.s_log_probs = np.asarray(test_results['start_log_probs']) if 'start_log_probs' in test_results else None
+        self.e_log_probs = np.asarray(test_results['end_log_probs']) if 'end_log_probs' in test_results else None
+
+        #NOTE: hidden reps are not required for majority predictions (i.e., load_layers = [])
+        feat_reps = test_results.get('feat_reps', {})
+        self.layers = list(feat_reps.keys()) if isinstance(load_layers, type(None)) else list(load_layers)
+        self.offsets = None
+        self.hiddens = {l: self.stack(feat_reps[l]) for l in self.layers}
+
+        self._tokenized_sent_pairs = None
+        self._sep_indices = None
+        self._pred_spans = None
+        self._q_means = {}
+        self._a_means = {}
+
+    def __len__(self):
+        return len(self.sent_pairs)
+
+    def stack(self, hiddens_all_sents:list):
+        #convert hidden reps of a layer into a single contiguous array (without creating an intermediate array per example)
+        if isinstance(self.offsets, type(None)):
+            self.offsets = np.concatenate(([0], np.cumsum([len(hiddens) for hiddens in hiddens_all_sents]))).astype(np.int64)
+        hidden_size = len(hiddens_all_sents[0][0])
+        hiddens_stacked = np.empty((self.offsets[-1], hidden_size))
+        for i, hiddens in enumerate(hiddens_all_sents):
+            hiddens_stacked[self.offsets[i]:self.offsets[i+1]] = hiddens
+        return hiddens_stacked
+
+    def get(
+            self,
+            layer:str,
+            i:int,
+    ):
+        #hidden reps of example i (view into the contiguous array of the layer)
+        return self.hiddens[layer][self.offsets[i]:self.offsets[i+1]]
+
+    def split(
+              self,
+              layer:str,
+              indices=None,
+    ):
+        indices = range(len(self)) if isinstance(indices, type(None)) else indices
+        return [self.get(layer, i) for i in indices]
+
+    @property
+    def tokenized_sent_pairs(self):
+        if isinstance(self._tokenized_sent_pairs, type(None)):
+            self._tokenized_sent_pairs = [sent_pair.strip().split() for sent_pair in self.sent_pairs]
+        return self._tokenized_sent_pairs
+
+    @property
+    def sep_indices(self):
+        if isinstance(self._sep_indices, type(None)):
+            self._sep_indices = np.array([sent_pair.index('[SEP]') for sent_pair in self.tokenized_sent_pairs])
+        return self._sep_indices
+
+    @property
+    def pred_spans(self):
+        #predicted answer spans (argmax over start and end log probs respectively)
+        if isinstance(self._pred_spans, type(None)):
+            self._pred_spans = (np.argmax(self.s_log_probs, axis=1), np.argmax(self.e_log_probs, axis=1))
+        return self._pred_spans
+
+    def span_means(
+                   self,
+                   cache:dict,
+                   layer:str,
+                   indices:np.ndarray,
+                   s_positions:np.ndarray,
+                   e_positions:np.ndarray,
+    ):
+        #mean hidden rep of span [s_pos, e_pos) per example (computed at most once per example and layer)
+        if layer not in cache:
+            cache[layer] = (np.zeros((len(self), self.hiddens[layer].shape[1])), np.zeros(len(self), dtype=bool))
+        means, is_cached = cache[layer]
+        indices = np.asarray(indices)
+        for i in indices[~is_cached[indices]]:
+            means[i] = self.get(layer, i)[s_positions[i]:e_positions[i]].mean(axis=0)
+        is_cached[indices] = True
+        return means[indices]
+
+    def question_means(
+                       self,
+                       layer:str,
+                       indices:np.ndarray,
+    ):
+        #question tokens are located between [CLS] and the first [SEP] token
+        return self.span_means(self._q_means, layer, indices, np.ones(len(self), dtype=int), self.sep_indices)
+
+    def answer_means(
+                     self,
+                     layer:str,
+                     indices:np.ndarray,
+    ):
+        s_positions, e_positions = self.pred_spans
+        return self.span_means(self._a_means, layer, indices, s_positions, e_positions + 1)
+
+    def drop_hiddens(self):
+        #release hidden reps (e.g., before the store is sent to worker processes that only require answers and sent pairs)
+        self.hiddens = {}
+        self._q_means = {}
+        self._a_means = {}
+        return self
+
 def euclidean_dist(u, v): return np.linalg.norm(u-v) #default is L2 norm
 
 def kl_div(p, q):
@@ -100,15 +228,44 @@ def cosine_sim(u, v):
     denom = np.linalg.norm(u) * np.linalg.norm(v) #default is Frobenius norm (i.e., L2 norm)
     return num / denom
 
+def cosine_sim_matrix(hiddens:np.ndarray):
+    #compute norms once and all pairwise dot products with a single Gram matrix
+    norms = np.linalg.norm(hiddens, axis=1)
+    return (hiddens @ hiddens.T) / np.outer(norms, norms)
+
 def compute_ans_similarities(a_hiddens:np.ndarray):
-    a_dists = []
-    for i, a_i in enumerate(a_hiddens):
-        for j, a_j in enumerate(a_hiddens):
-            #NOTE: cos sim is a symmetric dist metric plus we don't want to compute cos sim of a vector with itself (i.e., cos_sim(u, u) = 1)
-            if i != j and j > i:
-                a_dists.append(cosine_sim(u=a_i, v=a_j))
+    a_hiddens = np.asarray(a_hiddens)
+    #NOTE: cos sim is a symmetric dist metric plus we don't want to compute cos sim of a vector with itself (i.e., cos_sim(u, u) = 1)
+    #hence, we only need the upper triangle of the cos sim matrix (row-major order is equivalent to iterating over all pairs i < j)
+    a_dists = cosine_sim_matrix(a_hiddens)[np.triu_indices(a_hiddens.shape[0], k=1)]
     return np.max(a_dists), np.min(a_dists), np.mean(a_dists), np.std(a_dists)
 
+def compute_ans_similarities_batch(
+                                   hiddens:np.ndarray,
+                                   s_positions:np.ndarray,
+                                   e_positions:np.ndarray,
+):
+    """
+        - batched version of compute_ans_similarities for many answer spans (e.g., top-k candidates) in the same sequence
+        - a single Gram matrix is computed for the window [min start, max end] that covers all spans and statistics are read from the upper triangle of each span's block
+        - returns arrays of max, min, mean and std cos sims (one value per span; NaN for spans that consist of a single token)
+    """
+    hiddens = np.asarray(hiddens)
+    s_positions = np.asarray(s_positions).ravel()
+    e_positions = np.asarray(e_positions).ravel()
+    stats = np.full((4, s_positions.shape[0]), np.nan)
+    if s_positions.shape[0] == 0:
+        return tuple(stats)
+    #cos sims are only computed for tokens within the window (instead of the whole sequence)
+    window_start = s_positions.min()
+    cos_sims = cosine_sim_matrix(hiddens[window_start:e_positions.max()+1])
+    for k, (s_pos, e_pos) in enumerate(zip(s_positions - window_start, e_positions - window_start)):
+        if e_pos > s_pos:
+            span_dists = cos_sims[s_pos:e_pos+1, s_pos:e_pos+1][np.triu_indices(e_pos - s_pos + 1, k=1)]
+            stats[:, k] = np.max(span_dists), np.min(span_dists), np.mean(span_dists), np.std(span_dists)
+    max_cos, min_cos, mean_cos, std_cos = stats
+    return max_cos, min_cos, mean_cos, std_cos
+
 def adjust_p_values(
                     ans_similarities:dict,
                     alpha:float=.05,
@@ -142,7 +299,7 @@ def test(model, test_dl):
             logits = model(X)
             probas = torch.sigmoid(logits)
             y_pred = soft_to_hard(probas).long()
-            incorrect_preds.append(np.where(y.cpu() != y_pred)[0] + i)
+            incorrect_preds.append(np.where(to_cpu(y.long() != y_pred))[0] + i)
             test_f1 += f1(probas=probas, y_true=y, task='binary')
             test_acc += accuracy(probas=probas, y_true=y, task='binary')
             test_steps += 1
@@ -177,6 +334,8 @@ def train(
     max_grad_norm = 10 #if version.lower() == 'subjqa' else 5
     losses = []
     f1_scores = []
+    #stop training as soon as train loss does not decrease anymore (after min_n_epochs epochs)
+    eval_controller = EvalController(patience=0, min_epochs=min_n_epochs)
 
     for epoch in range(n_epochs):
         model.train()
@@ -207,9 +366,9 @@ def train(
         print("============================")
         print()
 
-        if epoch >= min_n_epochs:
-            if losses[-1] >= losses[-2]:
-                break
+        eval_controller.update(losses[-1])
+        if eval_controller.should_stop(epoch):
+            break
 
     model.eval()
     return losses, f1_scores, model
@@ -378,29 +537,50 @@ def plot_cosine_distrib(
 def compute_rel_freq(cos_sim_preds:dict):
     return {layer: {pred: {'min_std_cos':vals['min_std_cos']/vals['freq'], 'max_mean_cos':vals['max_mean_cos']/vals['freq'], 'spearman_r':np.mean(vals['spearman_r'])} for pred, vals in preds.items()} for layer, preds in cos_sim_preds.items()}
 
-def remove_impossible_candidates(s_positions:np.ndarray, e_positions:np.ndarray):
-    s_candidates, e_candidates = zip(*[(s_pos, e_pos) for s_pos, e_pos in zip(s_positions, e_positions) if s_pos < e_pos])
+def top_k_valid_spans(
+                      s_log_probs:np.ndarray,
+                      e_log_probs:np.ndarray,
+                      top_k:int,
+                      max_answer_length=None,
+                      chunk_size:int=64,
+):
+    """
+        - enumerate the top-k valid candidate answer spans (i.e., s_pos < e_pos) w.r.t. s_log_prob + e_log_prob for all examples at once
+        - span scores are computed for chunks of examples to bound memory (chunk_size x seq_len x seq_len)
+        - returns arrays of start and end positions (N x top_k), sorted by decreasing span score
+    """
+    s_log_probs = np.asarray(s_log_probs)
+    e_log_probs = np.asarray(e_log_probs)
+    N, T = s_log_probs.shape
+    #upper triangle without diagonal (s_pos < e_pos), optionally restricted to spans with at most max_answer_length tokens
+    valid_spans = np.triu(np.ones((T, T), dtype=bool), k=1)
+    if isinstance(max_answer_length, int):
+        valid_spans &= np.tril(np.ones((T, T), dtype=bool), k=max_answer_length-1)
+    valid_spans = np.flatnonzero(valid_spans)
+    top_k = min(top_k, valid_spans.size)
+    s_candidates = np.zeros((N, top_k), dtype=int)
+    e_candidates = np.zeros((N, top_k), dtype=int)
+    for start in range(0, N, chunk_size):
+        stop = min(start + chunk_size, N)
+        span_scores = (s_log_probs[start:stop, :, None] + e_log_probs[start:stop, None, :]).reshape(stop - start, -1)[:, valid_spans]
+        top_spans = np.argpartition(-span_scores, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(-np.take_along_axis(span_scores, top_spans, axis=1), axis=1, kind='stable')
+        top_spans = np.take_along_axis(top_spans, order, axis=1)
+        s_candidates[start:stop], e_candidates[start:stop] = np.divmod(valid_spans[top_spans], T)
     return s_candidates, e_candidates
 
 def compute_cos_sim_across_logits(
                                   hiddens:np.ndarray,
-                                  s_log_probs:np.ndarray,
-                                  e_log_probs:np.ndarray,
+                                  s_candidates:np.ndarray,
+                                  e_candidates:np.ndarray,
                                   cos_similarities_preds:dict,
                                   true_pred:bool,
                                   layer:str,
-                                  top_k:int,
                                   ):
-    assert len(s_log_probs) == len(e_log_probs)
-    #sort log-probabilities in decreasing order (0 to -inf)
-    s_positions = np.argsort(s_log_probs)[::-1]
-    e_positions = np.argsort(e_log_probs)[::-1]
-    #remove impossible answer span predictions to yield an array of possible candidate answers (i.e., remove answer spans where s_pos >= e_pos)
-    s_candidates, e_candidates = remove_impossible_candidates(s_positions, e_positions)
-    top_k_s_candidates = s_candidates[:top_k]
-    top_k_e_candidates = e_candidates[:top_k]
-
-    _, _, mean_cosines, std_cosines = zip(*[compute_ans_similarities(hiddens[top_k_s_candidates[i]:top_k_e_candidates[i]+1,:]) for i in range(top_k)])
+    assert len(s_candidates) == len(e_candidates)
+    #candidate answer spans are sorted w.r.t. their span scores in decreasing order (see top_k_valid_spans)
+    #cos sims for all top-k candidates are computed with a single Gram matrix
+    _, _, mean_cosines, std_cosines = compute_ans_similarities_batch(hiddens, s_candidates, e_candidates)
 
     cos_similarities_preds[layer]['correct' if true_pred else 'erroneous'] = {}
     
@@ -452,20 +632,27 @@ def interp_cos_per_layer(
         L = len(cos_distrib_correct_preds)
         cdf_probas = np.zeros((X.shape[0], 2*L))      
     
+    def get_cdf(cos:np.ndarray):
+        """
+            - sort *train* cos(h_a) distribution once per layer (instead of for every test example)
+            - set endpoint flag in np.linspace() to False to yield an unbiased estimator of the CDF (equivalent to np.arange(1, len(cos)+1)/len(cos))
+        """
+        p = np.arange(1, len(cos)+1) / len(cos) #np.linspace(0, 1, len(cos), endpoint=False)
+        cos_sorted = np.sort(cos) #sort values in ascending order
+        assert np.all(np.diff(cos_sorted) >= 0), 'x-coordinate sequence xp must be passed in increasing order' #use >= 0 since some values might be equivalent (hence, > 0 will yield AssertionError)
+        return cos_sorted, p
+
     def interp_cos(
-                   x:float,
-                   cos:np.ndarray,
+                   x:np.ndarray,
+                   cdf:tuple,
                    weighting:bool=False,
                    delta=None,
     ):
         """
             - compute P(x_i - delta < x_i < x_i + delta) (is equal to P(x_i - delta <= x_i <= x_i + delta)) => p that observed cos(h_a) lies within pre-defined interval according to CDFs
-            - set endpoint flag in np.linspace() to False to yield an unbiased estimator of the CDF (equivalent to np.arange(1, len(cos)+1)/len(cos))
+            - x is a whole column of X (i.e., interpolation is performed for all examples at once)
         """
-        p = np.arange(1, len(cos)+1) / len(cos) #np.linspace(0, 1, len(cos), endpoint=False)
-        cos_sorted = np.sort(cos) #sort values in ascending order
-        assert np.all(np.diff(cos_sorted) >= 0), 'x-coordinate sequence xp must be passed in increasing order' #use >= 0 since some values might be equivalent (hence, > 0 will yield AssertionError)
-        
+        cos_sorted, p = cdf
         if weighting:
             return np.interp(x, cos_sorted, p) #P(cos(h_a) < x_i)
         else:
@@ -476,74 +663,77 @@ def interp_cos_per_layer(
         #unpack mean(cos(h_a)) and std(cos(h_a)) *train* distributions
         cos_correct_means, cos_correct_stds = zip(*cos_correct)
         cos_incorrect_means, cos_incorrect_stds = zip(*cos_incorrect)
-        
-        if computation == 'concat':
-            cdf_probas_per_layer = []
 
-        for i in range(X.shape[0]):
-            cos_mean = X[i, 2*l]
-            cos_std = X[i, 2*l+1]
-            
-            if version == 'train' or w_strategy == 'oracle':
-                assert isinstance(y, np.ndarray), 'y must be provided at train time or if w_strategy == oracle'
-                p_cos_mean = interp_cos(x=cos_mean, cos=cos_correct_means if y[i] == 1 else cos_incorrect_means, delta=delta)
-                p_cos_std = interp_cos(x=cos_std, cos=cos_correct_stds if y[i] == 1 else cos_incorrect_stds, delta=delta)
-            else:
-                #NOTE: we shall not exploit gold labels (i.e., QA model predictions) at test time
-                p_cos_mean_correct = interp_cos(x=cos_mean, cos=cos_correct_means, delta=delta)
-                p_cos_mean_incorrect = interp_cos(x=cos_mean, cos=cos_incorrect_means, delta=delta)
-                p_cos_std_correct = interp_cos(x=cos_std, cos=cos_correct_stds, delta=delta)
-                p_cos_std_incorrect = interp_cos(x=cos_std, cos=cos_incorrect_stds, delta=delta)
+        #precompute *train* CDFs once per layer
+        cdf_correct_means = get_cdf(cos_correct_means)
+        cdf_correct_stds = get_cdf(cos_correct_stds)
+        cdf_incorrect_means = get_cdf(cos_incorrect_means)
+        cdf_incorrect_stds = get_cdf(cos_incorrect_stds)
+
+        cos_mean = X[:, 2*l].copy()
+        cos_std = X[:, 2*l+1].copy()
+        
+        if version == 'train' or w_strategy == 'oracle':
+            assert isinstance(y, np.ndarray), 'y must be provided at train time or if w_strategy == oracle'
+            p_cos_mean = np.where(y == 1, interp_cos(x=cos_mean, cdf=cdf_correct_means, delta=delta), interp_cos(x=cos_mean, cdf=cdf_incorrect_means, delta=delta))
+            p_cos_std = np.where(y == 1, interp_cos(x=cos_std, cdf=cdf_correct_stds, delta=delta), interp_cos(x=cos_std, cdf=cdf_incorrect_stds, delta=delta))
+        else:
+            #NOTE: we shall not exploit gold labels (i.e., QA model predictions) at test time
+            p_cos_mean_correct = interp_cos(x=cos_mean, cdf=cdf_correct_means, delta=delta)
+            p_cos_mean_incorrect = interp_cos(x=cos_mean, cdf=cdf_incorrect_means, delta=delta)
+            p_cos_std_correct = interp_cos(x=cos_std, cdf=cdf_correct_stds, delta=delta)
+            p_cos_std_incorrect = interp_cos(x=cos_std, cdf=cdf_incorrect_stds, delta=delta)
 
+            if w_strategy == 'distance':
                 dist_cos_mean_correct = abs(np.mean(cos_correct_means) - cos_mean)
                 dist_cos_mean_incorrect = abs(np.mean(cos_incorrect_means) - cos_mean)
                 dist_cos_std_correct = abs(np.mean(cos_correct_stds) - cos_std)
                 dist_cos_std_incorrect = abs(np.mean(cos_incorrect_stds) - cos_std)
 
-                if w_strategy == 'distance':
-                    cos_mean_w_correct = 1 - dist_cos_mean_correct
-                    cos_mean_w_incorrect = 1 - dist_cos_mean_incorrect
-                    cos_std_w_correct = 1 - dist_cos_std_correct
-                    cos_std_w_incorrect = 1 - dist_cos_std_incorrect
-
-                elif w_strategy == 'cdf':
-
-                    #################################################################################################################
-                    ## Note that the smaller abs(P(cos(h_a) > x_i) - P(cos(h_a) < x_i)) is,                                        ##
-                    ## the higher is the likelihood that x_i belongs to the respective distribution. This is a property of CDFs.   ##
-                    ## Hence, we must leverage 1 - abs(P(cos(h_a) > x_i) - P(cos(h_a) < x_i)) as a scaling factor (i.e., weights)  ##
-                    ## to approximate the *true* p_cdf values corresponding to the train CDFs.                                     ##
-                    #################################################################################################################
-
-                    q_cos_mean_correct = 1 - interp_cos(x=cos_mean, cos=cos_correct_means, weighting=True)
-                    cdf_cos_mean_correct = interp_cos(x=cos_mean, cos=cos_correct_means, weighting=True)
-                    q_cos_std_correct = 1 - interp_cos(x=cos_std, cos=cos_correct_stds, weighting=True)
-                    cdf_cos_std_correct = interp_cos(x=cos_std, cos=cos_correct_stds, weighting=True)
-
-                    q_cos_mean_incorrect = 1 - interp_cos(x=cos_mean, cos=cos_incorrect_means, weighting=True)
-                    cdf_cos_mean_incorrect = interp_cos(x=cos_mean, cos=cos_incorrect_means, weighting=True)
-                    q_cos_std_incorrect = 1 - interp_cos(x=cos_std, cos=cos_incorrect_stds, weighting=True)
-                    cdf_cos_std_incorrect = interp_cos(x=cos_std, cos=cos_incorrect_stds, weighting=True)
-
-                    cos_mean_w_correct = 1 - abs(q_cos_mean_correct - cdf_cos_mean_correct)
-                    cos_mean_w_incorrect = 1 - abs(q_cos_mean_incorrect - cdf_cos_mean_incorrect)
-                    cos_std_w_correct = 1 - abs(q_cos_std_correct - cdf_cos_std_correct)
-                    cos_std_w_incorrect = 1 - abs(q_cos_std_incorrect - cdf_cos_std_incorrect)
-
-                #weighted sum of the probabilities that *observed* cos(h_a) belongs to the distribution of correct or incorrect answer predictions respectively
-                p_cos_mean = ((p_cos_mean_correct * cos_mean_w_correct) + (p_cos_mean_incorrect * cos_mean_w_incorrect)) / 2
-                p_cos_std = ((p_cos_std_correct * cos_std_w_correct) + (p_cos_std_incorrect * cos_std_w_incorrect)) / 2
-                
-            if computation == 'weighting':
-                #use p as a weighting factor for mean and std wrt cos(h_a)
-                X[i, 2*l] *= p_cos_mean
-                X[i, 2*l+1] *= p_cos_std
-            
-            elif computation == 'concat':
-                cdf_probas_per_layer.append((p_cos_mean, p_cos_std))
+                cos_mean_w_correct = 1 - dist_cos_mean_correct
+                cos_mean_w_incorrect = 1 - dist_cos_mean_incorrect
+                cos_std_w_correct = 1 - dist_cos_std_correct
+                cos_std_w_incorrect = 1 - dist_cos_std_incorrect
+
+            elif w_strategy == 'cdf':
+
+                #################################################################################################################
+                ## Note that the smaller abs(P(cos(h_a) > x_i) - P(cos(h_a) < x_i)) is,                                        ##
+                ## the higher is the likelihood that x_i belongs to the respective distribution. This is a property of CDFs.   ##
+                ## Hence, we must leverage 1 - abs(P(cos(h_a) > x_i) - P(cos(h_a) < x_i)) as a scaling factor (i.e., weights)  ##
+                ## to approximate the *true* p_cdf values corresponding to the train CDFs.                                     ##
+                #################################################################################################################
+
+                cdf_cos_mean_correct = interp_cos(x=cos_mean, cdf=cdf_correct_means, weighting=True)
+                q_cos_mean_correct = 1 - cdf_cos_mean_correct
+                cdf_cos_std_correct = interp_cos(x=cos_std, cdf=cdf_correct_stds, weighting=True)
+                q_cos_std_correct = 1 - cdf_cos_std_correct
 
-        if computation == 'concat':
-            cdf_probas[:, 2*l:2*l+2] += np.stack(zip(*cdf_probas_per_layer), axis=1)
+                cdf_cos_mean_incorrect = interp_cos(x=cos_mean, cdf=cdf_incorrect_means, weighting=True)
+                q_cos_mean_incorrect = 1 - cdf_cos_mean_incorrect
+                cdf_cos_std_incorrect = interp_cos(x=cos_std, cdf=cdf_incorrect_stds, weighting=True)
+                q_cos_std_incorrect = 1 - cdf_cos_std_incorrect
+
+                cos_mean_w_correct = 1 - abs(q_cos_mean_correct - cdf_cos_mean_correct)
+                cos_mean_w_incorrect = 1 - abs(q_cos_mean_incorrect - cdf_cos_mean_incorrect)
+                cos_std_w_correct = 1 - abs(q_cos_std_correct - cdf_cos_std_correct)
+                cos_std_w_incorrect = 1 - abs(q_cos_std_incorrect - cdf_cos_std_incorrect)
+
+            else:
+                raise ValueError('Weighting strategy must be one of {distance, cdf, oracle}')
+
+            #weighted sum of the probabilities that *observed* cos(h_a) belongs to the distribution of correct or incorrect answer predictions respectively
+            p_cos_mean = ((p_cos_mean_correct * cos_mean_w_correct) + (p_cos_mean_incorrect * cos_mean_w_incorrect)) / 2
+            p_cos_std = ((p_cos_std_correct * cos_std_w_correct) + (p_cos_std_incorrect * cos_std_w_incorrect)) / 2
+            
+        if computation == 'weighting':
+            #use p as a weighting factor for mean and std wrt cos(h_a)
+            X[:, 2*l] *= p_cos_mean
+            X[:, 2*l+1] *= p_cos_std
+        
+        elif computation == 'concat':
+            cdf_probas[:, 2*l] += p_cos_mean
+            cdf_probas[:, 2*l+1] += p_cos_std
 
     if computation == 'concat':
         assert isinstance(concatenation, str), 'how to concatenate feature matrices must be specified'
@@ -572,96 +762,230 @@ def interp_cos_per_layer(
             X = np.hstack((X, cdf_probas))
     return X
 
-def compute_n_gram_overlap(q:list, a_candidate:list):
-    n_grams = list(range(1, 4))
-    n_gram_overlaps = []
-    def compute_unique_n_grams(sent:list, n_gram:int):
-        return set(tuple(sent[i:i+n_gram]) for i in range(len(sent)) if i <= len(sent)-n_gram)
-    for n_gram in n_grams:
-        q_n_grams = compute_unique_n_grams(q, n_gram)
-        a_n_grams = compute_unique_n_grams(a_candidate, n_gram)
-        try:
-            overlap_prop_q = len(q_n_grams.intersection(a_n_grams))/len(q_n_grams)
-            overlap_prop_a = len(a_n_grams.intersection(q_n_grams))/len(a_n_grams)
-        except:
-            overlap_prop_q = float(0)
-            overlap_prop_a = float(0)
-        n_gram_overlaps.append((overlap_prop_q, overlap_prop_a))
-    n_gram_overlaps = np.asarray(n_gram_overlaps).flatten()
-    return n_gram_overlaps
+def hash_n_grams(
+                 token_ids:np.ndarray,
+                 seq_lengths:np.ndarray,
+                 max_n_gram:int=4,
+):
+    """
+        - hash the n-grams of all (concatenated) sequences into dense integer IDs at once (n-grams are identified by the position of their first token)
+        - returns a list of ID arrays (one per n-gram order), where -1 denotes positions at which no n-gram starts (i.e., n-gram would cross the sequence boundary)
+    """
+    vocab_size = max(int(token_ids.max()) + 1, 1) if token_ids.size > 0 else 1
+    tokens_left = np.repeat(np.cumsum(seq_lengths), seq_lengths) - np.arange(len(token_ids))
+    n_gram_ids = [token_ids]
+    for n_gram in range(2, max_n_gram+1):
+        start_positions = np.flatnonzero(tokens_left >= n_gram)
+        #an n-gram consists of the (n-1)-gram starting at the same position and the token at position n-1
+        _, ids = np.unique(n_gram_ids[-1][start_positions] * vocab_size + token_ids[start_positions + n_gram - 1], return_inverse=True)
+        current_ids = np.full(len(token_ids), -1, dtype=np.int64)
+        current_ids[start_positions] = ids.reshape(-1)
+        n_gram_ids.append(current_ids)
+        vocab_size = max(len(token_ids), 1)
+    return n_gram_ids
+
+def compute_bleu(
+                 p_numerators:list,
+                 p_denominators:list,
+                 ref_len:int,
+                 hyp_len:int,
+                 weights:tuple=(0.25, 0.25, 0.25, 0.25),
+):
+    """
+        - sentence-level BLEU score for a single reference without smoothing (equivalent to nltk's sentence_bleu with SmoothingFunction().method0)
+        - p_numerators and p_denominators denote clipped n-gram matches and number of hypothesis n-grams per n-gram order
+    """
+    #there won't be any higher order n-gram matches, if there are no unigram matches
+    if p_numerators[0] == 0:
+        return 0
+
+    if hyp_len > ref_len:
+        bp = 1
+    elif hyp_len == 0:
+        bp = 0
+    else:
+        bp = math.exp(1 - ref_len / hyp_len)
+
+    #NOTE: precision scores of n-gram orders without any matches are set to sys.float_info.min (as in nltk)
+    p_n = [p_num / p_denom if p_num != 0 else sys.float_info.min for p_num, p_denom in zip(p_numerators, p_denominators)]
+    return bp * math.exp(math.fsum(w_i * math.log(p_i) for w_i, p_i in zip(weights, p_n)))
+
+def compute_n_gram_features(
+                            questions:list,
+                            a_candidates:list,
+                            weights:tuple=(0.25, 0.25, 0.25, 0.25),
+                            max_overlap_n_gram:int=3,
+):
+    """
+        - compute BLEU score (q serves as the reference and a_pred as the hypothesis) and n-gram overlaps between q and a_pred for all examples in one batched call
+        - n-grams are hashed into integer IDs once per sequence s.t. overlaps and clipped counts are computed with set operations on int arrays
+        - returns feature matrix of shape N x (1 + 2 * max_overlap_n_gram) (i.e., BLEU score followed by (overlap_prop_q, overlap_prop_a) per n-gram order)
+    """
+    N = len(questions)
+    max_n_gram = max(len(weights), max_overlap_n_gram)
+    X = np.zeros((N, 1 + 2 * max_overlap_n_gram))
+
+    #encode questions (first N sequences) and candidate answers (last N sequences) w.r.t. a single vocabulary
+    vocab = {}
+    sequences = list(questions) + list(a_candidates)
+    token_ids = np.array([vocab.setdefault(token, len(vocab)) for seq in sequences for token in seq], dtype=np.int64)
+    seq_lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    q_lengths, a_lengths = seq_lengths[:N], seq_lengths[N:]
+    is_question = np.repeat(np.arange(2*N) < N, seq_lengths)
+    example_indices = np.repeat(np.arange(2*N) % N, seq_lengths)
+
+    p_numerators = np.zeros((N, max_n_gram), dtype=np.int64)
+    p_denominators = np.zeros((N, max_n_gram), dtype=np.int64)
+
+    for n, n_gram_ids in enumerate(hash_n_grams(token_ids, seq_lengths, max_n_gram)):
+        #unique (example, n-gram) keys and their counts for questions and candidate answers respectively
+        n_ids = max(int(n_gram_ids.max()) + 1, 1) if n_gram_ids.size > 0 else 1
+        keys = example_indices * n_ids + n_gram_ids
+        q_keys, q_counts = np.unique(keys[is_question & (n_gram_ids >= 0)], return_counts=True)
+        a_keys, a_counts = np.unique(keys[~is_question & (n_gram_ids >= 0)], return_counts=True)
+        common_keys, q_idx, a_idx = np.intersect1d(q_keys, a_keys, assume_unique=True, return_indices=True)
+
+        #clip hypothesis n-gram counts by reference n-gram counts
+        p_numerators[:, n] = np.bincount(common_keys // n_ids, weights=np.minimum(q_counts[q_idx], a_counts[a_idx]), minlength=N)
+        p_denominators[:, n] = np.maximum(1, a_lengths - n)
+
+        if n < max_overlap_n_gram:
+            n_overlaps = np.bincount(common_keys // n_ids, minlength=N)
+            n_q_n_grams = np.bincount(q_keys // n_ids, minlength=N)
+            n_a_n_grams = np.bincount(a_keys // n_ids, minlength=N)
+            has_n_grams = (n_q_n_grams > 0) & (n_a_n_grams > 0)
+            X[has_n_grams, 1 + 2*n] = n_overlaps[has_n_grams] / n_q_n_grams[has_n_grams]
+            X[has_n_grams, 2 + 2*n] = n_overlaps[has_n_grams] / n_a_n_grams[has_n_grams]
+
+    for i, (p_nums, p_denoms, q_len, a_len) in enumerate(zip(p_numerators[:, :len(weights)].tolist(), p_denominators[:, :len(weights)].tolist(), q_lengths.tolist(), a_lengths.tolist())):
+        X[i, 0] = compute_bleu(p_nums, p_denoms, ref_len=q_len, hyp_len=a_len, weights=weights)
+    return X
+
+def get_pred_order(pred_indices:np.ndarray):
+    #example indices in ascending order (i.e., the order in which examples appear in the data set)
+    pred_indices = np.asarray(pred_indices)
+    return pred_indices[np.argsort(pred_indices, kind='stable')]
 
 def compute_baseline_features(
-                              feat_reps:dict,
-                              sent_pairs:list,
+                              store:HiddenRepStore,
                               pred_indices:list,
-                              s_log_probs:np.ndarray,
-                              e_log_probs:np.ndarray,
                               last_layer:str='Layer_6',
                               method:str='heuristic',
 ):
     N = len(pred_indices)
     M = 9 #ans_length, cos_sim, bleu_score, n_gram_overlaps
-    D = 768
-    X = np.zeros((N, M)) if method == 'heuristic' else np.zeros((N, 2*D))
-    for i, sent_pair in enumerate(sent_pairs):
-        if i in pred_indices:
-            sent_pair = sent_pair.strip().split()
-            sep_idx = sent_pair.index('[SEP]')
-            q = sent_pair[1:sep_idx]
-            #extract hidden reps for question and candidate answer
-            hiddens = np.asarray(feat_reps[last_layer][i])
-            q_hiddens = hiddens[1:sep_idx]
-            q_mean_rep = q_hiddens.mean(axis=0)
-            s_pos = np.argmax(s_log_probs[i])
-            e_pos = np.argmax(e_log_probs[i])
-            a_hiddens = hiddens[s_pos:e_pos+1]
-
-            try:
-                a_mean_rep = a_hiddens.mean(axis=0)
-            except:
-                a_mean_rep = np.zeros(D)
-
-            if method == 'heuristic':
-                #compute cos sim between avg q_hidden and avg a_pred_hidden
-                cos_sim = cosine_sim(q_mean_rep, a_mean_rep)
-                cos_sim = 0 if np.isnan(cos_sim) else cos_sim
-
-                #compute length of a_pred
-                a_candidate = sent_pair[s_pos:e_pos+1]
-                a_candidate_len = len(a_candidate)
-
-                #compute BLEU score, where q serves as the reference and a_pred as the hypothesis (i.e., translation)
-                try:
-                    bleu_score = sentence_bleu([q], a_candidate)
-                except ZeroDivisionError:
-                    bleu_score = sentence_bleu([q], a_candidate, weights=(0.5, 0.5))
-                except:
-                    bleu_score = 0 
-
-                #compute n_gram overlaps between q and a_pred
-                n_gram_overlaps = compute_n_gram_overlap(q, a_candidate) if a_candidate_len > 0 else np.zeros(6)
-
-                #concatenate features
-                X[i] += np.concatenate((np.array([a_candidate_len, cos_sim, bleu_score]), n_gram_overlaps))
-
-            else:
-                #concat hiddens w.r.t. q and a_pred
-                X[i] += np.concatenate((q_mean_rep, a_mean_rep))
+    #iterate over pred_indices directly (instead of testing membership for every example in the data set)
+    pred_order = get_pred_order(pred_indices)
+    #mean hidden reps w.r.t. q and a_pred are cached in the store (i.e., computed only once across analyses)
+    q_mean_reps = store.question_means(last_layer, pred_order)
+    a_mean_reps = store.answer_means(last_layer, pred_order)
+
+    if method != 'heuristic':
+        #concat hiddens w.r.t. q and a_pred
+        return np.hstack((q_mean_reps, a_mean_reps))
+
+    X = np.zeros((N, M))
+    s_positions, e_positions = store.pred_spans
+    questions, a_candidates = [], []
+    for k, i in enumerate(pred_order):
+        sent_pair = store.tokenized_sent_pairs[i]
+        q = sent_pair[1:store.sep_indices[i]]
+
+        #compute cos sim between avg q_hidden and avg a_pred_hidden
+        cos_sim = cosine_sim(q_mean_reps[k], a_mean_reps[k])
+        cos_sim = 0 if np.isnan(cos_sim) else cos_sim
+
+        #compute length of a_pred
+        a_candidate = sent_pair[s_positions[i]:e_positions[i]+1]
+        a_candidate_len = len(a_candidate)
+
+        #BLEU score and n-gram overlaps are computed for all examples at once (see below)
+        questions.append(q)
+        a_candidates.append(a_candidate)
+
+        X[k, :2] += np.array([a_candidate_len, cos_sim])
+
+    #compute BLEU score, where q serves as the reference and a_pred as the hypothesis (i.e., translation), and n-gram overlaps between q and a_pred
+    X[:, 2:] += compute_n_gram_features(questions, a_candidates)
     return X
 
+def sample_hidden_reps(
+                       hiddens_all_sents:list,
+                       sent_indices:np.ndarray,
+                       n_samples:int,
+                       rnd_state:int=42,
+):
+    #draw a random sample of token hidden reps (sentences are drawn at random until n_samples tokens are collected)
+    rng = np.random.RandomState(rnd_state)
+    sampled_hiddens = []
+    n_tokens = 0
+    for i in rng.permutation(sent_indices):
+        sampled_hiddens.append(np.asarray(hiddens_all_sents[i]))
+        n_tokens += sampled_hiddens[-1].shape[0]
+        if n_tokens >= n_samples:
+            break
+    sampled_hiddens = np.vstack(sampled_hiddens)
+    return sampled_hiddens[rng.permutation(sampled_hiddens.shape[0])[:n_samples]]
+
+def get_global_pca(
+                   hiddens_all_sents:list,
+                   sent_indices:np.ndarray,
+                   source:str,
+                   version:str,
+                   layer:str,
+                   pca_solver:str='full',
+                   pca_components:int=64,
+                   n_samples:int=50000,
+                   retained_var:float=.95,
+                   rnd_state:int=42,
+):
+    """
+        - fit a single PCA per layer on a random sample of token hidden reps from the *train* split and persist it (at test time, the stored PCA is loaded)
+        - PCA is always refitted (and overwritten) at train time s.t. a basis fitted on hidden reps of a previous model (or with different parameters) is never reused
+        - pca_solver must be one of {full, randomized, incremental}; for randomized and incremental PCA, the number of components must be fixed
+    """
+    PATH = './results_hidden_reps/' + source.lower() + '/pca'
+    file_name = '/' + layer + '_' + pca_solver + '.joblib'
+
+    if version != 'train':
+        assert os.path.exists(PATH + file_name), 'Global PCA must be fitted on the train split before it can be applied to the test split'
+        return load(PATH + file_name)
+
+    hiddens = sample_hidden_reps(hiddens_all_sents, sent_indices, n_samples, rnd_state)
+    pca_components = min(pca_components, hiddens.shape[1])
+    if pca_solver == 'full':
+        pca = PCA(n_components=retained_var, svd_solver='full', random_state=rnd_state).fit(hiddens)
+    elif pca_solver == 'randomized':
+        pca = PCA(n_components=pca_components, svd_solver='randomized', random_state=rnd_state).fit(hiddens)
+    elif pca_solver == 'incremental':
+        pca = IncrementalPCA(n_components=pca_components, batch_size=max(pca_components, 5000)).fit(hiddens)
+    else:
+        raise ValueError('PCA solver must be one of {full, randomized, incremental}')
+
+    if not os.path.exists(PATH):
+        os.makedirs(PATH)
+    dump(pca, PATH + file_name)
+    return pca
+
+def transform_hiddens(
+                      pca,
+                      hiddens_per_sent:list,
+):
+    #transform the hidden reps of all sentences with a single matrix multiplication and split them back into sentences
+    hiddens_per_sent = [np.asarray(hiddens) for hiddens in hiddens_per_sent]
+    sent_lengths = np.cumsum([hiddens.shape[0] for hiddens in hiddens_per_sent])[:-1]
+    return np.split(pca.transform(np.vstack(hiddens_per_sent)), sent_lengths)
+
 def compute_similarities_across_layers(
-                                       feat_reps:dict,
-                                       true_start_pos:list,
-                                       true_end_pos:list,
-                                       sent_pairs:list,
+                                       store:HiddenRepStore,
                                        pred_indices:list,
                                        true_preds:np.ndarray,
-                                       s_log_probs:np.ndarray,
-                                       e_log_probs:np.ndarray,
                                        source:str,
                                        version:str,
                                        top_k:int=10,
                                        layers=None,
+                                       global_pca:bool=False,
+                                       pca_solver:str='full',
 ):
     retained_var = .95 #retain 90% or 95% of the hidden rep's variance
     rnd_state = 42 #set random state for reproducibility
@@ -676,64 +1000,84 @@ def compute_similarities_across_layers(
     j = 0 #running idx to update X_i for each l in L_est
 
     #initialise PCA (we need to apply PCA to remove noise from the high-dimensional feature representations)
+    #NOTE: if global_pca, a single PCA is fitted per layer (instead of for every sentence) s.t. all sentences share the same basis
     pca = PCA(n_components=retained_var, svd_solver='auto', random_state=rnd_state)
 
     if version == 'train':
         correct_preds_cosines_per_layer = []
         incorrect_preds_cosines_per_layer = []
     
-    for l, hiddens_all_sents in feat_reps.items():
+    #enumerate top-k candidate answer spans for all examples at once (instead of per example and layer)
+    if source.lower() == 'squad':
+        s_candidates, e_candidates = top_k_valid_spans(store.s_log_probs[pred_indices], store.e_log_probs[pred_indices], top_k)
+
+    #precompute position map once s.t. every layer iterates over pred_indices directly (in ascending order of example indices)
+    pred_order = np.argsort(pred_indices, kind='stable')
+
+    for l in store.layers:
         correct_preds_cosines = []
         incorrect_preds_cosines = []
         layer_no = int(l.lstrip('Layer' + '_'))
-        k = 0
-        for i, hiddens in enumerate(hiddens_all_sents):
-            if i in pred_indices:
-                hiddens = np.asarray(hiddens)
-                sent = sent_pairs[i].strip().split()
-                sep_idx = sent.index('[SEP]')
-
-                #remove hidden reps corresponding to special [CLS] and [SEP] tokens
-                #hiddens = np.vstack((hiddens[1:sep_idx], hiddens[sep_idx+1:-1])) 
-                
-                #transform hidden reps with PCA
-                hiddens = pca.fit_transform(hiddens)
-
-                if layer_no == 1 and i == pred_indices[0]:
-                    print("==============================================================")
-                    print("=== Number of components in transformed hidden reps: {} ===".format(hiddens.shape[1]))
-                    print("==============================================================")
-                    print()
-
-                elif layer_no > 3:
-                #TODO: the if statement below is just a work-around for now (must be fixed properly later)
-                    if source.lower() == 'squad':
-                        cos_similarities_preds = compute_cos_sim_across_logits(
-                                                                               hiddens=hiddens,
-                                                                               s_log_probs=s_log_probs[i],
-                                                                               e_log_probs=e_log_probs[i],
-                                                                               cos_similarities_preds=cos_similarities_preds,
-                                                                               true_pred=bool(true_preds[pred_indices == i]),
-                                                                               layer=l,
-                                                                               top_k=top_k,
-                                                                               )
-
-                #extract hidden reps for answer span
-                #a_hiddens = hiddens[true_start_pos[i]-2:true_end_pos[i]-1] #move ans span indices two positions to the left (accounting for the removal of [CLS] and [SEP])
-                a_hiddens = hiddens[true_start_pos[i]:true_end_pos[i]+1]
-
-                #compute cos(h_a)
-                _, _, a_mean_cos, a_std_cos = compute_ans_similarities(a_hiddens)
-
-                if layer_no in est_layers:
-                    X[k, M*j:M*j+M] += np.array([a_mean_cos, a_std_cos])
+
+        if global_pca:
+            layer_pca = get_global_pca(
+                                       hiddens_all_sents=store.split(l),
+                                       sent_indices=pred_indices,
+                                       source=source,
+                                       version=version,
+                                       layer=l,
+                                       pca_solver=pca_solver,
+                                       retained_var=retained_var,
+                                       rnd_state=rnd_state,
+                                       )
+            hiddens_per_sent = transform_hiddens(layer_pca, store.split(l, pred_indices[pred_order]))
+
+        for k, pos in enumerate(pred_order):
+            i = pred_indices[pos]
+            true_pred = true_preds[pos]
+            sep_idx = store.sep_indices[i]
+
+            #remove hidden reps corresponding to special [CLS] and [SEP] tokens
+            #hiddens = np.vstack((hiddens[1:sep_idx], hiddens[sep_idx+1:-1])) 
             
-                if true_preds[pred_indices == i] == 1:
-                    correct_preds_cosines.append((a_mean_cos, a_std_cos))
-                else:
-                    incorrect_preds_cosines.append((a_mean_cos, a_std_cos))
+            #transform hidden reps with PCA
+            if global_pca:
+                hiddens = hiddens_per_sent[k]
+            else:
+                hiddens = pca.fit_transform(store.get(l, i))
+
+            if layer_no == 1 and k == 0:
+                print("==============================================================")
+                print("=== Number of components in transformed hidden reps: {} ===".format(hiddens.shape[1]))
+                print("==============================================================")
+                print()
+
+            elif layer_no > 3:
+            #TODO: the if statement below is just a work-around for now (must be fixed properly later)
+                if source.lower() == 'squad':
+                    cos_similarities_preds = compute_cos_sim_across_logits(
+                                                                           hiddens=hiddens,
+                                                                           s_candidates=s_candidates[pos],
+                                                                           e_candidates=e_candidates[pos],
+                                                                           cos_similarities_preds=cos_similarities_preds,
+                                                                           true_pred=bool(true_pred),
+                                                                           layer=l,
+                                                                           )
+
+            #extract hidden reps for answer span
+            #a_hiddens = hiddens[true_start_pos[i]-2:true_end_pos[i]-1] #move ans span indices two positions to the left (accounting for the removal of [CLS] and [SEP])
+            a_hiddens = hiddens[store.true_start_pos[i]:store.true_end_pos[i]+1]
+
+            #compute cos(h_a)
+            _, _, a_mean_cos, a_std_cos = compute_ans_similarities(a_hiddens)
 
-                k += 1
+            if layer_no in est_layers:
+                X[k, M*j:M*j+M] += np.array([a_mean_cos, a_std_cos])
+        
+            if true_pred == 1:
+                correct_preds_cosines.append((a_mean_cos, a_std_cos))
+            else:
+                incorrect_preds_cosines.append((a_mean_cos, a_std_cos))
 
         if version == 'train':
             #store mean cos(h_a) and std cos(h_a) distributions for every transformer layer to compute *train* CDFs
@@ -823,27 +1167,21 @@ def compute_similarities_across_layers(
 
     return ans_similarities, cos_similarities_preds, X
 
-def evaluate_estimations_and_cosines(
-                                     test_results:dict,
-                                     source:str,
-                                     version:str,
-                                     prediction:str,
-                                     model_dir=None,
-                                     n_epochs=None,
-                                     batch_size=None,
-                                     layers=None,
-                                     w_strategy=None,
-                                     computation=None,
-                                     rnd_seed=None,
+def compute_hidden_rep_features(
+                                store:HiddenRepStore,
+                                source:str,
+                                version:str,
+                                prediction:str='learned',
+                                layers=None,
+                                global_pca:bool=False,
+                                pca_solver:str='full',
 ):
-    pred_answers = test_results['predicted_answers']
-    true_answers = test_results['true_answers']
-    true_start_pos = np.asarray(test_results['true_start_pos'])
-    true_end_pos = np.asarray(test_results['true_end_pos'])
-    s_log_probs = np.asarray(test_results['start_log_probs'])
-    e_log_probs = np.asarray(test_results['end_log_probs'])
-    sent_pairs = test_results['sent_pairs']
-    feat_reps = test_results['feat_reps']
+    """
+        - compute labels and feature matrices that do not depend on the random seed or on the computation (i.e., cos(h_a) and baseline features)
+        - these must be computed only once and can be shared across all (random seed x computation) runs
+    """
+    pred_answers = store.predicted_answers
+    true_answers = store.true_answers
     true_preds, pred_indices = [], []
     
     print("=============================================")
@@ -862,24 +1200,71 @@ def evaluate_estimations_and_cosines(
             pred_indices.append(i)
     
     assert len(true_preds) == len(pred_indices)
-    pred_indices = np.asarray(pred_indices)
-    true_preds = np.asarray(true_preds)
+    features = {}
+    features['pred_indices'] = np.asarray(pred_indices)
+    features['true_preds'] = np.asarray(true_preds)
+
+    if prediction == 'learned':
+        features['ans_similarities'], features['cos_similarities_preds'], features['X_cos'] = compute_similarities_across_layers(
+                                                                                                                               store=store,
+                                                                                                                               pred_indices=features['pred_indices'],
+                                                                                                                               true_preds=features['true_preds'],
+                                                                                                                               source=source,
+                                                                                                                               version=version,
+                                                                                                                               layers=layers,
+                                                                                                                               global_pca=global_pca,
+                                                                                                                               pca_solver=pca_solver,
+                                                                                                                               )
+
+        features['X_baseline'] = compute_baseline_features(
+                                                           store=store,
+                                                           pred_indices=features['pred_indices'],
+                                                           method='heuristic',
+                                                           )
+    return features
+
+def evaluate_estimations_and_cosines(
+                                     store:HiddenRepStore,
+                                     source:str,
+                                     version:str,
+                                     prediction:str,
+                                     model_dir=None,
+                                     n_epochs=None,
+                                     batch_size=None,
+                                     layers=None,
+                                     w_strategy=None,
+                                     computation=None,
+                                     rnd_seed=None,
+                                     global_pca:bool=False,
+                                     pca_solver:str='full',
+                                     features=None,
+                                     save_incorrect_preds:bool=True,
+):
+    pred_answers = store.predicted_answers
+    true_answers = store.true_answers
+    sent_pairs = store.sent_pairs
+
+    #NOTE: seed-independent features might have been computed beforehand (see compute_hidden_rep_features)
+    if isinstance(features, type(None)):
+        features = compute_hidden_rep_features(
+                                               store=store,
+                                               source=source,
+                                               version=version,
+                                               prediction=prediction,
+                                               layers=layers,
+                                               global_pca=global_pca,
+                                               pca_solver=pca_solver,
+                                               )
+    pred_indices = features['pred_indices']
+    true_preds = features['true_preds']
     y = true_preds
 
     if prediction == 'learned':
-        ans_similarities, cos_similarities_preds, X_cos = compute_similarities_across_layers(
-                                                                                            feat_reps=feat_reps,
-                                                                                            true_start_pos=true_start_pos,
-                                                                                            true_end_pos=true_end_pos,
-                                                                                            sent_pairs=sent_pairs,
-                                                                                            pred_indices=pred_indices,
-                                                                                            true_preds=true_preds,
-                                                                                            s_log_probs=s_log_probs,
-                                                                                            e_log_probs=e_log_probs,
-                                                                                            source=source,
-                                                                                            version=version,
-                                                                                            layers=layers,
-                                                                                            )
+        ans_similarities = features['ans_similarities']
+        cos_similarities_preds = features['cos_similarities_preds']
+        #copy cached feature matrices since they might be modified in place (e.g., computation == 'weighting')
+        X_cos = features['X_cos'].copy()
+        X_baseline = features['X_baseline'].copy()
 
         if computation in ['concat', 'weighting']:
             #interpolate values wrt to *train* CDFs
@@ -897,26 +1282,14 @@ def evaluate_estimations_and_cosines(
 
         #elif re.search(r'baseline', computation):
         #    X = compute_baseline_features(
-        #                                  feat_reps=feat_reps,
-        #                                  sent_pairs=sent_pairs,
+        #                                  store=store,
         #                                  pred_indices=pred_indices,
-        #                                  s_log_probs=s_log_probs,
-        #                                  e_log_probs=e_log_probs,
         #                                  method='qa_concat' if re.search(r'concat', computation) else 'heuristic',
         #                                  )
         #    model_name = 'fc_nn' + '_' + computation + str(rnd_seed)
         else:
             model_name = 'fc_nn' + '_' + computation + '_' + 'heuristic' + '_'  + str(rnd_seed)
 
-        X_baseline = compute_baseline_features(
-                                              feat_reps=feat_reps,
-                                              sent_pairs=sent_pairs,
-                                              pred_indices=pred_indices,
-                                              s_log_probs=s_log_probs,
-                                              e_log_probs=e_log_probs,
-                                              method='heuristic',
-                                              )
-
         if re.search(r'baseline', computation):
             X = X_baseline
             model_name = 'fc_nn' + '_' + computation + str(rnd_seed)
@@ -939,6 +1312,10 @@ def evaluate_estimations_and_cosines(
             """
             y_distribution = Counter(y)
             y_weights = torch.tensor(y_distribution[0]/y_distribution[1], dtype=torch.float)
+            #NOTE: seed immediately before model init s.t. weight init and shuffling only depend on rnd_seed (independent of the worker process and of random draws during feature computation)
+            #this changes the random streams w.r.t. runs before the sweep, where features were computed after seeding (i.e., previous models are not reproduced bit by bit)
+            if not isinstance(rnd_seed, type(None)):
+                set_rnd_seed(rnd_seed)
             model = FFNN(in_size=M)
             model.to(device)
             losses, f1_scores, model = train(model=model, train_dl=dl, version=version, n_epochs=n_epochs, batch_size=batch_size, y_weights=y_weights)
@@ -974,20 +1351,23 @@ def evaluate_estimations_and_cosines(
             model_name =  "".join(filter(lambda char: not char.isdigit(), model_name)).rstrip('_')
             PATH = './incorrect_predictions/' + source.lower() + '/' + model_name + '/'
 
-            if not os.path.exists(PATH):
-                os.makedirs(PATH)
+            #NOTE: PATH does not depend on rnd_seed, hence sequential runs overwrote the same files for every seed (i.e., the files of the last seed were kept)
+            #the caller stores incorrect predictions exclusively for the last seed, which yields the same files and avoids concurrent writes if runs are performed in parallel
+            if save_incorrect_preds:
+                if not os.path.exists(PATH):
+                    os.makedirs(PATH)
 
-            with open(PATH + 'question_answers.txt', 'wb') as f:
-                np.save(f, qas)
+                with open(PATH + 'question_answers.txt', 'wb') as f:
+                    np.save(f, qas)
 
-            with open(PATH + 'ans_span_preds.txt', 'wb') as f:
-                np.save(f, pred_answers)
+                with open(PATH + 'ans_span_preds.txt', 'wb') as f:
+                    np.save(f, pred_answers)
 
-            with open(PATH + 'features.txt', 'wb') as f:
-                np.save(f, X)
+                with open(PATH + 'features.txt', 'wb') as f:
+                    np.save(f, X)
 
-            with open(PATH + 'labels.txt', 'wb') as f:
-                np.save(f, y)
+                with open(PATH + 'labels.txt', 'wb') as f:
+                    np.save(f, y)
 
             return ans_similarities, cos_similarities_preds, test_f1, test_acc, len(true_preds)
     else:
@@ -999,6 +1379,36 @@ def evaluate_estimations_and_cosines(
         acc = (y == y_hat).mean()    
         return f1_score(y_true=y, y_pred=y_hat, average='macro'), acc 
 
+#state shared by all (random seed x computation) runs of a sweep (set once per worker process)
+SHARED_STATE = {}
+
+def init_sweep(
+               store:HiddenRepStore,
+               features:dict,
+               n_threads=None,
+):
+    SHARED_STATE['store'] = store
+    SHARED_STATE['features'] = features
+    #avoid oversubscription if several runs are performed in parallel
+    if isinstance(n_threads, int):
+        torch.set_num_threads(n_threads)
+
+def set_rnd_seed(rnd_seed:int):
+    np.random.seed(rnd_seed)
+    torch.manual_seed(rnd_seed)
+    try:
+        torch.cuda.manual_seed_all(rnd_seed)
+    except:
+        pass
+
+def run_sweep(run:dict):
+    #every run is seeded with its own seed right before model initialisation (see evaluate_estimations_and_cosines)
+    return evaluate_estimations_and_cosines(
+                                            store=SHARED_STATE['store'],
+                                            features=SHARED_STATE['features'],
+                                            **run,
+                                            )
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--source', type=str, default='SubjQA',
@@ -1017,10 +1427,19 @@ if __name__ == "__main__":
         help='Must be one of {all_layers, top_three_layers}.')
     parser.add_argument('--w_strategy', type=str, default='',
         help='Must be one of {distance, cdf, oracle}.')
+    parser.add_argument('--global_pca', action='store_true',
+        help='If provided, fit a single PCA per layer on the train split (instead of a separate PCA for every sentence).')
+    parser.add_argument('--pca_solver', type=str, default='full',
+        help='Must be one of {full, randomized, incremental}. Only used if --global_pca is provided.')
+    parser.add_argument('--workers', type=int, default=1,
+        help='Number of worker processes across which (random seed x computation) runs are distributed.')
     
     args = parser.parse_args()
     #get hidden representations
     results, file_name = get_hidden_reps(source=args.source, version=args.version)
+    #convert hidden reps once (they are not required for majority predictions) and release the raw JSON results
+    store = HiddenRepStore(results, load_layers=None if args.prediction == 'learned' else [])
+    del results
     #set NumPy random seed for reproducibility of results
     np.random.seed(42)
     
@@ -1030,37 +1449,60 @@ if __name__ == "__main__":
         rnd_seeds = np.random.randint(0, 100, 5)
         computations = ['raw', 'concat', 'weighting', 'baseline_heuristic'] if args.w_strategy == 'distance' else ['concat', 'weighting']
 
+        if args.version == 'train':
+            assert isinstance(args.n_epochs, int), 'Number of epochs must be defined in train mode'
+            
+            if not os.path.exists(args.model_dir):
+                os.makedirs(args.model_dir)
+
+        #cos(h_a) and baseline features neither depend on the random seed nor on the computation (compute them once under the first random seed)
+        np.random.seed(rnd_seeds[0])
+        features = compute_hidden_rep_features(
+                                               store=store,
+                                               source=args.source,
+                                               version=args.version,
+                                               layers=args.layers,
+                                               global_pca=args.global_pca,
+                                               pca_solver=args.pca_solver,
+                                               )
+        #runs only need answers and sent pairs (hidden reps are not required anymore)
+        store.drop_hiddens()
+
+        runs = []
         for computation in computations:
-            hidden_reps_results = {}
-            #perform computations for different random seeds (results might vary as a function of random seeds due to different initialisations)
             for k, rnd_seed in enumerate(rnd_seeds):
-                np.random.seed(rnd_seed)
-                torch.manual_seed(rnd_seed)
+                run = dict(
+                           source=args.source,
+                           prediction=args.prediction,
+                           version=args.version,
+                           model_dir=args.model_dir,
+                           batch_size=args.batch_size,
+                           layers=args.layers,
+                           w_strategy=args.w_strategy,
+                           computation=computation,
+                           rnd_seed=int(rnd_seed),
+                           #NOTE: as for sequential runs (which overwrote the files of previous seeds), incorrect predictions of the last random seed are stored
+                           save_incorrect_preds=k == len(rnd_seeds) - 1,
+                           )
+                if args.version == 'train':
+                    run['n_epochs'] = args.n_epochs
+                runs.append(run)
 
-                try:
-                    torch.cuda.manual_seed_all(rnd_seed)
-                except:
-                    pass
-            
+        if args.workers > 1:
+            #NOTE: spawn (instead of fork) worker processes, since CUDA cannot be re-initialised in forked processes
+            with multiprocessing.get_context('spawn').Pool(args.workers, initializer=init_sweep, initargs=(store, features, 1)) as pool:
+                run_results = pool.map(run_sweep, runs)
+        else:
+            init_sweep(store, features)
+            run_results = list(map(run_sweep, runs))
+
+        #merge results of all runs (in the same order as for sequential runs)
+        for c, computation in enumerate(computations):
+            hidden_reps_results = {}
+            for k, rnd_seed in enumerate(rnd_seeds):
+                run_result = run_results[c * len(rnd_seeds) + k]
                 if args.version == 'train':
-                    assert isinstance(args.n_epochs, int), 'Number of epochs must be defined in train mode'
-                    
-                    if not os.path.exists(args.model_dir):
-                        os.makedirs(args.model_dir)
-                    
-                    ans_similarities, cos_similarities_preds, losses, f1_scores, n_examples = evaluate_estimations_and_cosines(
-                                                                                                                                test_results=results,
-                                                                                                                                source=args.source,
-                                                                                                                                prediction=args.prediction,
-                                                                                                                                version=args.version,
-                                                                                                                                model_dir=args.model_dir,
-                                                                                                                                batch_size=args.batch_size,
-                                                                                                                                n_epochs=args.n_epochs,
-                                                                                                                                layers=args.layers,
-                                                                                                                                w_strategy=args.w_strategy,
-                                                                                                                                computation=computation,
-                                                                                                                                rnd_seed=rnd_seed,
-                                                                                                                                )
+                    ans_similarities, cos_similarities_preds, losses, f1_scores, n_examples = run_result
                     """
                     try:
                         hidden_reps_results['train_f1'] += train_f1
@@ -1076,18 +1518,7 @@ if __name__ == "__main__":
                         hidden_reps_results['train_f1s'] = [f1_scores]
 
                 else:
-                    ans_similarities, cos_similarities_preds, test_f1, test_acc, n_examples = evaluate_estimations_and_cosines(
-                                                                                                                             test_results=results,
-                                                                                                                             source=args.source, 
-                                                                                                                             prediction=args.prediction,
-                                                                                                                             version=args.version,
-                                                                                                                             model_dir=args.model_dir,
-                                                                                                                             batch_size=args.batch_size,
-                                                                                                                             layers=args.layers,
-                                                                                                                             w_strategy=args.w_strategy,
-                                                                                                                             computation=computation,
-                                                                                                                             rnd_seed=rnd_seed,
-                                                                                                                             )
+                    ans_similarities, cos_similarities_preds, test_f1, test_acc, n_examples = run_result
                     try:
                         hidden_reps_results['test_f1'] += test_f1
                         hidden_reps_results['test_acc'] += test_acc
@@ -1119,7 +1550,7 @@ if __name__ == "__main__":
     elif args.prediction == 'majority':
         hidden_reps_results = {}
         hidden_reps_results['f1_score'],  hidden_reps_results['acc']= evaluate_estimations_and_cosines(
-                                                                                                       test_results=results,
+                                                                                                       store=store,
                                                                                                        source=args.source,
                                                                                                        prediction=args.prediction, 
                                                                                                        version=args.version,
@@ -6,15 +6,23 @@ __all__ = [
            'compute_exact',
            'compute_f1',
            'get_raw_scores',
+           'get_raw_scores_parallel',
+           'iter_articles',
+           'iter_raw_scores',
            'apply_no_ans_threshold',
            'make_eval_dict',
            'merge_eval',
            'plot_pr_curve',
+           'sort_qids_by_na_prob',
            'make_precision_recall_eval',
            'run_precision_recall_analysis',
            'histogram_na_prob',
            'find_best_thresh',
            'find_all_best_thresh',
+           'resample_means',
+           'bootstrap_ci',
+           'paired_bootstrap_test',
+           'make_bootstrap_eval',
 ]
             
 
@@ -29,6 +37,7 @@ that a question is unanswerable.
 import argparse
 import collections
 import json
+import multiprocessing
 import numpy as np
 import os
 import re
@@ -49,6 +58,16 @@ def parse_args():
                       help='Predict "" if no-answer probability exceeds this (default = 1.0).')
   parser.add_argument('--out-image-dir', '-p', metavar='out_images', default=None,
                       help='Save precision-recall curves to directory.')
+  parser.add_argument('--workers', '-w', type=int, default=1,
+                      help='Evaluate chunks of articles in this many worker processes (default = 1).')
+  parser.add_argument('--chunk-size', type=int, default=20,
+                      help='Number of articles per chunk (default = 20).')
+  parser.add_argument('--bootstrap', '-b', type=int, default=0,
+                      help='Compute bootstrap confidence intervals with this many resamples (default = 0, i.e. none).')
+  parser.add_argument('--compare-pred-file', metavar='pred_b.json', default=None,
+                      help='Paired bootstrap test of the model predictions against these predictions.')
+  parser.add_argument('--compare-na-prob-file', metavar='na_prob_b.json', default=None,
+                      help='Model estimates of probability of no answer for --compare-pred-file.')
   parser.add_argument('--verbose', '-v', action='store_true')
   if len(sys.argv) == 1:
     parser.print_help()
@@ -63,16 +82,18 @@ def make_qid_to_has_ans(dataset):
         qid_to_has_ans[qa['id']] = bool(qa['answers'])
   return qid_to_has_ans
 
+# compile regex and punctuation table once (instead of for every answer)
+ARTICLES_REGEX = re.compile(r'\b(a|an|the)\b', re.UNICODE)
+PUNCT_TABLE = str.maketrans('', '', string.punctuation)
+
 def normalize_answer(s):
   """Lower text and remove punctuation, articles and extra whitespace."""
   def remove_articles(text):
-    regex = re.compile(r'\b(a|an|the)\b', re.UNICODE)
-    return re.sub(regex, ' ', text)
+    return ARTICLES_REGEX.sub(' ', text)
   def white_space_fix(text):
     return ' '.join(text.split())
   def remove_punc(text):
-    exclude = set(string.punctuation)
-    return ''.join(ch for ch in text if ch not in exclude)
+    return text.translate(PUNCT_TABLE)
   def lower(text):
     return text.lower()
   return white_space_fix(remove_articles(remove_punc(lower(s))))
@@ -81,6 +102,26 @@ def get_tokens(s):
   if not s: return []
   return normalize_answer(s).split()
 
+def get_normalized_answer(s):
+  """Normalize and tokenize an answer once, returning (normalized answer, tokens, token counts)."""
+  normalized = normalize_answer(s)
+  toks = normalized.split() if s else []
+  return normalized, toks, collections.Counter(toks)
+
+def compute_f1_from_tokens(gold, pred):
+  _, gold_toks, gold_counts = gold
+  _, pred_toks, pred_counts = pred
+  if len(gold_toks) == 0 or len(pred_toks) == 0:
+    # If either is no-answer, then F1 is 1 if they agree, 0 otherwise
+    return int(gold_toks == pred_toks)
+  num_same = sum((gold_counts & pred_counts).values())
+  if num_same == 0:
+    return 0
+  precision = 1.0 * num_same / len(pred_toks)
+  recall = 1.0 * num_same / len(gold_toks)
+  f1 = (2 * precision * recall) / (precision + recall)
+  return f1
+
 def compute_exact(a_gold, a_pred):
   return int(normalize_answer(a_gold) == normalize_answer(a_pred))
 
@@ -99,27 +140,163 @@ def compute_f1(a_gold, a_pred):
   f1 = (2 * precision * recall) / (precision + recall)
   return f1
 
-def get_raw_scores(dataset, preds):
-  exact_scores = {}
-  f1_scores = {}
+def iter_raw_scores(dataset, preds):
+  """Yield (qid, exact, f1) for every question in a single pass.
+
+  Each gold and predicted answer is normalized and tokenized exactly once and
+  nothing but the current question is kept in memory.
+  """
   for article in dataset:
     for p in article['paragraphs']:
       for qa in p['qas']:
         qid = qa['id']
-        gold_answers = [a['text'] for a in qa['answers']
-                        if normalize_answer(a['text'])]
+        # duplicate gold answers do not change the max over all gold answers
+        gold_answers = collections.OrderedDict()
+        for a in qa['answers']:
+          if a['text'] not in gold_answers:
+            gold_answers[a['text']] = get_normalized_answer(a['text'])
+        gold_answers = [gold for gold in gold_answers.values() if gold[0]]
         if not gold_answers:
           # For unanswerable questions, only correct answer is empty string
-          gold_answers = ['']
+          gold_answers = [get_normalized_answer('')]
         if qid not in preds:
           print('Missing prediction for %s' % qid)
           continue
-        a_pred = preds[qid]
+        a_pred = get_normalized_answer(preds[qid])
         # Take max over all gold answers
-        exact_scores[qid] = max(compute_exact(a, a_pred) for a in gold_answers)
-        f1_scores[qid] = max(compute_f1(a, a_pred) for a in gold_answers)
+        yield (qid,
+               max(int(gold[0] == a_pred[0]) for gold in gold_answers),
+               max(compute_f1_from_tokens(gold, a_pred) for gold in gold_answers))
+
+def get_raw_scores(dataset, preds):
+  exact_scores = {}
+  f1_scores = {}
+  for qid, exact, f1 in iter_raw_scores(dataset, preds):
+    exact_scores[qid] = exact
+    f1_scores[qid] = f1
   return exact_scores, f1_scores
 
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+class JSONStream(object):
+  """Buffered reader that decodes one JSON value at a time via raw_decode.
+
+  The file is read in blocks; a block is appended to the buffer only if the
+  value at the current position is incomplete, and decoded input is dropped
+  from the buffer, hence memory is bounded by the largest single value (i.e.,
+  article) instead of the size of the file.
+  """
+
+  def __init__(self, f, block_size=1 << 16):
+    self.f = f
+    self.block_size = block_size
+    self.decoder = json.JSONDecoder()
+    self.buf = ''
+    self.idx = 0
+    self.eof = False
+
+  def read(self, n_chars):
+    block = self.f.read(n_chars)
+    self.eof = not block
+    # drop decoded input before extending the buffer
+    self.buf = self.buf[self.idx:] + block
+    self.idx = 0
+    return not self.eof
+
+  def peek(self):
+    """Skip whitespace and return the next character ('' at the end of the file)."""
+    while True:
+      self.idx = WHITESPACE.match(self.buf, self.idx).end()
+      if self.idx < len(self.buf) or not self.read(self.block_size):
+        return self.buf[self.idx:self.idx + 1]
+
+  def expect(self, delimiter):
+    if self.peek() != delimiter:
+      raise ValueError('Expected %r at position %d of the buffered JSON input' % (delimiter, self.idx))
+    self.idx += 1
+
+  def decode(self):
+    self.peek()
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.buf, self.idx)
+        # a number at the end of the buffer may be truncated
+        if end < len(self.buf) or self.eof:
+          self.idx = end
+          return value
+      except ValueError:
+        if self.eof:
+          raise
+      # grow geometrically s.t. a large value is not decoded (and rejected) once per block
+      self.read(max(self.block_size, len(self.buf) - self.idx))
+
+def iter_articles(data_file, block_size=1 << 16):
+  """Decode the articles of a SQuAD data file one at a time.
+
+  The file is read incrementally and only the article that is currently
+  decoded is kept as a Python object (instead of the entire 'data' list as
+  with json.load).
+  """
+  with open(data_file) as f:
+    stream = JSONStream(f, block_size)
+    stream.expect('{')
+    while stream.peek() != '}':
+      key = stream.decode()
+      stream.expect(':')
+      if key == 'data':
+        stream.expect('[')
+        while stream.peek() != ']':
+          yield stream.decode()
+          if stream.peek() == ',':
+            stream.expect(',')
+        stream.expect(']')
+      else:
+        # skip any other top-level entry (e.g., version)
+        stream.decode()
+      if stream.peek() == ',':
+        stream.expect(',')
+
+def iter_chunks(articles, preds, chunk_size):
+  """Group articles into chunks together with the predictions for their questions."""
+  chunk = []
+  for article in articles:
+    chunk.append(article)
+    if len(chunk) == chunk_size:
+      yield chunk, get_chunk_preds(chunk, preds)
+      chunk = []
+  if chunk:
+    yield chunk, get_chunk_preds(chunk, preds)
+
+def get_chunk_preds(chunk, preds):
+  # send only those predictions to a worker that are needed for its chunk
+  return {qa['id']: preds[qa['id']] for article in chunk for p in article['paragraphs']
+          for qa in p['qas'] if qa['id'] in preds}
+
+def score_chunk(args):
+  chunk, preds = args
+  exact_scores, f1_scores = get_raw_scores(chunk, preds)
+  return make_qid_to_has_ans(chunk), exact_scores, f1_scores
+
+def merge_chunk_scores(scored_chunks):
+  qid_to_has_ans = {}
+  exact_scores = {}
+  f1_scores = {}
+  for qid_to_has_ans_chunk, exact_chunk, f1_chunk in scored_chunks:
+    qid_to_has_ans.update(qid_to_has_ans_chunk)
+    exact_scores.update(exact_chunk)
+    f1_scores.update(f1_chunk)
+  return qid_to_has_ans, exact_scores, f1_scores
+
+def get_raw_scores_parallel(data_file, preds, workers, chunk_size=20):
+  """Compute raw scores for chunks of articles in a process pool.
+
+  Chunks are merged in the order of the data file, hence exact_raw, f1_raw and
+  qid_to_has_ans are identical to the ones computed by a single process.
+  """
+  chunks = iter_chunks(iter_articles(data_file), preds, chunk_size)
+  with multiprocessing.Pool(workers) as pool:
+    return merge_chunk_scores(pool.imap(score_chunk, chunks))
+
 def apply_no_ans_threshold(scores, na_probs, qid_to_has_ans, na_prob_thresh):
   new_scores = {}
   for qid, s in scores.items():
@@ -161,52 +338,67 @@ def plot_pr_curve(precisions, recalls, out_image, title):
   plt.savefig(out_image)
   plt.clf()
 
+def sort_qids_by_na_prob(na_probs):
+  """Sort qids by no-answer probability (stable, i.e., as sorted(na_probs, key=...))."""
+  qid_list = list(na_probs)
+  order = np.argsort(np.array([na_probs[k] for k in qid_list], dtype=np.float64), kind='stable')
+  return [qid_list[i] for i in order]
+
+def compute_precision_recall(score_rows, has_ans, sorted_probs, num_true_pos):
+  """Compute precision-recall curves and AP for several score rows in one pass.
+
+  score_rows is an (n_scores x n_qids) array sorted by no-answer probability.
+  All sums are accumulated sequentially via np.cumsum and hence are identical
+  to summing in a Python loop.
+  """
+  true_pos = np.cumsum(np.where(has_ans, score_rows, 0.0), axis=1)
+  cur_p = true_pos / np.arange(1, score_rows.shape[1] + 1, dtype=np.float64)
+  cur_r = true_pos / float(num_true_pos)
+  # i.e., if we can put a threshold after this point
+  is_thresh = np.append(sorted_probs[:-1] != sorted_probs[1:], True)
+  precisions = cur_p[:, is_thresh]
+  recalls = cur_r[:, is_thresh]
+  prev_recalls = np.concatenate((np.zeros((recalls.shape[0], 1)), recalls[:, :-1]), axis=1)
+  avg_precs = np.cumsum(precisions * (recalls - prev_recalls), axis=1)[:, -1]
+  return avg_precs, precisions, recalls
+
 def make_precision_recall_eval(scores, na_probs, num_true_pos, qid_to_has_ans,
-                               out_image=None, title=None):
-  qid_list = sorted(na_probs, key=lambda k: na_probs[k])
-  true_pos = 0.0
-  cur_p = 1.0
-  cur_r = 0.0
-  precisions = [1.0]
-  recalls = [0.0]
-  avg_prec = 0.0
-  for i, qid in enumerate(qid_list):
-    if qid_to_has_ans[qid]:
-      true_pos += scores[qid]
-    cur_p = true_pos / float(i+1)
-    cur_r = true_pos / float(num_true_pos)
-    if i == len(qid_list) - 1 or na_probs[qid] != na_probs[qid_list[i+1]]:
-      # i.e., if we can put a threshold after this point
-      avg_prec += cur_p * (cur_r - recalls[-1])
-      precisions.append(cur_p)
-      recalls.append(cur_r)
+                               out_image=None, title=None, qid_list=None):
+  if qid_list is None:
+    qid_list = sort_qids_by_na_prob(na_probs)
+  has_ans = np.array([qid_to_has_ans[k] for k in qid_list], dtype=bool)
+  score_row = np.array([[scores[k] if qid_to_has_ans[k] else 0.0 for k in qid_list]], dtype=np.float64)
+  sorted_probs = np.array([na_probs[k] for k in qid_list], dtype=np.float64)
+  avg_precs, precisions, recalls = compute_precision_recall(score_row, has_ans, sorted_probs,
+                                                            num_true_pos)
   if out_image:
-    plot_pr_curve(precisions, recalls, out_image, title)
-  return {'ap': 100.0 * avg_prec}
+    plot_pr_curve([1.0] + precisions[0].tolist(), [0.0] + recalls[0].tolist(), out_image, title)
+  return {'ap': 100.0 * float(avg_precs[0])}
 
 def run_precision_recall_analysis(main_eval, exact_raw, f1_raw, na_probs, 
-                                  qid_to_has_ans, out_image_dir):
+                                  qid_to_has_ans, out_image_dir, qid_list=None):
   if out_image_dir and not os.path.exists(out_image_dir):
     os.makedirs(out_image_dir)
   num_true_pos = sum(1 for v in qid_to_has_ans.values() if v)
   if num_true_pos == 0:
     return
-  pr_exact = make_precision_recall_eval(
-      exact_raw, na_probs, num_true_pos, qid_to_has_ans,
-      out_image=os.path.join(out_image_dir, 'pr_exact.png'),
-      title='Precision-Recall curve for Exact Match score')
-  pr_f1 = make_precision_recall_eval(
-      f1_raw, na_probs, num_true_pos, qid_to_has_ans,
-      out_image=os.path.join(out_image_dir, 'pr_f1.png'),
-      title='Precision-Recall curve for F1 score')
-  oracle_scores = {k: float(v) for k, v in qid_to_has_ans.items()}
-  pr_oracle = make_precision_recall_eval(
-      oracle_scores, na_probs, num_true_pos, qid_to_has_ans,
-      out_image=os.path.join(out_image_dir, 'pr_oracle.png'),
-      title='Oracle Precision-Recall curve (binary task of HasAns vs. NoAns)')
-  merge_eval(main_eval, pr_exact, 'pr_exact')
-  merge_eval(main_eval, pr_f1, 'pr_f1')
-  merge_eval(main_eval, pr_oracle, 'pr_oracle')
+  # sort once and evaluate EM, F1 and oracle scores in a single vectorized pass
+  if qid_list is None:
+    qid_list = sort_qids_by_na_prob(na_probs)
+  has_ans = np.array([qid_to_has_ans[k] for k in qid_list], dtype=bool)
+  score_rows = np.array([[exact_raw[k] if v else 0.0 for k, v in zip(qid_list, has_ans)],
+                         [f1_raw[k] if v else 0.0 for k, v in zip(qid_list, has_ans)],
+                         has_ans.tolist()], dtype=np.float64)
+  sorted_probs = np.array([na_probs[k] for k in qid_list], dtype=np.float64)
+  avg_precs, precisions, recalls = compute_precision_recall(score_rows, has_ans, sorted_probs,
+                                                            num_true_pos)
+  curves = [('pr_exact', 'Precision-Recall curve for Exact Match score'),
+            ('pr_f1', 'Precision-Recall curve for F1 score'),
+            ('pr_oracle', 'Oracle Precision-Recall curve (binary task of HasAns vs. NoAns)')]
+  for i, (name, title) in enumerate(curves):
+    plot_pr_curve([1.0] + precisions[i].tolist(), [0.0] + recalls[i].tolist(),
+                  os.path.join(out_image_dir, '%s.png' % name), title)
+    merge_eval(main_eval, {'ap': 100.0 * float(avg_precs[i])}, name)
 
 def histogram_na_prob(na_probs, qid_list, image_dir, name):
   if not qid_list:
@@ -220,39 +412,109 @@ def histogram_na_prob(na_probs, qid_list, image_dir, name):
   plt.savefig(os.path.join(image_dir, 'na_prob_hist_%s.png' % name))
   plt.clf()
 
-def find_best_thresh(preds, scores, na_probs, qid_to_has_ans):
-  num_no_ans = sum(1 for k in qid_to_has_ans if not qid_to_has_ans[k])
-  cur_score = num_no_ans
-  best_score = cur_score
-  best_thresh = 0.0
-  qid_list = sorted(na_probs, key=lambda k: na_probs[k])
-  for i, qid in enumerate(qid_list):
-    if qid not in scores: continue
-    if qid_to_has_ans[qid]:
-      diff = scores[qid]
+def compute_best_thresh(score_rows, qid_list, na_probs, num_no_ans):
+  """Find the best no-answer threshold for several score rows in one pass.
+
+  score_rows is an (n_scores x n_qids) array of per-qid score differences sorted
+  by no-answer probability. The running score is accumulated sequentially
+  (starting from num_no_ans) and the first maximum is used, as in a Python loop.
+  """
+  start = np.full((score_rows.shape[0], 1), num_no_ans, dtype=np.float64)
+  cur_scores = np.cumsum(np.concatenate((start, score_rows), axis=1), axis=1)[:, 1:]
+  results = []
+  for cur_score in cur_scores:
+    best_idx = int(np.argmax(cur_score)) if cur_score.size else -1
+    if best_idx >= 0 and cur_score[best_idx] > num_no_ans:
+      results.append((float(cur_score[best_idx]), na_probs[qid_list[best_idx]]))
     else:
-      if preds[qid]:
-        diff = -1
-      else:
-        diff = 0
-    cur_score += diff
-    if cur_score > best_score:
-      best_score = cur_score
-      best_thresh = na_probs[qid]
+      results.append((num_no_ans, 0.0))
+  return results
+
+def get_thresh_diffs(preds, scores, qid_list, qid_to_has_ans):
+  return [scores[k] if qid_to_has_ans[k] else (-1 if preds[k] else 0) for k in qid_list]
+
+def find_best_thresh(preds, scores, na_probs, qid_to_has_ans, qid_list=None):
+  num_no_ans = sum(1 for k in qid_to_has_ans if not qid_to_has_ans[k])
+  if qid_list is None:
+    qid_list = sort_qids_by_na_prob(na_probs)
+  qid_list = [k for k in qid_list if k in scores]
+  score_rows = np.array([get_thresh_diffs(preds, scores, qid_list, qid_to_has_ans)],
+                        dtype=np.float64).reshape(1, len(qid_list))
+  best_score, best_thresh = compute_best_thresh(score_rows, qid_list, na_probs, num_no_ans)[0]
   return 100.0 * best_score / len(scores), best_thresh
 
-def find_all_best_thresh(main_eval, preds, exact_raw, f1_raw, na_probs, qid_to_has_ans):
-  best_exact, exact_thresh = find_best_thresh(preds, exact_raw, na_probs, qid_to_has_ans)
-  best_f1, f1_thresh = find_best_thresh(preds, f1_raw, na_probs, qid_to_has_ans)
-  main_eval['best_exact'] = best_exact
+def find_all_best_thresh(main_eval, preds, exact_raw, f1_raw, na_probs, qid_to_has_ans,
+                         qid_list=None):
+  # sort once and search for the best EM and F1 thresholds in a single vectorized pass
+  num_no_ans = sum(1 for k in qid_to_has_ans if not qid_to_has_ans[k])
+  if qid_list is None:
+    qid_list = sort_qids_by_na_prob(na_probs)
+  qid_list = [k for k in qid_list if k in exact_raw]
+  score_rows = np.array([get_thresh_diffs(preds, exact_raw, qid_list, qid_to_has_ans),
+                         get_thresh_diffs(preds, f1_raw, qid_list, qid_to_has_ans)],
+                        dtype=np.float64).reshape(2, len(qid_list))
+  (best_exact, exact_thresh), (best_f1, f1_thresh) = compute_best_thresh(score_rows, qid_list,
+                                                                          na_probs, num_no_ans)
+  main_eval['best_exact'] = 100.0 * best_exact / len(exact_raw)
   main_eval['best_exact_thresh'] = exact_thresh
-  main_eval['best_f1'] = best_f1
+  main_eval['best_f1'] = 100.0 * best_f1 / len(f1_raw)
   main_eval['best_f1_thresh'] = f1_thresh
 
+def resample_means(scores, n_resamples=10000, seed=42, chunk_size=1000):
+  """Means of bootstrap samples, drawn via index resampling over a per-question score array.
+
+  Indices are drawn for chunks of resamples at once s.t. memory stays bounded
+  (chunk_size x number of questions indices).
+  """
+  scores = np.asarray(scores, dtype=np.float64)
+  rng = np.random.RandomState(seed)
+  means = np.empty(n_resamples, dtype=np.float64)
+  for start in range(0, n_resamples, chunk_size):
+    stop = min(start + chunk_size, n_resamples)
+    idx = rng.randint(0, scores.shape[0], size=(stop - start, scores.shape[0]))
+    means[start:stop] = scores[idx].mean(axis=1)
+  return means
+
+def bootstrap_ci(scores, n_resamples=10000, alpha=0.05, seed=42):
+  """Mean and percentile bootstrap confidence interval of per-question scores."""
+  means = resample_means(scores, n_resamples, seed)
+  lower, upper = np.percentile(means, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+  return float(np.mean(scores)), float(lower), float(upper)
+
+def paired_bootstrap_test(scores_a, scores_b, n_resamples=10000, alpha=0.05, seed=42):
+  """Paired bootstrap test for the difference between two models on the same questions.
+
+  The p-value is two-sided and computed under the null hypothesis of no
+  difference, i.e. w.r.t. the bootstrap distribution shifted by the observed delta.
+  """
+  diffs = np.asarray(scores_a, dtype=np.float64) - np.asarray(scores_b, dtype=np.float64)
+  delta = np.mean(diffs)
+  means = resample_means(diffs, n_resamples, seed)
+  lower, upper = np.percentile(means, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+  p_value = np.mean(np.abs(means - delta) >= np.abs(delta))
+  return {'delta': float(delta), 'ci': [float(lower), float(upper)], 'p_value': float(p_value)}
+
+def make_bootstrap_eval(exact_scores, f1_scores, n_resamples, qid_list=None):
+  if not qid_list:
+    qid_list = list(exact_scores)
+  bootstrap_eval = collections.OrderedDict()
+  for name, scores in [('exact', exact_scores), ('f1', f1_scores)]:
+    _, lower, upper = bootstrap_ci([100.0 * scores[k] for k in qid_list], n_resamples)
+    bootstrap_eval['%s_ci' % name] = [lower, upper]
+  return bootstrap_eval
+
+def load_raw_scores(data_file, preds, workers=1, chunk_size=20):
+  """Score the predictions against the data file, which is decoded article by article.
+
+  Predictions (and no-answer probabilities) map question ids to short strings
+  (floats) and are loaded as a whole.
+  """
+  if workers > 1:
+    return get_raw_scores_parallel(data_file, preds, workers, chunk_size)
+  chunks = iter_chunks(iter_articles(data_file), preds, chunk_size)
+  return merge_chunk_scores(map(score_chunk, chunks))
+
 def main():
-  with open(OPTS.data_file) as f:
-    dataset_json = json.load(f)
-    dataset = dataset_json['data']
   with open(OPTS.pred_file) as f:
     preds = json.load(f)
   if OPTS.na_prob_file:
@@ -260,10 +522,10 @@ def main():
       na_probs = json.load(f)
   else:
     na_probs = {k: 0.0 for k in preds}
-  qid_to_has_ans = make_qid_to_has_ans(dataset)  # maps qid to True/False
+  qid_to_has_ans, exact_raw, f1_raw = load_raw_scores(OPTS.data_file, preds,
+                                                       OPTS.workers, OPTS.chunk_size)
   has_ans_qids = [k for k, v in qid_to_has_ans.items() if v]
   no_ans_qids = [k for k, v in qid_to_has_ans.items() if not v]
-  exact_raw, f1_raw = get_raw_scores(dataset, preds)
   exact_thresh = apply_no_ans_threshold(exact_raw, na_probs, qid_to_has_ans,
                                         OPTS.na_prob_thresh)
   f1_thresh = apply_no_ans_threshold(f1_raw, na_probs, qid_to_has_ans,
@@ -275,11 +537,42 @@ def main():
   if no_ans_qids:
     no_ans_eval = make_eval_dict(exact_thresh, f1_thresh, qid_list=no_ans_qids)
     merge_eval(out_eval, no_ans_eval, 'NoAns')
+  if OPTS.bootstrap > 0:
+    out_eval.update(make_bootstrap_eval(exact_thresh, f1_thresh, OPTS.bootstrap))
+    if has_ans_qids:
+      has_ans_ci = make_bootstrap_eval(exact_thresh, f1_thresh, OPTS.bootstrap, qid_list=has_ans_qids)
+      merge_eval(out_eval, has_ans_ci, 'HasAns')
+    if no_ans_qids:
+      no_ans_ci = make_bootstrap_eval(exact_thresh, f1_thresh, OPTS.bootstrap, qid_list=no_ans_qids)
+      merge_eval(out_eval, no_ans_ci, 'NoAns')
+  if OPTS.compare_pred_file:
+    with open(OPTS.compare_pred_file) as f:
+      preds_b = json.load(f)
+    if OPTS.compare_na_prob_file:
+      with open(OPTS.compare_na_prob_file) as f:
+        na_probs_b = json.load(f)
+    else:
+      na_probs_b = {k: 0.0 for k in preds_b}
+    _, exact_raw_b, f1_raw_b = load_raw_scores(OPTS.data_file, preds_b, OPTS.workers, OPTS.chunk_size)
+    # both models must be scored with the same rule (i.e., no-answer threshold) on the same questions
+    exact_thresh_b = apply_no_ans_threshold(exact_raw_b, na_probs_b, qid_to_has_ans,
+                                            OPTS.na_prob_thresh)
+    f1_thresh_b = apply_no_ans_threshold(f1_raw_b, na_probs_b, qid_to_has_ans,
+                                         OPTS.na_prob_thresh)
+    assert set(exact_thresh) == set(exact_thresh_b), \
+        'Both prediction files must cover the same questions for a paired test'
+    qid_list = list(exact_thresh)
+    for name, scores_a, scores_b in [('exact', exact_thresh, exact_thresh_b), ('f1', f1_thresh, f1_thresh_b)]:
+      out_eval['paired_%s' % name] = paired_bootstrap_test(
+          [100.0 * scores_a[k] for k in qid_list], [100.0 * scores_b[k] for k in qid_list],
+          n_resamples=OPTS.bootstrap or 10000)
   if OPTS.na_prob_file:
-    find_all_best_thresh(out_eval, preds, exact_raw, f1_raw, na_probs, qid_to_has_ans)
+    qid_list = sort_qids_by_na_prob(na_probs)  # sort only once
+    find_all_best_thresh(out_eval, preds, exact_raw, f1_raw, na_probs, qid_to_has_ans,
+                         qid_list=qid_list)
   if OPTS.na_prob_file and OPTS.out_image_dir:
     run_precision_recall_analysis(out_eval, exact_raw, f1_raw, na_probs, 
-                                  qid_to_has_ans, OPTS.out_image_dir)
+                                  qid_to_has_ans, OPTS.out_image_dir, qid_list=qid_list)
     histogram_na_prob(na_probs, has_ans_qids, OPTS.out_image_dir, 'hasAns')
     histogram_na_prob(na_probs, no_ans_qids, OPTS.out_image_dir, 'noAns')
   if OPTS.out_file:
@@ -19,6 +19,8 @@ from transformers import get_linear_schedule_with_warmup
 
 from eval_squad import *
 from models.QAModels import *
+from models.export import *
+from models.inference import *
 from models.utils import *
 from utils import *
 
@@ -35,6 +37,12 @@ if __name__ == '__main__':
             help='If train, then train model on train set(s); if test, then evaluate model on SubjQA test set.')
     parser.add_argument('--n_evals', type=str, default='multiple_per_epoch',
             help='Define number of evaluations during training. If "multiple_per_epoch", ten evals per epoch. If "one_per_epoch", once after a training epoch.')
+    parser.add_argument('--eval_every_secs', type=float, default=0.,
+            help='If > 0, evaluate model every n seconds of training instead of ten times per epoch. Only necessary, if "multiple_per_epoch".')
+    parser.add_argument('--val_subsample', type=int, default=0,
+            help='If > 0, frequent evaluations are performed on a fixed random subsample of n dev examples (full dev set evaluations decide whether model is saved). Only necessary, if "multiple_per_epoch".')
+    parser.add_argument('--full_eval_every', type=int, default=10,
+            help='If --val_subsample > 0, every n-th evaluation is performed on the full dev set.')
     parser.add_argument('--sbj_classification', action='store_true',
             help='If provided, perform subjectivity classification (binary) instead of QA.')
     parser.add_argument('--multi_qa_type_class', action='store_true',
@@ -63,6 +71,12 @@ if __name__ == '__main__':
             help='Define number of auxiliary tasks QA model should perform during training. Only necessary, if MTL setting.')
     parser.add_argument('--task_sampling', type=str, default='uniform',
             help='If "uniform", main and auxiliary tasks will be sampled uniformly. If "oversampling", main task will be oversampled. Only necessary, if MTL setting.')
+    parser.add_argument('--task_temperature', type=float, default=1.0,
+            help='Temperature T for task sampling (probabilities are raised to the power of 1/T). If T > 1, task distribution is flattened. Only necessary, if MTL setting.')
+    parser.add_argument('--anneal_task_sampling', action='store_true',
+            help='If provided, temperature for task sampling is linearly annealed to 1 across epochs. Only necessary, if MTL setting.')
+    parser.add_argument('--loss_based_task_weights', action='store_true',
+            help='If provided, task sampling probabilities are re-weighted w.r.t. the running training loss per task at the beginning of every epoch. Only necessary, if MTL setting.')
     parser.add_argument('--encoder', action='store_true',
             help='If provided, use BiLSTM encoder to compute temporal dependencies before returning feature representations to linear output layers.')
     parser.add_argument('--highway_connection', action='store_true',
@@ -87,6 +101,10 @@ if __name__ == '__main__':
             help='If provided, compute exact-match accuracies per (top k) interrogative word across all questions in the test set.')
     parser.add_argument('--detailed_results_domains', action='store_true',
             help='If provided, compute exact-match accuracies per review domain across all questions in the test set.')  
+    parser.add_argument('--n_bootstrap', type=int, default=0,
+            help='If > 0, compute bootstrap confidence intervals (with this many resamples) for the exact-match accuracies per question type or review domain.')
+    parser.add_argument('--conf_mat', action='store_true',
+            help='If provided, accumulate a confusion matrix during inference (Sbj_Classification or Domain_Classification only) and plot it.')
     parser.add_argument('--output_last_hiddens_cls', action='store_true',
             help='If provided, feature representations of [CLS] token at last layer will be stored for each input sequence in the test set.')
     parser.add_argument('--output_all_hiddens_cls', action='store_true',
@@ -103,6 +121,24 @@ if __name__ == '__main__':
             help='If provided, store erroneous answer span predictions at inference time and compute distribution w.r.t. the latter.')
     parser.add_argument('--error_analysis_simple', action='store_true',
             help='If provided, save predicted answers, gold answers, questions, and contexts')
+    parser.add_argument('--resume', action='store_true',
+            help='If provided, resume training from the latest checkpoint (i.e., model, optimizer, scheduler, task scheduler, RNG states and step counter).')
+    parser.add_argument('--checkpoint_every', type=int, default=0,
+            help='Store full training state every n training steps (checkpoints are written asynchronously). If 0, no checkpoints are stored.')
+    parser.add_argument('--keep_checkpoints', type=int, default=3,
+            help='Number of most recent checkpoints to retain.')
+    parser.add_argument('--benchmark_inference', action='store_true',
+            help='If provided, compare throughput of test against the dedicated inference engine (run with CUDA_VISIBLE_DEVICES="" to benchmark on CPU). Inference must be performed on QA.')
+    parser.add_argument('--jit', action='store_true',
+            help='If provided, compile the QA forward pass of the inference engine via torch.jit.trace.')
+    parser.add_argument('--quantize', action='store_true',
+            help='If provided, apply dynamic int8 quantization to all linear layers of the fine-tuned model, save the quantized checkpoint and report both EM/F1 delta and latency gain on CPU. Inference must be performed on QA.')
+    parser.add_argument('--onnx', action='store_true',
+            help='If provided, export the QA (and Sbj_Class) forward pass of the fine-tuned model to ONNX, check parity of logits and compare inference speed against PyTorch. Inference must be performed on QA.')
+    parser.add_argument('--onnx_atol', type=float, default=1e-4,
+            help='Tolerance for the max abs difference between PyTorch and ONNX logits. Exceeding it is reported, but does not abort inference.')
+    parser.add_argument('--aggregate_windows', action='store_true',
+            help='If provided, merge predictions across doc spans (windows) of the same review and compute exact-match and F1 per question (not per window). Inference must be performed on QA.')
     
     args = parser.parse_args()
     
@@ -831,6 +867,9 @@ if __name__ == '__main__':
         hypers["n_evals"] = args.n_evals
         hypers["batch_presentation"] = args.batches
         hypers["task_sampling"] = args.task_sampling
+        hypers["task_temperature"] = args.task_temperature
+        hypers["anneal_task_sampling"] = args.anneal_task_sampling
+        hypers["loss_based_task_weights"] = args.loss_based_task_weights
         hypers["mtl_setting"] = args.mtl_setting
         hypers["n_qa_type_labels"] = n_qa_type_labels
         hypers["n_domains"] = n_domain_labels
@@ -839,11 +878,17 @@ if __name__ == '__main__':
             hypers["n_evals_per_epoch"] = 10 #number of times we evaluate model on dev set per epoch (not necessary, if we just evaluate once after an epoch)
 
         hypers["early_stopping_thresh"] = 5 #if validation loss does not decrease for 5 evaluation steps (i.e., half an epoch), stop training early
+        hypers["eval_every_secs"] = args.eval_every_secs
+        hypers["val_subsample"] = args.val_subsample
+        hypers["full_eval_every"] = args.full_eval_every
         hypers["freeze_bert"] = freeze_bert
         hypers["pretrained_model"] = 'distilbert'
         hypers["model_dir"] = args.sd
         hypers["model_name"] = model_name
         hypers["dataset"] = args.finetuning
+        hypers["checkpoint_every"] = args.checkpoint_every
+        hypers["keep_checkpoints"] = args.keep_checkpoints
+        hypers["resume"] = args.resume
         
         if args.sequential_transfer:
             hypers["task"] = ''
@@ -1184,6 +1229,8 @@ if __name__ == '__main__':
 
                 squad_tensor_dataset_test = create_tensor_dataset(squad_features_test)
 
+                examples_test, features_test = squad_examples_test, squad_features_test
+
                 tensor_dataset_test = squad_tensor_dataset_test
 
             else:
@@ -1217,6 +1264,8 @@ if __name__ == '__main__':
                                                                     dataset_to_idx=dataset_to_idx,
                 )
 
+                examples_test, features_test = subjqa_examples_test, subjqa_features_test
+
                 if args.detailed_analysis_sbj_class or (args.multi_qa_type_class and args.sbj_classification) or (args.dataset_agnostic and (args.output_last_hiddens_cls or args.output_all_hiddens_cls)):
 
                     squad_data_train = get_data(
@@ -1247,6 +1296,9 @@ if __name__ == '__main__':
                                                                      dataset_to_idx=dataset_to_idx,
                                                                      )
 
+                    # example indexes of SubjQA and SQuAD features overlap, hence spans cannot be merged per question
+                    examples_test, features_test = None, None
+
                     subjqa_features_test.extend(squad_features_dev)
 
                     # make sure that examples from SQuAD are not just at the end of the dataset (i.e., last mini-batches)
@@ -1266,6 +1318,10 @@ if __name__ == '__main__':
                                                                         )                                                
                 tensor_dataset_test = subjqa_tensor_dataset_test
 
+            if args.aggregate_windows:
+                assert not isinstance(features_test, type(None)), 'Spans can only be merged per question, if test features are not shuffled'
+                assert not sort_batch, 'Spans can only be merged per question, if test features are presented sequentially'
+
             test_dl = BatchGenerator(
                                     dataset=tensor_dataset_test,
                                     batch_size=batch_size,
@@ -1321,7 +1377,47 @@ if __name__ == '__main__':
                 # move model to device
                 model.to(device)
 
-            if args.detailed_analysis_sbj_class:
+            if task == 'QA' and args.benchmark_inference:
+                test_loss, test_acc, test_f1, benchmark_results = benchmark_inference(
+                                                                                      model = model,
+                                                                                      tokenizer = bert_tokenizer,
+                                                                                      test_dl = test_dl,
+                                                                                      batch_size = batch_size,
+                                                                                      max_seq_length = max_seq_length,
+                                                                                      jit = args.jit,
+                                                                                      )
+            elif task == 'QA' and args.quantize:
+                q_model_path = args.sd + '/%s' % (model_name + '_int8')
+                # re-use the int8 checkpoint of a previous run (if there is one) instead of quantizing the fine-tuned model again
+                if os.path.exists(q_model_path):
+                    q_model = load_quantized_model(model, q_model_path)
+                else:
+                    q_model = quantize_model(model)
+                    save_quantized_model(q_model, q_model_path)
+                test_loss, test_acc, test_f1, quantization_results = evaluate_quantization(
+                                                                                           model = model,
+                                                                                           q_model = q_model,
+                                                                                           tokenizer = bert_tokenizer,
+                                                                                           test_dl = test_dl,
+                                                                                           batch_size = batch_size,
+                                                                                           max_seq_length = max_seq_length,
+                                                                                           )
+            elif task == 'QA' and args.onnx:
+                onnx_paths = export_to_onnx(
+                                            model = model,
+                                            model_path = args.sd + '/%s' % (model_name),
+                                            max_seq_length = max_seq_length,
+                                            sbj_class = args.multitask,
+                                            )
+                test_loss, test_acc, test_f1, onnx_results = compare_backends(
+                                                                              model = model,
+                                                                              tokenizer = bert_tokenizer,
+                                                                              test_dl = test_dl,
+                                                                              batch_size = batch_size,
+                                                                              onnx_paths = onnx_paths,
+                                                                              atol = args.onnx_atol,
+                                                                              )
+            elif args.detailed_analysis_sbj_class:
                 test_loss, test_acc, test_f1, results_per_ds = test(
                                                                     model = model,
                                                                     tokenizer = bert_tokenizer,
@@ -1376,6 +1472,7 @@ if __name__ == '__main__':
                                                                 sequential_transfer = args.sequential_transfer,
                                                                 inference_strategy = args.sequential_transfer_evaluation,
                                                                 detailed_results_sbj = args.detailed_results_sbj,
+                                                                n_bootstrap = args.n_bootstrap,
                                                                 )
 
             elif task == 'QA' and args.detailed_results_q_type:
@@ -1406,6 +1503,7 @@ if __name__ == '__main__':
                                                                         sequential_transfer = args.sequential_transfer,
                                                                         inference_strategy = args.sequential_transfer_evaluation,
                                                                         detailed_results_domains = args.detailed_results_domains,
+                                                                        n_bootstrap = args.n_bootstrap,
                                                                         )
             elif task == 'QA' and args.detailed_results_q_words:
                 test_loss, test_acc, test_f1, results_per_q_word = test(
@@ -1502,6 +1600,36 @@ if __name__ == '__main__':
                                                                                           output_all_hiddens_cls = args.output_all_hiddens_cls,
                                                                                           )
 
+            elif task in ['Sbj_Classification', 'Domain_Classification'] and args.conf_mat:
+                test_loss, test_acc, test_f1, conf_mat = test(
+                                                              model = model,
+                                                              tokenizer = bert_tokenizer,
+                                                              test_dl = test_dl,
+                                                              batch_size = batch_size,
+                                                              not_finetuned = args.not_finetuned,
+                                                              task = task,
+                                                              n_domains = n_domain_labels,
+                                                              input_sequence = 'question_answer' if args.batches == 'alternating' else 'question_context',
+                                                              sequential_transfer = args.sequential_transfer,
+                                                              inference_strategy = args.sequential_transfer_evaluation,
+                                                              multi_qa_type_class = args.multi_qa_type_class,
+                                                              output_conf_mat = args.conf_mat,
+                                                              )
+                # plotting dependencies are only required, if a confusion matrix is plotted
+                from plotting import plot_confusion_matrix
+                disp = plot_confusion_matrix(
+                                             y_pred = None,
+                                             y_true = None,
+                                             labels = np.arange(conf_mat.shape[0]),
+                                             display_labels = None,
+                                             custom_conf_mat = True,
+                                             normalize = False,
+                                             cm = conf_mat,
+                                             )
+                if not os.path.exists('./plots/conf_mats/'):
+                    os.makedirs('./plots/conf_mats/')
+                disp.figure_.savefig('./plots/conf_mats/' + model_name + '.png')
+
             else:
                 test_loss, test_acc, test_f1 = test(
                                                     model = model,
@@ -1514,6 +1642,8 @@ if __name__ == '__main__':
                                                     input_sequence = 'question_answer' if args.batches == 'alternating' else 'question_context',
                                                     sequential_transfer = args.sequential_transfer,
                                                     inference_strategy = args.sequential_transfer_evaluation,
+                                                    features = features_test if args.aggregate_windows else None,
+                                                    examples = examples_test if args.aggregate_windows else None,
                 )
             
             test_results = dict()
@@ -1521,7 +1651,16 @@ if __name__ == '__main__':
             test_results['test_acc'] = test_acc
             test_results['test_f1'] = test_f1
 
-            if args.detailed_analysis_sbj_class:
+            if task == 'QA' and args.benchmark_inference:
+                test_results['inference_benchmark'] = benchmark_results
+
+            elif task == 'QA' and args.quantize:
+                test_results['quantization'] = quantization_results
+
+            elif task == 'QA' and args.onnx:
+                test_results['onnx'] = onnx_results
+
+            elif args.detailed_analysis_sbj_class:
                 test_results['test_results_per_ds'] = results_per_ds
 
             elif args.error_analysis_simple:
@@ -1572,6 +1711,9 @@ if __name__ == '__main__':
                 test_results['predictions'] = predictions
                 test_results['true_labels'] = true_labels
                 test_results['feat_reps'] = feat_reps
+
+            elif task in ['Sbj_Classification', 'Domain_Classification'] and args.conf_mat:
+                test_results['conf_mat'] = conf_mat.tolist()
             
             with open('./results_test/' + model_name + '.json', 'w') as json_file:
                 json.dump(test_results, json_file)
\ No newline at end of file
@@ -0,0 +1,125 @@
+__all__ = [
+           'Checkpointer',
+           'get_rng_states',
+           'set_rng_states',
+           ]
+
+import numpy as np
+
+import os
+import random
+import re
+import threading
+import torch
+
+def get_rng_states():
+    rng_states = {}
+    rng_states['python'] = random.getstate()
+    rng_states['numpy'] = np.random.get_state()
+    rng_states['torch'] = torch.get_rng_state()
+    if torch.cuda.is_available():
+        rng_states['cuda'] = torch.cuda.get_rng_state_all()
+    return rng_states
+
+def set_rng_states(rng_states:dict):
+    random.setstate(rng_states['python'])
+    np.random.set_state(rng_states['numpy'])
+    torch.set_rng_state(rng_states['torch'])
+    if torch.cuda.is_available() and 'cuda' in rng_states:
+        torch.cuda.set_rng_state_all(rng_states['cuda'])
+
+def copy_to_cpu(state):
+    # copy (nested) state to CPU memory s.t. training can continue while the copy is written to disk
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    elif isinstance(state, dict):
+        return {k: copy_to_cpu(v) for k, v in state.items()}
+    elif isinstance(state, list):
+        return [copy_to_cpu(v) for v in state]
+    elif isinstance(state, tuple):
+        return tuple(copy_to_cpu(v) for v in state)
+    else:
+        return state
+
+class Checkpointer(object):
+    """
+        Periodically stores the full training state (model, optimizers, schedulers, task scheduler, RNG states, step counter and metrics).
+        Checkpoints are written on a separate thread and only the last K checkpoints are retained.
+    """
+
+    def __init__(
+                 self,
+                 model_dir:str,
+                 model_name:str,
+                 save_every:int,
+                 keep_last:int=3,
+                 resume:bool=False,
+    ):
+        self.checkpoint_dir = os.path.join(model_dir, 'checkpoints')
+        self.model_name = model_name
+        self.save_every = save_every
+        self.keep_last = keep_last
+        self.resume = resume
+        self.global_step = 0
+        self.thread = None
+
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+
+    def is_due(self):
+        self.global_step += 1
+        return self.save_every > 0 and self.global_step % self.save_every == 0
+
+    def get_checkpoints(self):
+        # sort checkpoints w.r.t. global step (ascending)
+        pattern = re.compile(r'^' + re.escape(self.model_name) + r'_step_([0-9]+)\.pt$')
+        checkpoints = [(int(match.group(1)), file_name) for file_name in os.listdir(self.checkpoint_dir) for match in [pattern.match(file_name)] if match]
+        return [os.path.join(self.checkpoint_dir, file_name) for _, file_name in sorted(checkpoints)]
+
+    def write(
+              self,
+              state:dict,
+              checkpoint_path:str,
+    ):
+        # write to temporary file first s.t. a preempted job never leaves a corrupted checkpoint behind
+        torch.save(state, checkpoint_path + '.tmp')
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+        for old_checkpoint in self.get_checkpoints()[:-self.keep_last]:
+            os.remove(old_checkpoint)
+
+    def save(
+             self,
+             state:dict,
+    ):
+        state = copy_to_cpu(state)
+        state['global_step'] = self.global_step
+        state['rng_states'] = get_rng_states()
+        checkpoint_path = os.path.join(self.checkpoint_dir, '{}_step_{}.pt'.format(self.model_name, self.global_step))
+        # wait for previous checkpoint to be written (at most one checkpoint is written at a time)
+        self.wait()
+        self.thread = threading.Thread(target=self.write, args=(state, checkpoint_path))
+        self.thread.start()
+
+    def wait(self):
+        if not isinstance(self.thread, type(None)):
+            self.thread.join()
+            self.thread = None
+
+    def load(self):
+        if not self.resume:
+            return None
+        checkpoints = self.get_checkpoints()
+        if len(checkpoints) == 0:
+            print("=======================================================")
+            print("===== No checkpoint found. Training from scratch. =====")
+            print("=======================================================")
+            print()
+            return None
+        state = torch.load(checkpoints[-1], map_location='cpu')
+        self.global_step = state['global_step']
+        #NOTE: RNG states are not restored here but right before the first resumed training step (via set_rng_states)
+        print("====================================================")
+        print("===== Resuming training from step {} =====".format(self.global_step))
+        print("====================================================")
+        print()
+        return state
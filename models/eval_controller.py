@@ -0,0 +1,129 @@
+__all__ = [
+           'EvalController',
+           ]
+
+import numpy as np
+
+import time
+import torch
+
+from torch.utils.data import TensorDataset
+
+from utils import BatchGenerator
+
+class EvalController(object):
+    """
+        Decides when a model is evaluated during training, on which data, whether its weights are saved and when training is stopped early.
+            - cadence: a check is due every check_every steps or, if check_every_secs > 0, every check_every_secs seconds of training (evaluation time is excluded)
+            - subsampling: if subsample_size > 0, checks are performed on a fixed random subsample of the dev set and only every full_eval_every-th check on the full dev set
+            - saving: only full evaluations decide whether a model is saved (i.e., new lowest loss on the full dev set)
+            - patience: training is stopped, if either the subsample or the full dev loss has not decreased for more than patience consecutive checks of the same kind (subsample and full losses are compared and counted separately)
+            - a full evaluation is pending, if no full evaluation was performed yet or if there were checks on the subsample since the last full evaluation (callers evaluate on the full dev set at the end of an epoch and before stopping early)
+    """
+
+    def __init__(
+                 self,
+                 check_every:int=0,
+                 check_every_secs:float=0.,
+                 subsample_size:int=0,
+                 full_eval_every:int=1,
+                 patience:int=None,
+                 min_delta:float=0.,
+                 min_epochs:int=1,
+                 seed:int=42,
+    ):
+        self.check_every = check_every
+        self.check_every_secs = check_every_secs
+        self.subsample_size = subsample_size
+        self.full_eval_every = max(full_eval_every, 1)
+        self.patience = patience
+        self.min_delta = min_delta
+        self.min_epochs = min_epochs
+        self.seed = seed
+        self.n_checks = 0
+        self.n_bad_checks = {'subsample': 0, 'full': 0}
+        self.n_checks_since_full = 0
+        self.best_losses = {}
+        self.full = True
+        self.subsamples = {}
+        self.last_check_time = time.perf_counter()
+
+    def is_due(
+               self,
+               step:int,
+    ):
+        if self.check_every_secs > 0:
+            due = time.perf_counter() - self.last_check_time >= self.check_every_secs
+        else:
+            due = self.check_every > 0 and step > 0 and step % self.check_every == 0
+        if due:
+            self.next_check()
+        return due
+
+    def next_check(
+                   self,
+                   full:bool=False,
+    ):
+        # checks at the end of an epoch (or of training) may enforce an evaluation on the full dev set
+        self.n_checks += 1
+        self.full = full or self.subsample_size == 0 or self.n_checks % self.full_eval_every == 0
+
+    def get_val_dl(self, val_dl):
+        if self.full:
+            return val_dl
+        # subsample is drawn once per dev set (i.e., the same examples are used for every check) and is a multiple of the mini-batch size
+        key = id(val_dl.dataset)
+        if key not in self.subsamples:
+            n_examples = len(val_dl.dataset)
+            subsample_size = min(max(self.subsample_size // val_dl.batch_size, 1) * val_dl.batch_size, n_examples)
+            indices = np.sort(np.random.RandomState(self.seed).choice(n_examples, size=subsample_size, replace=False))
+            self.subsamples[key] = BatchGenerator(
+                                                  dataset=TensorDataset(*val_dl.dataset[torch.from_numpy(indices)]),
+                                                  batch_size=val_dl.batch_size,
+                                                  sort_batch=val_dl.sort_batch,
+                                                  )
+        return self.subsamples[key]
+
+    def update(
+               self,
+               loss:float,
+    ):
+        # returns True, iff the loss on the full dev set has decreased (i.e., model weights should be saved)
+        kind = 'full' if self.full else 'subsample'
+        improved = kind not in self.best_losses or loss < self.best_losses[kind] - self.min_delta
+        if improved:
+            self.best_losses[kind] = loss
+            self.n_bad_checks[kind] = 0
+        else:
+            self.n_bad_checks[kind] += 1
+        self.n_checks_since_full = 0 if self.full else self.n_checks_since_full + 1
+        self.last_check_time = time.perf_counter()
+        return improved and self.full
+
+    def full_eval_pending(self):
+        return 'full' not in self.best_losses or self.n_checks_since_full > 0
+
+    def should_stop(
+                    self,
+                    epoch:int,
+    ):
+        # we want to train the model at least for min_epochs epochs
+        return not isinstance(self.patience, type(None)) and epoch >= self.min_epochs and max(self.n_bad_checks.values()) > self.patience
+
+    def state_dict(self):
+        return {
+                'n_checks': self.n_checks,
+                'n_bad_checks': dict(self.n_bad_checks),
+                'n_checks_since_full': self.n_checks_since_full,
+                'best_losses': dict(self.best_losses),
+                }
+
+    def load_state_dict(
+                        self,
+                        state:dict,
+    ):
+        self.n_checks = state['n_checks']
+        self.n_bad_checks = dict(state['n_bad_checks'])
+        self.n_checks_since_full = state['n_checks_since_full']
+        self.best_losses = dict(state['best_losses'])
+        self.last_check_time = time.perf_counter()
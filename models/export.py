@@ -0,0 +1,208 @@
+__all__ = [
+           'ONNXBackend',
+           'TorchBackend',
+           'check_logits_parity',
+           'compare_backends',
+           'export_to_onnx',
+           ]
+
+import numpy as np
+import torch.nn as nn
+
+import random
+import time
+import torch
+
+from itertools import islice
+
+from models.inference import QAForward, inference_mode
+from models.utils import test, to_cpu
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# set random seeds to reproduce results
+np.random.seed(42)
+random.seed(42)
+torch.manual_seed(42)
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+class SbjForward(nn.Module):
+    """
+        Sbj_Class path of DistilBertForQA (i.e., subjectivity logits w.r.t. answer and question).
+    """
+
+    def __init__(
+                 self,
+                 model,
+    ):
+        super(SbjForward, self).__init__()
+        self.model = model
+
+    def forward(
+                self,
+                input_ids:torch.Tensor,
+                attention_masks:torch.Tensor,
+    ):
+        return self.model(
+                          input_ids=input_ids,
+                          attention_masks=attention_masks,
+                          token_type_ids=None,
+                          task='Sbj_Class',
+                          )
+
+def get_onnx_path(
+                  model_path:str,
+                  task:str,
+):
+    return model_path + '.onnx' if task == 'QA' else model_path + '_' + task.lower() + '.onnx'
+
+def export_to_onnx(
+                   model,
+                   model_path:str,
+                   max_seq_length:int,
+                   sbj_class:bool=False,
+                   opset_version:int=11,
+):
+    assert not model.encoder, 'Only DistilBertForQA with a linear QA head can be exported to ONNX'
+    model.eval()
+    dummy_input_ids = torch.ones(1, max_seq_length, dtype=torch.long).to(device)
+    input_names = ['input_ids', 'attention_masks']
+    # both mini-batch size and sequence length may vary at inference time
+    dynamic_axes = {input_name: {0: 'batch_size', 1: 'seq_len'} for input_name in input_names}
+
+    tasks = [('QA', QAForward(model), ['start_logits', 'end_logits'])]
+    if sbj_class:
+        sbj_outputs = ['sbj_logits'] if isinstance(model.n_qa_type_labels, int) else ['sbj_logits_a', 'sbj_logits_q']
+        tasks.append(('Sbj_Class', SbjForward(model), sbj_outputs))
+
+    onnx_paths = {}
+    for task, forward, output_names in tasks:
+        onnx_paths[task] = get_onnx_path(model_path, task)
+        output_axes = {output_name: {0: 'batch_size', 1: 'seq_len'} if task == 'QA' else {0: 'batch_size'} for output_name in output_names}
+        with torch.no_grad():
+            torch.onnx.export(
+                              forward,
+                              (dummy_input_ids, dummy_input_ids),
+                              onnx_paths[task],
+                              input_names=input_names,
+                              output_names=output_names,
+                              dynamic_axes=dict(dynamic_axes, **output_axes),
+                              opset_version=opset_version,
+                              )
+    return onnx_paths
+
+class TorchBackend(object):
+
+    def __init__(
+                 self,
+                 model,
+    ):
+        model.eval()
+        self.model = model
+
+    def __call__(
+                 self,
+                 input_ids:torch.Tensor,
+                 attention_masks:torch.Tensor,
+                 task:str,
+    ):
+        with inference_mode():
+            return self.model(
+                              input_ids=input_ids,
+                              attention_masks=attention_masks,
+                              token_type_ids=None,
+                              task=task,
+                              )
+
+class ONNXBackend(object):
+
+    def __init__(
+                 self,
+                 onnx_paths:dict,
+    ):
+        if onnxruntime is None:
+            raise ImportError('onnxruntime must be installed to perform inference with an exported ONNX graph')
+        self.sessions = {task: onnxruntime.InferenceSession(onnx_path) for task, onnx_path in onnx_paths.items()}
+
+    def __call__(
+                 self,
+                 input_ids:torch.Tensor,
+                 attention_masks:torch.Tensor,
+                 task:str,
+    ):
+        try:
+            session = self.sessions[task]
+        except KeyError:
+            raise ValueError('No ONNX graph was exported for task: {}'.format(task))
+        inputs = {'input_ids': to_cpu(input_ids), 'attention_masks': to_cpu(attention_masks)}
+        outputs = tuple(torch.from_numpy(output).to(device) for output in session.run(None, inputs))
+        # single output (multi-way Sbj_Class) is returned as a tensor (as in DistilBertForQA)
+        return outputs[0] if len(outputs) == 1 else outputs
+
+def check_logits_parity(
+                        backends:dict,
+                        test_dl,
+                        task:str='QA',
+                        n_batches:int=10,
+):
+    reference, candidate = backends.values()
+    max_abs_diffs = []
+    for batch in islice(test_dl, n_batches):
+        b_input_ids, b_attn_masks = batch[0].to(device), batch[1].to(device)
+        ref_logits = reference(b_input_ids, b_attn_masks, task)
+        cand_logits = candidate(b_input_ids, b_attn_masks, task)
+        ref_logits = ref_logits if isinstance(ref_logits, tuple) else (ref_logits,)
+        cand_logits = cand_logits if isinstance(cand_logits, tuple) else (cand_logits,)
+        max_abs_diffs.append(max((ref - cand).abs().max().item() for ref, cand in zip(ref_logits, cand_logits)))
+    return max(max_abs_diffs)
+
+def compare_backends(
+                     model,
+                     tokenizer,
+                     test_dl,
+                     batch_size:int,
+                     onnx_paths:dict,
+                     atol:float=1e-4,
+):
+    backends = {'pytorch': TorchBackend(model), 'onnx': ONNXBackend(onnx_paths)}
+
+    results = {}
+    for task in onnx_paths.keys():
+        # deviations beyond atol are reported (and stored in the results) instead of aborting the evaluation
+        max_abs_diff = check_logits_parity(backends, test_dl, task=task)
+        results['max_abs_diff_' + task.lower()] = max_abs_diff
+        results['parity_' + task.lower()] = max_abs_diff < atol
+
+    for name, backend in backends.items():
+        start_time = time.perf_counter()
+        test_loss, test_acc, test_f1 = test(
+                                            model=model,
+                                            tokenizer=tokenizer,
+                                            test_dl=test_dl,
+                                            batch_size=batch_size,
+                                            task='QA',
+                                            backend=backend,
+                                            )
+        results[name] = {
+                         'test_loss': test_loss,
+                         'test_acc': test_acc,
+                         'test_f1': test_f1,
+                         'inference_time': time.perf_counter() - start_time,
+                         }
+
+    results['speed_up'] = results['pytorch']['inference_time'] / results['onnx']['inference_time']
+
+    print("============================================")
+    for task in onnx_paths.keys():
+        print("----- Max abs logits diff ({}): {} -----".format(task, results['max_abs_diff_' + task.lower()]))
+        if not results['parity_' + task.lower()]:
+            print("----- WARNING: {} logits of exported graph deviate from PyTorch logits by more than {} -----".format(task, atol))
+    print("----- ONNX speed-up: {} -----".format(round(results['speed_up'], 3)))
+    print("============================================")
+    print()
+
+    return results['onnx']['test_loss'], results['onnx']['test_acc'], results['onnx']['test_f1'], results
@@ -0,0 +1,273 @@
+__all__ = [
+           'InferenceEngine',
+           'benchmark_inference',
+           'evaluate_quantization',
+           'inference_mode',
+           'load_quantized_model',
+           'quantize_model',
+           'save_quantized_model',
+           ]
+
+import numpy as np
+import torch.nn as nn
+import torch.nn.functional as F
+
+import copy
+import random
+import time
+import torch
+
+from itertools import islice
+
+from models.utils import compute_exact_batch, compute_f1_batch, get_answers, test
+
+# set random seeds to reproduce results
+np.random.seed(42)
+random.seed(42)
+torch.manual_seed(42)
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+## NOTE: torch.inference_mode is only available for PyTorch >= 1.9 (fall back to torch.no_grad for older versions) ##
+inference_mode = torch.inference_mode if hasattr(torch, 'inference_mode') else torch.no_grad
+
+class QAForward(nn.Module):
+    """
+        Fixed QA path of DistilBertForQA (no auxiliary targets, no hidden states).
+        Wrapping the path into a separate module allows it to be compiled via torch.jit.trace.
+    """
+
+    def __init__(
+                 self,
+                 model,
+    ):
+        super(QAForward, self).__init__()
+        self.model = model
+
+    def forward(
+                self,
+                input_ids:torch.Tensor,
+                attention_masks:torch.Tensor,
+                input_lengths=None,
+    ):
+        return self.model(
+                          input_ids=input_ids,
+                          attention_masks=attention_masks,
+                          token_type_ids=None,
+                          task='QA',
+                          input_lengths=input_lengths,
+                          )
+
+class InferenceEngine(object):
+
+    def __init__(
+                 self,
+                 model,
+                 batch_size:int,
+                 max_seq_length:int,
+                 jit:bool=False,
+                 device:torch.device=device,
+    ):
+        # disable dropout once (instead of for every mini-batch); gradient computation is disabled via inference_mode in predict (requires_grad flags of the caller's model are left untouched)
+        model.eval()
+
+        self.model = model
+        self.batch_size = batch_size
+        self.max_seq_length = max_seq_length
+        self.jit = jit
+        self.device = device
+        self.forward = QAForward(model)
+        self.inference_time = 0
+
+        if self.jit:
+            assert not model.encoder, 'Only the QA path with a linear QA head can be traced (recurrent encoders depend on input lengths)'
+            dummy_input_ids = torch.ones(batch_size, max_seq_length, dtype=torch.long).to(self.device)
+            # traced graphs must not contain inference tensors, hence trace under no_grad
+            with torch.no_grad():
+                self.forward = torch.jit.trace(self.forward, (dummy_input_ids, dummy_input_ids), check_trace=False)
+
+        self.start_logits = torch.empty(0, max_seq_length)
+        self.end_logits = torch.empty(0, max_seq_length)
+
+    def allocate_buffers(
+                         self,
+                         n_examples:int,
+    ):
+        # (re-)allocate output buffers only if they are too small for the current test set
+        if self.start_logits.size(0) < n_examples:
+            self.start_logits = torch.empty(n_examples, self.max_seq_length)
+            self.end_logits = torch.empty(n_examples, self.max_seq_length)
+
+    def predict(
+                self,
+                test_dl,
+    ):
+        self.allocate_buffers(len(test_dl) * self.batch_size)
+        nb_test_examples = 0
+        start_time = time.perf_counter()
+        with inference_mode():
+            for batch in test_dl:
+                b_input_ids, b_attn_masks, b_input_lengths = batch[0], batch[1], batch[3]
+                ## NOTE: as in test, skip last mini-batch, if number of examples is smaller than specified batch_size ##
+                if b_input_ids.size(0) != self.batch_size:
+                    continue
+                if self.model.encoder:
+                    start_logits, end_logits = self.forward(b_input_ids.to(self.device), b_attn_masks.to(self.device), b_input_lengths.to(self.device))
+                else:
+                    start_logits, end_logits = self.forward(b_input_ids.to(self.device), b_attn_masks.to(self.device))
+                self.start_logits[nb_test_examples: nb_test_examples + self.batch_size].copy_(start_logits)
+                self.end_logits[nb_test_examples: nb_test_examples + self.batch_size].copy_(end_logits)
+                nb_test_examples += self.batch_size
+        self.inference_time = time.perf_counter() - start_time
+        return self.start_logits[:nb_test_examples], self.end_logits[:nb_test_examples]
+
+    def evaluate(
+                 self,
+                 tokenizer,
+                 test_dl,
+    ):
+        start_logits, end_logits = self.predict(test_dl)
+        test_loss, correct_answers, f1_answers = 0, 0, 0
+        nb_test_steps, nb_test_examples = 0, 0
+        for batch in test_dl:
+            b_input_ids, b_start_pos, b_end_pos = batch[0], batch[4], batch[5]
+            if b_input_ids.size(0) != self.batch_size:
+                continue
+            # start and end loss must be computed separately
+            start_loss = F.cross_entropy(start_logits[nb_test_examples: nb_test_examples + self.batch_size], b_start_pos)
+            end_loss = F.cross_entropy(end_logits[nb_test_examples: nb_test_examples + self.batch_size], b_end_pos)
+            test_loss += ((start_loss + end_loss) / 2).item()
+            b_pred_answers = get_answers(
+                                         tokenizer=tokenizer,
+                                         b_input_ids=b_input_ids,
+                                         start_logs=start_logits[nb_test_examples: nb_test_examples + self.batch_size],
+                                         end_logs=end_logits[nb_test_examples: nb_test_examples + self.batch_size],
+                                         predictions=True,
+                                         )
+            b_true_answers = get_answers(
+                                         tokenizer=tokenizer,
+                                         b_input_ids=b_input_ids,
+                                         start_logs=b_start_pos,
+                                         end_logs=b_end_pos,
+                                         predictions=False,
+                                         )
+            correct_answers += compute_exact_batch(b_true_answers, b_pred_answers)
+            f1_answers += compute_f1_batch(b_true_answers, b_pred_answers)
+            nb_test_examples += self.batch_size
+            nb_test_steps += 1
+
+        test_loss /= nb_test_steps
+        test_acc = 100 * (correct_answers / nb_test_examples)
+        test_f1 = 100 * (f1_answers / nb_test_examples)
+        return test_loss, test_acc, test_f1
+
+def benchmark_inference(
+                        model,
+                        tokenizer,
+                        test_dl,
+                        batch_size:int,
+                        max_seq_length:int,
+                        n_batches:int=None,
+                        jit:bool=False,
+):
+    # materialise mini-batches once s.t. both runs are timed on exactly the same inputs
+    batches = list(islice(test_dl, n_batches)) if isinstance(n_batches, int) else list(test_dl)
+    n_examples = sum(batch[0].size(0) for batch in batches if batch[0].size(0) == batch_size)
+
+    start_time = time.perf_counter()
+    test_loss, test_acc, test_f1 = test(
+                                        model=model,
+                                        tokenizer=tokenizer,
+                                        test_dl=batches,
+                                        batch_size=batch_size,
+                                        task='QA',
+                                        )
+    test_time = time.perf_counter() - start_time
+
+    engine = InferenceEngine(
+                             model=model,
+                             batch_size=batch_size,
+                             max_seq_length=max_seq_length,
+                             jit=jit,
+                             )
+    start_time = time.perf_counter()
+    _, engine_acc, engine_f1 = engine.evaluate(tokenizer, batches)
+    engine_time = time.perf_counter() - start_time
+
+    print("============================================")
+    print("----- test: {} examples / s -----".format(round(n_examples / test_time, 3)))
+    print("----- InferenceEngine (jit: {}): {} examples / s -----".format(jit, round(n_examples / engine_time, 3)))
+    print("----- Speed-up: {} -----".format(round(test_time / engine_time, 3)))
+    print("============================================")
+    print()
+
+    results = {}
+    results['device'] = str(device)
+    results['n_examples'] = n_examples
+    results['test_throughput'] = n_examples / test_time
+    results['engine_throughput'] = n_examples / engine_time
+    results['speed_up'] = test_time / engine_time
+    results['exact_match'] = {'test': test_acc, 'engine': engine_acc}
+    results['f1'] = {'test': test_f1, 'engine': engine_f1}
+    return test_loss, test_acc, test_f1, results
+
+## NOTE: dynamic quantization is only supported on CPU (weights of all linear layers, incl. fc_qa and the auxiliary heads, are stored as int8) ##
+def quantize_model(model):
+    # quantize a CPU copy s.t. the caller's (fp32) model stays on its device
+    q_model = copy.deepcopy(model).cpu()
+    q_model.eval()
+    return torch.quantization.quantize_dynamic(q_model, {nn.Linear}, dtype=torch.qint8)
+
+def save_quantized_model(
+                         model,
+                         model_path:str,
+):
+    torch.save(model.state_dict(), model_path)
+
+def load_quantized_model(
+                         model,
+                         model_path:str,
+):
+    # quantized modules must exist before their (packed) int8 parameters can be loaded
+    q_model = quantize_model(model)
+    q_model.load_state_dict(torch.load(model_path, map_location='cpu'))
+    return q_model
+
+def evaluate_quantization(
+                          model,
+                          q_model,
+                          tokenizer,
+                          test_dl,
+                          batch_size:int,
+                          max_seq_length:int,
+):
+    cpu = torch.device('cpu')
+    results = {}
+    # fp32 baseline is evaluated on a CPU copy s.t. the caller's model stays on its device
+    for precision, current_model in [('fp32', copy.deepcopy(model).cpu()), ('int8', q_model)]:
+        engine = InferenceEngine(
+                                 model=current_model,
+                                 batch_size=batch_size,
+                                 max_seq_length=max_seq_length,
+                                 device=cpu,
+                                 )
+        test_loss, test_acc, test_f1 = engine.evaluate(tokenizer, test_dl)
+        results[precision] = {
+                              'test_loss': test_loss,
+                              'test_acc': test_acc,
+                              'test_f1': test_f1,
+                              'latency_per_batch': engine.inference_time / len(test_dl),
+                              }
+
+    results['exact_match_delta'] = results['int8']['test_acc'] - results['fp32']['test_acc']
+    results['f1_delta'] = results['int8']['test_f1'] - results['fp32']['test_f1']
+    results['speed_up'] = results['fp32']['latency_per_batch'] / results['int8']['latency_per_batch']
+
+    print("============================================")
+    print("----- Exact-match delta (int8 - fp32): {} % -----".format(round(results['exact_match_delta'], 3)))
+    print("----- F1 delta (int8 - fp32): {} % -----".format(round(results['f1_delta'], 3)))
+    print("----- Speed-up: {} -----".format(round(results['speed_up'], 3)))
+    print("============================================")
+    print()
+
+    return results['int8']['test_loss'], results['int8']['test_acc'], results['int8']['test_f1'], results
@@ -0,0 +1,160 @@
+__all__ = [
+           'ConfusionMatrix',
+           'GroupedMetrics',
+           'accuracy_from_counts',
+           'confusion_counts',
+           'f1_from_counts',
+           'hard_predictions',
+           ]
+
+import numpy as np
+
+import torch
+
+from models.tensor_ops import soft_to_hard
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+def hard_predictions(
+                     probas:torch.Tensor,
+                     task:str,
+):
+    # thresholding (binary) and argmax (multi-way) are performed on the device where the probabilities live
+    probas = probas.detach()
+    return soft_to_hard(probas).long() if task == 'binary' else torch.argmax(probas, dim=1)
+
+def confusion_counts(
+                     y_pred:torch.Tensor,
+                     y_true:torch.Tensor,
+                     n_labels:int,
+):
+    # (n_labels x n_labels) confusion counts (rows: true labels, columns: predicted labels) via a single bincount
+    y_pred = y_pred.detach().view(-1).long()
+    y_true = y_true.detach().view(-1).long().to(y_pred.device)
+    return torch.bincount(y_true * n_labels + y_pred, minlength=n_labels * n_labels).view(n_labels, n_labels)
+
+def accuracy_from_counts(counts:torch.Tensor):
+    counts = counts.double()
+    return counts.diag().sum() / counts.sum().clamp(min=1)
+
+def f1_from_counts(
+                   counts:torch.Tensor,
+                   avg:str='macro',
+):
+    # same as sklearn's f1_score for single-label (multi-class) predictions (labels that neither occur as true labels nor as predictions are ignored, zero division yields 0)
+    counts = counts.double()
+    tp = counts.diag()
+    support = counts.sum(dim=1)
+    denom = support + counts.sum(dim=0)
+    f1_per_label = torch.where(denom > 0, 2 * tp / denom.clamp(min=1), torch.zeros_like(tp))
+    if avg == 'macro':
+        is_present = denom > 0
+        return f1_per_label[is_present].sum() / is_present.sum().clamp(min=1).double()
+    elif avg == 'weighted':
+        return (f1_per_label * support).sum() / support.sum().clamp(min=1)
+    elif avg == 'micro':
+        return accuracy_from_counts(counts)
+    else:
+        raise ValueError('Average must be one of macro, weighted or micro')
+
+class ConfusionMatrix(object):
+    """
+        Streaming confusion matrix (rows: true labels, columns: predicted labels).
+        Counts are accumulated on device via a single bincount over (true * n_labels + pred) per mini-batch s.t. predictions never have to be stored.
+    """
+
+    def __init__(
+                 self,
+                 n_labels:int,
+                 device:torch.device=device,
+    ):
+        self.n_labels = n_labels
+        self.device = device
+        self.counts = torch.zeros(n_labels * n_labels, dtype=torch.long, device=device)
+
+    def update(
+               self,
+               y_pred:torch.Tensor,
+               y_true:torch.Tensor,
+    ):
+        # hard predictions and true labels must be class indices (i.e., no one-hot encodings)
+        self.counts += confusion_counts(y_pred.to(self.device), y_true, self.n_labels).view(-1)
+
+    def reset(self):
+        self.counts.zero_()
+
+    def accuracy(self):
+        # metrics are reduced from the running counts (i.e., a single reduction and host sync per call)
+        return accuracy_from_counts(self.counts.view(self.n_labels, self.n_labels)).item()
+
+    def f1(
+           self,
+           avg:str='macro',
+    ):
+        return f1_from_counts(self.counts.view(self.n_labels, self.n_labels), avg=avg).item()
+
+    def to_numpy(self):
+        # single device-to-host copy at the end of inference
+        return self.counts.view(self.n_labels, self.n_labels).cpu().numpy()
+
+    def state_dict(self):
+        return {'counts': self.counts.cpu()}
+
+    def load_state_dict(
+                        self,
+                        state:dict,
+    ):
+        self.counts = state['counts'].to(self.device)
+
+class GroupedMetrics(object):
+    """
+        Accumulates per-example correctness w.r.t. any number of categorical groupings (e.g., subjectivity, review domain, question type) in a single pass.
+        Frequencies and numbers of correct examples per category are updated via scatter_add (i.e., no per-example dict updates).
+        Per-example scores are only kept for groupings listed in store_scores (required for bootstrap confidence intervals).
+    """
+
+    def __init__(
+                 self,
+                 groupings:dict,
+                 store_scores:tuple=(),
+                 device:torch.device=device,
+    ):
+        # groupings map the name of a grouping onto its categories (the index of a category is its key)
+        self.groupings = groupings
+        self.device = device
+        self.freqs = {name: torch.zeros(len(categories), dtype=torch.long, device=device) for name, categories in groupings.items()}
+        self.correct = {name: torch.zeros(len(categories), dtype=torch.long, device=device) for name, categories in groupings.items()}
+        self.scores = {name: [] for name in store_scores}
+
+    def update(
+               self,
+               correct:torch.Tensor,
+               **keys
+    ):
+        # keys map the name of a grouping onto a tensor of category indices (examples with a negative key are not part of the grouping)
+        correct = torch.as_tensor(correct, device=self.device).view(-1).long()
+        for name, key in keys.items():
+            key = torch.as_tensor(key, device=self.device).view(-1).long()
+            is_valid = key >= 0
+            key, key_correct = key[is_valid], correct[is_valid]
+            self.freqs[name].scatter_add_(0, key, torch.ones_like(key))
+            self.correct[name].scatter_add_(0, key, key_correct)
+            if name in self.scores:
+                self.scores[name].append(torch.stack((key, key_correct)).cpu())
+
+    def results(
+                self,
+                name:str,
+    ):
+        # same format as the per-category results dicts (i.e., {category: {'freq', 'correct'[, 'scores']}}), categories without examples are omitted
+        freqs = self.freqs[name].cpu().numpy().tolist()
+        correct = self.correct[name].cpu().numpy().tolist()
+        if name in self.scores:
+            scores = torch.cat(self.scores[name], dim=1).numpy() if len(self.scores[name]) > 0 else np.zeros((2, 0), dtype=int)
+        results = {}
+        for k, category in enumerate(self.groupings[name]):
+            if freqs[k] > 0:
+                results[category] = {'freq': freqs[k], 'correct': correct[k]}
+                if name in self.scores:
+                    results[category]['scores'] = scores[1, scores[0] == k].tolist()
+        return results
@@ -0,0 +1,111 @@
+__all__ = [
+           'TaskScheduler',
+           ]
+
+import numpy as np
+
+from collections import Counter
+
+class TaskScheduler(object):
+    """
+        Samples the order in which tasks are performed in MTL (one task per training step).
+        A new task order is drawn at the beginning of every epoch s.t. sampling probabilities may change over the course of training:
+            - temperature: base probabilities are raised to the power of 1/T (T > 1 flattens, T < 1 sharpens the distribution)
+            - annealing: temperature is linearly annealed from T to 1 (i.e., the base distribution) across epochs
+            - loss-based weighting: probabilities are scaled by the (exponential moving average of the) training loss per task
+        Steps per task are counted on the fly s.t. the cost per step is constant (independent of the number of steps per epoch).
+    """
+
+    def __init__(
+                 self,
+                 tasks:list,
+                 distrib:list,
+                 n_steps:int,
+                 n_epochs:int,
+                 temperature:float=1.0,
+                 anneal:bool=False,
+                 loss_weighting:bool=False,
+                 momentum:float=0.9,
+    ):
+        assert len(tasks) == len(distrib), 'There must be a sampling probability for each task'
+        assert temperature > 0, 'Temperature must be positive'
+        self.tasks = tasks
+        self.distrib = np.array(distrib, dtype=float)
+        self.n_steps = n_steps
+        self.n_epochs = n_epochs
+        self.temperature = temperature
+        self.anneal = anneal
+        self.loss_weighting = loss_weighting
+        self.momentum = momentum
+        self.epoch = None
+        self.task_order = []
+        self.counts = Counter()
+        self.losses = {}
+
+    def get_temperature(
+                        self,
+                        epoch:int,
+    ):
+        if self.anneal and self.n_epochs > 1:
+            return self.temperature + (1 - self.temperature) * (epoch / (self.n_epochs - 1))
+        return self.temperature
+
+    def get_distrib(
+                    self,
+                    epoch:int,
+    ):
+        distrib = self.distrib ** (1 / self.get_temperature(epoch))
+        if self.loss_weighting and len(self.losses) > 0:
+            # tasks that were not performed yet are weighted by the mean loss across all other tasks
+            mean_loss = np.mean(list(self.losses.values()))
+            distrib = distrib * np.array([self.losses.get(task, mean_loss) for task in self.tasks])
+        return distrib / distrib.sum()
+
+    def start_epoch(
+                    self,
+                    epoch:int,
+    ):
+        # sample task order only once per epoch (task order of a resumed epoch is restored from the checkpoint)
+        if self.epoch == epoch:
+            return
+        self.epoch = epoch
+        self.task_order = np.random.choice(self.tasks, size=self.n_steps, replace=True, p=self.get_distrib(epoch))
+        self.counts = Counter()
+
+    @property
+    def task_distrib(self):
+        return Counter(self.task_order)
+
+    def next_task(
+                  self,
+                  step:int,
+    ):
+        current_task = self.task_order[step]
+        self.counts[current_task] += 1
+        return current_task
+
+    def update_loss(
+                    self,
+                    task:str,
+                    loss:float,
+    ):
+        # exponential moving average of training loss per task (only used for loss-based weighting)
+        loss = abs(loss)
+        self.losses[task] = loss if task not in self.losses else self.momentum * self.losses[task] + (1 - self.momentum) * loss
+
+    def state_dict(self):
+        return {
+                'epoch': self.epoch,
+                'task_order': self.task_order,
+                'counts': dict(self.counts),
+                'losses': dict(self.losses),
+                }
+
+    def load_state_dict(
+                        self,
+                        state:dict,
+    ):
+        self.epoch = state['epoch']
+        self.task_order = state['task_order']
+        self.counts = Counter(state['counts'])
+        self.losses = dict(state['losses'])
@@ -0,0 +1,29 @@
+__all__ = [
+           'reverse_sequences',
+           'soft_to_hard',
+           'to_cat',
+           ]
+
+import torch
+import torch.nn.functional as F
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+## NOTE: label manipulations are performed on the device where the input tensors live (no Python loops and no host round trips) ##
+
+def to_cat(
+           true_labels:torch.Tensor,
+           n_labels:int,
+):
+    # one-hot encoding of class indices (float, same as the zero-initialised matrix that is used as an additional input to the QA head)
+    return F.one_hot(true_labels.long().to(device), num_classes=n_labels).float()
+
+def soft_to_hard(probas:torch.Tensor):
+    # binary hard predictions (threshold = 0.5) as doubles
+    return (probas.detach() >= 0.5).double()
+
+## NOTE: use this function in case we want to use a unidirectional LSTM (or GRU) instead of a BiLSTM ##
+##       BERT feature representation sequences have to be reversed (special [CLS] token corresponds to semantic representation of sentence) ##
+def reverse_sequences(batch:torch.Tensor):
+    # reverse every sequence in batch (batch_size x seq_len x hidden_size) along the time axis
+    return torch.flip(torch.as_tensor(batch, dtype=torch.double).to(device), dims=[1])
@@ -3,6 +3,7 @@ __all__ = [
            'f1',
            'freeze_transformer_layers',
            'get_answers',
+           'aggregate_answers_across_windows',
            'compute_exact_batch',
            'compute_f1_batch',
            'cosine_sim',
@@ -28,14 +29,19 @@ import transformers
 
 from collections import Counter, defaultdict
 from itertools import islice
-from sklearn.metrics import f1_score
 from tqdm import trange, tqdm
 from transformers import AdamW
 from transformers import get_linear_schedule_with_warmup
 from transformers import BertTokenizer, BertModel, BertForQuestionAnswering
 
-from eval_squad import compute_exact, compute_f1
+from eval_squad import bootstrap_ci, compute_exact, compute_f1
 from eval_hidden_reps import *
+from models.checkpointing import Checkpointer, set_rng_states
+from models.metrics import ConfusionMatrix, GroupedMetrics, confusion_counts, f1_from_counts, hard_predictions
+from models.eval_controller import EvalController
+from models.task_scheduler import TaskScheduler
+from models.tensor_ops import reverse_sequences, soft_to_hard, to_cat
+from utils import BatchGenerator
 
 # set random seeds to reproduce results
 np.random.seed(42)
@@ -49,22 +55,20 @@ try:
 except:
   pass
 
-## NOTE: use this function in case we want to use a unidirectional LSTM (or GRU) instead of a BiLSTM ##
-##       BERT feature representation sequences have to be reversed (special [CLS] token corresponds to semantic representation of sentence) ##
-def reverse_sequences(batch:torch.Tensor):
-    return torch.tensor(list(map(lambda feat_reps: feat_reps[::-1], batch)), dtype=torch.double).to(device)
-
-def soft_to_hard(probas:torch.Tensor):
-    return torch.tensor(list(map(lambda p: 1 if p >= 0.5 else 0, to_cpu(probas, detach=True))), dtype=torch.double)
-
+## NOTE: hard predictions and confusion counts are computed on device (no host copies and no sklearn calls per mini-batch) ##
 def accuracy(probas:torch.Tensor, y_true:torch.Tensor, task:str):
-    y_pred = soft_to_hard(probas) if task == 'binary' else torch.argmax(to_cpu(probas, to_numpy=False), dim=1) 
-    y_true = y_true.type_as(y_pred)
-    return (y_pred == to_cpu(y_true, to_numpy=False)).float().mean().item()
+    y_pred = hard_predictions(probas, task)
+    return (y_pred == y_true.detach().long()).float().mean().item()
 
 def f1(probas:torch.Tensor, y_true:torch.Tensor, task:str, avg:str='macro'):
-    y_pred = soft_to_hard(probas) if task == 'binary' else torch.argmax(to_cpu(probas, detach=True, to_numpy=False), dim=1)
-    return f1_score(to_cpu(y_true), y_pred.numpy(), average=avg)
+    n_labels = 2 if task == 'binary' else probas.size(1)
+    return f1_from_counts(confusion_counts(hard_predictions(probas, task), y_true, n_labels), avg=avg).item()
+
+def reduce_conf_mats(conf_mats:list):
+    # acc and F1 (in %) are averaged across heads (i.e., answer and question heads in the binary sbj setting), same as in val and test
+    mean_acc = 100 * np.mean([conf_mat.accuracy() for conf_mat in conf_mats])
+    mean_f1 = 100 * np.mean([conf_mat.f1() for conf_mat in conf_mats])
+    return round(mean_acc, 3), round(mean_f1, 3)
 
 def compute_acc_nested(results_per_ds:dict):
     return {ds: {q_type: 100 * (score['correct'] / score['freq']) for q_type, score in q_types.items()} for ds, q_types in results_per_ds.items()}
@@ -73,98 +77,32 @@ def compute_acc(results:dict): return {k: 100 * (v['correct'] / v['freq']) for k
 
 def sort_dict(results:dict): return dict(sorted(results.items(), key=lambda kv:kv[1], reverse=True))
 
-def compute_batch_score_sbj(
-                            results_sbj:dict,
-                            b_true_answers:list,
-                            b_pred_answers:list,
-                            b_sbj:torch.Tensor,
-                            ):
-    b_sbj = to_cpu(b_sbj)
-    for i, (y_true, y_hat) in enumerate(zip(b_true_answers, b_pred_answers)):
-      try:
-        results_sbj['sbj' if b_sbj[i, 1] == 1 else 'obj']['freq'] += 1
-      except KeyError:
-        results_sbj['sbj' if b_sbj[i, 1] == 1 else 'obj']['freq'] = 0
-        results_sbj['sbj' if b_sbj[i, 1] == 1 else 'obj']['correct'] = 0
-      results_sbj['sbj' if b_sbj[i, 1] == 1 else 'obj']['correct'] += compute_exact(y_true, y_hat)
-    return results_sbj
-
-def compute_batch_score_per_q_type(
-                                   results_per_q_type:dict,
-                                   b_true_answers:list,
-                                   b_pred_answers:list,
-                                   q_types:list,
-                                   ):
-  for y_true, y_hat in zip(b_true_answers, b_pred_answers):
-    if y_true.strip() == '[CLS]':
-      key = q_types[2]
-    elif len(y_true.split()) == 1:
-      key = q_types[0]
-    else:
-      key = q_types[1]
-    try:
-      results_per_q_type[key]['freq'] += 1
-    except KeyError:
-      results_per_q_type[key]['freq'] = 1
-      results_per_q_type[key]['correct'] = 0
-    results_per_q_type[key]['correct'] += compute_exact(y_true, y_hat)
-  return results_per_q_type
-
-def compute_batch_score_per_domain(
-                                   results_per_domain:dict,
-                                   idx_to_domain:dict,
-                                   b_true_answers:list,
-                                   b_pred_answers:list,
-                                   b_domains:torch.Tensor,
-                                   ):
-  b_domains = to_cpu(b_domains)
-  for i, (true_ans, pred_ans) in enumerate(zip(b_true_answers, b_pred_answers)):
-    try:
-      results_per_domain[idx_to_domain[b_domains[i]]]['freq'] += 1
-    except KeyError:
-      results_per_domain[idx_to_domain[b_domains[i]]]['freq'] = 1
-      results_per_domain[idx_to_domain[b_domains[i]]]['correct'] = 0
-    results_per_domain[idx_to_domain[b_domains[i]]]['correct'] += compute_exact(true_ans, pred_ans)
-  return results_per_domain
-
-def compute_batch_score_per_q_word(
-                                   results_per_q_word:dict,
-                                   b_sent_pairs:list,
-                                   b_true_answers:list,
-                                   b_pred_answers:list,
-                                   q_words:list,
-                                   ):
-  for i, sent_pair in enumerate(b_sent_pairs):
-      q_word = sent_pair.split()[1].strip().lower()
-      if q_word in q_words:
-        try:
-          results_per_q_word[q_word]['freq'] += 1
-        except KeyError:
-          results_per_q_word[q_word]['freq'] = 1
-          results_per_q_word[q_word]['correct'] = 0
-        results_per_q_word[q_word]['correct'] += compute_exact(b_true_answers[i], b_pred_answers[i])
-  return results_per_q_word
-
-def get_detailed_scores(
-                        probas:torch.Tensor,
-                        y_true:torch.Tensor,
-                        y_ds:torch.Tensor,
-                        results_per_ds:dict,
-                        ):
-    y_pred = soft_to_hard(probas) 
-    y_true = to_cpu(y_true.type_as(y_pred), to_numpy=False)
-    y_ds = to_cpu(y_ds.type_as(y_pred), to_numpy=False)
-
-    for p, l, ds in zip(y_pred, y_true, y_ds):
-      try:
-        results_per_ds['SubjQA' if ds == 1 else 'SQuAD']['sbj' if l == 1 else 'obj']['freq'] += 1
-      except KeyError:
-        results_per_ds['SubjQA' if ds == 1 else 'SQuAD']['sbj' if l == 1 else 'obj'] = {}
-        results_per_ds['SubjQA' if ds == 1 else 'SQuAD']['sbj' if l == 1 else 'obj']['freq'] = 1
-        results_per_ds['SubjQA' if ds == 1 else 'SQuAD']['sbj' if l == 1 else 'obj']['correct'] = 0
-      if p == l:
-        results_per_ds['SubjQA' if ds == 1 else 'SQuAD']['sbj' if l == 1 else 'obj']['correct'] += 1
-    return results_per_ds
+def compute_acc_with_cis(
+                         results:dict,
+                         n_bootstrap:int,
+                         alpha:float=0.05,
+):
+    # exact-match per group together with its bootstrap confidence interval and per-question scores (for paired tests between models)
+    results_with_cis = {}
+    for k, acc in compute_acc(results).items():
+      scores = 100 * np.array(results[k]['scores'], dtype=np.float64)
+      _, ci_lower, ci_upper = bootstrap_ci(scores, n_resamples=n_bootstrap, alpha=alpha)
+      results_with_cis[k] = {'exact_match': acc, 'ci': [ci_lower, ci_upper], 'scores': results[k]['scores']}
+    return dict(sorted(results_with_cis.items(), key=lambda kv:kv[1]['exact_match'], reverse=True))
+
+def get_q_type_keys(
+                    b_true_answers:list,
+                    ):
+  # 0: answerable (single token answer), 1: answerable (multi token answer), 2: unanswerable
+  return torch.tensor([2 if y_true.strip() == '[CLS]' else 0 if len(y_true.split()) == 1 else 1 for y_true in b_true_answers], dtype=torch.long)
+
+def get_q_word_keys(
+                    b_sent_pairs:list,
+                    q_words:list,
+                    ):
+  # index of the interrogative word each question starts with (-1, if the question does not start with any of the top k interrogative words)
+  b_q_words = [sent_pair.split()[1].strip().lower() for sent_pair in b_sent_pairs]
+  return torch.tensor([q_words.index(q_word) if q_word in q_words else -1 for q_word in b_q_words], dtype=torch.long)
 
 def freeze_transformer_layers(
                               model,
@@ -225,6 +163,111 @@ def compute_f1_batch(
 ):
     return sum([compute_f1(a_gold, a_pred) for a_gold, a_pred in zip(answers_gold, answers_pred)])
 
+## NOTE: long reviews are split into several doc spans (windows) w.r.t. doc_stride ##
+##       the functions below merge window-level predictions back into a single answer per question (i.e., per example_index) ##
+def get_window_masks(
+                     features:list,
+                     max_seq_length:int,
+):
+    # a span may only start at a (context) token that has maximum context in the current window and end at any (context) token
+    ## NOTE: token positions are stored in per-feature dicts, hence reading them is linear in the total number of context tokens; both masks are filled with a single scatter each ##
+    positions = [np.fromiter(feature.token_to_orig_map.keys(), dtype=np.int64, count=len(feature.token_to_orig_map)) for feature in features]
+    is_max_context = [np.array([feature.token_is_max_context.get(pos, False) for pos in feature_positions], dtype=bool) for feature, feature_positions in zip(features, positions)]
+    rows = np.repeat(np.arange(len(features)), [len(feature_positions) for feature_positions in positions])
+    cols = np.concatenate(positions) if len(positions) > 0 else np.zeros(0, dtype=np.int64)
+    is_max_context = np.concatenate(is_max_context) if len(is_max_context) > 0 else np.zeros(0, dtype=bool)
+    start_mask = np.zeros((len(features), max_seq_length), dtype=bool)
+    end_mask = np.zeros((len(features), max_seq_length), dtype=bool)
+    end_mask[rows, cols] = True
+    start_mask[rows[is_max_context], cols[is_max_context]] = True
+    return start_mask, end_mask
+
+def get_best_valid_spans(
+                         start_logits:np.ndarray,
+                         end_logits:np.ndarray,
+                         start_mask:np.ndarray,
+                         end_mask:np.ndarray,
+                         max_answer_length:int=30,
+):
+    n_features, seq_len = start_logits.shape
+    start_logits = np.where(start_mask, start_logits, -np.inf)
+    end_logits = np.where(end_mask, end_logits, -np.inf)
+    best_scores = np.full(n_features, -np.inf)
+    best_starts = np.zeros(n_features, dtype=np.int64)
+    best_ends = np.zeros(n_features, dtype=np.int64)
+    # iterate over span lengths (instead of all start-end pairs) and compute scores for every window at once
+    ## NOTE: max_answer_length iterations with O(n_features * seq_len) vectorized work each (no Python loop over features or positions) ##
+    for offset in range(min(max_answer_length, seq_len)):
+        span_scores = start_logits[:, :seq_len - offset] + end_logits[:, offset:]
+        starts = np.argmax(span_scores, axis=1)
+        scores = span_scores[np.arange(n_features), starts]
+        improved = scores > best_scores
+        best_scores[improved] = scores[improved]
+        best_starts[improved] = starts[improved]
+        best_ends[improved] = starts[improved] + offset
+    return best_scores, best_starts, best_ends
+
+def aggregate_answers_across_windows(
+                                     features:list,
+                                     examples:list,
+                                     start_logits:np.ndarray,
+                                     end_logits:np.ndarray,
+                                     max_answer_length:int=30,
+                                     null_score_diff_thresh:float=0.,
+):
+    # logits are only available for features that were not skipped at inference time (i.e., features in the last incomplete mini-batch)
+    # examples with windows in the skipped mini-batch are dropped entirely (they would otherwise be answered from a subset of their windows)
+    n_windows = Counter(feature.example_index for feature in features)
+    features = features[:start_logits.shape[0]]
+    n_windows_kept = Counter(feature.example_index for feature in features)
+    is_complete = np.array([n_windows_kept[feature.example_index] == n_windows[feature.example_index] for feature in features], dtype=bool)
+    n_dropped = sum(1 for example_index in n_windows if n_windows_kept[example_index] != n_windows[example_index])
+    if n_dropped > 0:
+      print("------------------------------------------------------------------------------------------")
+      print("----- {} question(s) with (some) windows in the skipped last mini-batch are dropped -----".format(n_dropped))
+      print("------------------------------------------------------------------------------------------")
+      print()
+    features = [feature for feature, complete in zip(features, is_complete) if complete]
+    start_logits, end_logits = start_logits[is_complete], end_logits[is_complete]
+    start_mask, end_mask = get_window_masks(features, start_logits.shape[1])
+    span_scores, span_starts, span_ends = get_best_valid_spans(
+                                                               start_logits=start_logits,
+                                                               end_logits=end_logits,
+                                                               start_mask=start_mask,
+                                                               end_mask=end_mask,
+                                                               max_answer_length=max_answer_length,
+                                                               )
+    # score for predicting that there is no answer (i.e., [CLS] token at position 0)
+    null_scores = start_logits[:, 0] + end_logits[:, 0]
+    example_indexes = np.array([feature.example_index for feature in features])
+
+    # sort features by example and by span score (descending) s.t. first feature per example holds the best span across windows
+    order = np.lexsort((-span_scores, example_indexes))
+    example_indexes, first_windows = np.unique(example_indexes[order], return_index=True)
+    best_windows = order[first_windows]
+    # as in the official SQuAD v2 implementation, the minimum null score across windows is used
+    min_null_scores = np.minimum.reduceat(null_scores[order], first_windows)
+    is_null = (min_null_scores - span_scores[best_windows]) > null_score_diff_thresh
+
+    predictions = {}
+    exact_scores, f1_scores = [], []
+    for example_index, window, no_answer in zip(example_indexes, best_windows, is_null):
+        example = examples[example_index]
+        feature = features[window]
+        if no_answer:
+            pred_answer = ''
+        else:
+            orig_start = feature.token_to_orig_map[int(span_starts[window])]
+            orig_end = feature.token_to_orig_map[int(span_ends[window])]
+            pred_answer = ' '.join(example.doc_tokens[orig_start:orig_end + 1])
+        predictions[example.qas_id] = pred_answer
+        exact_scores.append(compute_exact(example.orig_answer_text, pred_answer))
+        f1_scores.append(compute_f1(example.orig_answer_text, pred_answer))
+
+    exact_match = 100 * (sum(exact_scores) / len(exact_scores))
+    f1_score_qa = 100 * (sum(f1_scores) / len(f1_scores))
+    return predictions, exact_match, f1_score_qa
+
 # move tensor to CPU
 def to_cpu(
            tensor:torch.Tensor,
@@ -235,16 +278,6 @@ def to_cpu(
     if to_numpy: return tensor.numpy()
     else: return tensor
 
-def to_cat(
-           true_labels:torch.Tensor,
-           n_labels:int,
-           ):
-    batch_size = true_labels.size(0)
-    cat_mat = torch.zeros(batch_size, n_labels)
-    for i, l in enumerate(true_labels):
-      cat_mat[i, l] += 1
-    return cat_mat.to(device)
-
 def create_optimizer(
                      model,
                      task:str,
@@ -284,6 +317,43 @@ def cosine_sim(x:torch.Tensor, y:torch.Tensor):
     denom = np.linalg.norm(x) * np.linalg.norm(y) # default is Frobenius norm (i.e., L2 norm)
     return num / denom
 
+def create_checkpointer(args:dict):
+    # checkpoints are only stored (or loaded), if a checkpointing interval is specified or training is resumed
+    if args['checkpoint_every'] > 0 or args['resume']:
+        return Checkpointer(
+                            model_dir=args['model_dir'],
+                            model_name=args['model_name'],
+                            save_every=args['checkpoint_every'],
+                            keep_last=args['keep_checkpoints'],
+                            resume=args['resume'],
+                            )
+
+def create_eval_controller(
+                           args:dict,
+                           steps_until_eval:int=0,
+):
+    # evaluation cadence, dev set subsampling and patience (early_stopping_thresh) w.r.t. evaluations during training
+    return EvalController(
+                          check_every=steps_until_eval,
+                          check_every_secs=args['eval_every_secs'],
+                          subsample_size=args['val_subsample'],
+                          full_eval_every=args['full_eval_every'],
+                          patience=args['early_stopping_thresh'],
+                          )
+
+def resume_batches(
+                   train_dl,
+                   start_step:int,
+):
+    # continue an interrupted epoch at start_step (mini-batches of steps that were already performed are not loaded again)
+    if start_step == 0:
+        return train_dl
+    elif isinstance(train_dl, BatchGenerator):
+        return train_dl.iter_from(start_step)
+    else:
+        # list of (zipped) mini-batches for alternating batch presentation
+        return train_dl[start_step:]
+
 def train(
           model,
           tokenizer,
@@ -336,6 +406,9 @@ def train(
     val_accs = []
     val_f1s = []
 
+    # every metric list is registered in history s.t. it can be stored in (and restored from) checkpoints
+    history = {'batch_losses': batch_losses, 'val_losses': val_losses, 'val_accs': val_accs, 'val_f1s': val_f1s}
+
     if args['task'] == 'QA':
 
       if compute_cosine_loss:
@@ -346,6 +419,7 @@ def train(
       qa_loss_func = nn.CrossEntropyLoss()
       tasks = ['QA']
       batch_accs_qa, batch_f1s_qa = [], []
+      history.update(batch_accs_qa=batch_accs_qa, batch_f1s_qa=batch_f1s_qa)
 
       if isinstance(n_aux_tasks, int):
           tasks.append('Sbj_Class')
@@ -360,10 +434,13 @@ def train(
 
           batch_accs_sbj, batch_f1s_sbj = [], []
 
+          history.update(batch_accs_sbj=batch_accs_sbj, batch_f1s_sbj=batch_f1s_sbj)
+
           if n_aux_tasks == 2 and dataset_agnostic:
               assert isinstance(ds_weights, torch.Tensor), 'Tensor of class weights for the two datasets is not provided'
               ds_loss_func = nn.BCEWithLogitsLoss(weight=ds_weights.to(device))
               batch_accs_ds, batch_f1s_ds = [], []
+              history.update(batch_accs_ds=batch_accs_ds, batch_f1s_ds=batch_f1s_ds)
               tasks.append('Dataset_Class')
               #uncomment line below if you want to train a ds_agnostic model (without any other aux task)
               #tasks.pop(tasks.index('Sbj_Class'))
@@ -372,6 +449,7 @@ def train(
               assert isinstance(domain_weights, torch.Tensor), 'Tensor of class weights for different domains is not provided'
               domain_loss_func = nn.CrossEntropyLoss(weight=domain_weights.to(device))
               batch_accs_domain, batch_f1s_domain = [], []
+              history.update(batch_accs_domain=batch_accs_domain, batch_f1s_domain=batch_f1s_domain)
               tasks.append('Domain_Class')
 
               if args['mtl_setting'] == 'domain_only':
@@ -391,6 +469,8 @@ def train(
         sbj_loss_func = nn.BCEWithLogitsLoss(pos_weight=torch.ones(2).to(device))
 
       batch_accs_sbj, batch_f1s_sbj = [], []
+
+      history.update(batch_accs_sbj=batch_accs_sbj, batch_f1s_sbj=batch_f1s_sbj)
       loss_func = sbj_loss_func
 
     elif args['task'] == 'Domain_Classification':
@@ -399,6 +479,8 @@ def train(
       domain_loss_func = nn.CrossEntropyLoss(weight=domain_weights.to(device))
 
       batch_accs_domain, batch_f1s_domain = [], []
+
+      history.update(batch_accs_domain=batch_accs_domain, batch_f1s_domain=batch_f1s_domain)
       loss_func = domain_loss_func
 
     if isinstance(n_aux_tasks, type(None)) or args['task_sampling'] == 'uniform' or args['task'] in ['Sbj_Classification', 'Domain_Classification']:
@@ -407,51 +489,99 @@ def train(
     elif isinstance(n_aux_tasks, int) and args['task_sampling'] == 'oversampling':
       distrib = [2/3 if task == 'QA' else 1/(3 * (len(tasks) - 1)) for task in tasks]
 
-    task_order = np.random.choice(tasks, size=args['n_steps'], replace=True, p = distrib)
-    task_distrib = Counter(task_order)
+    # task order is resampled at the beginning of every epoch (optionally w.r.t. temperature, annealing and training losses per task)
+    task_scheduler = TaskScheduler(
+                                   tasks=tasks,
+                                   distrib=distrib,
+                                   n_steps=args['n_steps'],
+                                   n_epochs=args['n_epochs'],
+                                   temperature=args['task_temperature'],
+                                   anneal=args['anneal_task_sampling'],
+                                   loss_weighting=args['loss_based_task_weights'],
+                                   )
+
+    #################################################
+    ######## RESUME FROM LATEST CHECKPOINT ##########
+    #################################################
+    optimizers = {'QA': optimizer_qa, 'Sbj_Class': optimizer_sbj, 'Domain_Class': optimizer_dom, 'Dataset_Class': optimizer_ds}
+    schedulers = {'QA': scheduler_qa, 'Sbj_Class': scheduler_sbj, 'Domain_Class': scheduler_dom, 'Dataset_Class': scheduler_ds}
+    optimizers = {task: optimizer for task, optimizer in optimizers.items() if not isinstance(optimizer, type(None))}
+    schedulers = {task: scheduler for task, scheduler in schedulers.items() if not isinstance(scheduler, type(None))}
+
+    checkpointer = create_checkpointer(args)
+    resume_state = checkpointer.load() if not isinstance(checkpointer, type(None)) else None
+    start_epoch, start_step = 0, 0
+
+    eval_controller = create_eval_controller(args, steps_until_eval if args['n_evals'] == 'multiple_per_epoch' else 0)
+
+    if not isinstance(resume_state, type(None)):
+      model.load_state_dict(resume_state['model'])
+      for task, optimizer in optimizers.items():
+        optimizer.load_state_dict(resume_state['optimizers'][task])
+      for task, scheduler in schedulers.items():
+        scheduler.load_state_dict(resume_state['schedulers'][task])
+      for name, values in resume_state['history'].items():
+        history[name].extend(values)
+      task_scheduler.load_state_dict(resume_state['task_scheduler'])
+      eval_controller.load_state_dict(resume_state['eval_controller'])
+      start_epoch, start_step = resume_state['epoch'], resume_state['step'] + 1
+
+    task_scheduler.start_epoch(start_epoch)
+    task_distrib = task_scheduler.task_distrib
 
     if plot_task_distrib:
-      plt.bar(tasks, [task_distrib[task] for task in tasks], alpha=0.5, edgecolor='black')
-      plt.xticks(range(len(tasks)), labels=tasks)
-      plt.xlabel('Tasks', fontsize=12)
-      plt.ylabel('Frequency per epoch', fontsize=12)
-      plt.title('Task distribution in MTL setting')
-      plt.show()
-      plt.clf()
+      # plotting dependencies are only required, if the task distribution is plotted
+      from plotting import plot_task_distribution
+      # save figure instead of showing it (training must not block on an interactive window, e.g. on headless machines)
+      plot_task_distribution(task_distrib, tasks, file_name=args['model_name'])
 
     # we want to store train exact-match accuracies and F1 scores for each task as often as we evaluate model on validation set
     running_tasks = tasks[:]
 
-    for epoch in trange(args['n_epochs'],  desc="Epoch"):
+    # running (per epoch) losses and exact-match scores (stored in checkpoints to resume an interrupted epoch)
+    running_metrics = {}
 
-        ### Training ###
-
-        model.train()
-
-        if args['task'] == 'QA':
-          correct_answers, batch_f1 = 0, 0
+    ## NOTE: auxiliary heads accumulate confusion counts on device every step, acc and F1 are only reduced when they are logged (same definition as in val and test) ##
+    conf_mats = {}
+    if 'Sbj_Class' in tasks:
+      conf_mats['Sbj_Class'] = [ConfusionMatrix(model.n_qa_type_labels)] if multi_qa_type_class else [ConfusionMatrix(2) for _ in range(2)]
+    if 'Domain_Class' in tasks:
+      conf_mats['Domain_Class'] = [ConfusionMatrix(args['n_domains'])]
+    if 'Dataset_Class' in tasks:
+      conf_mats['Dataset_Class'] = [ConfusionMatrix(2)]
 
-          if isinstance(n_aux_tasks, int):
-            if 'Sbj_Class' in tasks:
-              batch_acc_sbj, batch_f1_sbj = 0, 0
+    for epoch in trange(start_epoch, args['n_epochs'],  desc="Epoch"):
 
-            if 'Dataset_Class' in tasks:
-              batch_acc_ds, batch_f1_ds = 0, 0
-            
-            if 'Domain_Class' in tasks:
-              batch_acc_domain, batch_f1_domain = 0, 0
+        ### Training ###
 
-        elif args['task'] == 'Sbj_Classification':
-          batch_acc_sbj, batch_f1_sbj = 0, 0
+        model.train()
 
-        elif args['task'] == 'Domain_Classification':
-          batch_acc_domain, batch_f1_domain = 0, 0
+        task_scheduler.start_epoch(epoch)
+        task_distrib = task_scheduler.task_distrib
 
-        tr_loss = 0
-        nb_tr_examples, nb_tr_steps = 0, 0
+        if args['task'] == 'QA':
+          running_metrics.update(correct_answers=0, batch_f1=0)
+
+        for conf_mat in [conf_mat for task_conf_mats in conf_mats.values() for conf_mat in task_conf_mats]:
+          conf_mat.reset()
+
+        running_metrics.update(tr_loss=0, nb_tr_examples=0, nb_tr_steps=0)
+
+        if not isinstance(resume_state, type(None)):
+          # restore running metrics (and confusion counts) of interrupted epoch
+          running_metrics.update(resume_state['running_metrics'])
+          for task, task_conf_mats in conf_mats.items():
+            for conf_mat, state in zip(task_conf_mats, resume_state['conf_mats'][task]):
+              conf_mat.load_state_dict(state)
+          running_tasks = resume_state['running_tasks']
+          set_rng_states(resume_state['rng_states'])
+          resume_state = None
         
+        # skip steps that were already performed before training was interrupted
+        first_step = start_step if epoch == start_epoch else 0
+
         # n_steps == n_updates per epoch (n_iters = n_epochs * n_steps per epoch)
-        for step, batch in enumerate(tqdm(train_dl, desc="Step")):
+        for step, batch in enumerate(tqdm(resume_batches(train_dl, first_step), desc="Step", total=len(train_dl) - first_step), start=first_step):
 
             if args['batch_presentation'] == 'alternating' and isinstance(n_aux_tasks, int):
               assert len(batch) == 2, 'In MTL, we must provide batches with different input sequences for the main and auxiliary task when alternating'
@@ -461,7 +591,7 @@ def train(
               main_batch = tuple(t.to(device) for t in batch)
             
             # sample task from random distribution
-            current_task = task_order[step]
+            current_task = task_scheduler.next_task(step)
 
             # set loss back to 0 after every training iteration
             batch_loss = 0 
@@ -613,16 +743,16 @@ def train(
                                          predictions=False,
               )
             
-              correct_answers += compute_exact_batch(true_answers, pred_answers)
-              batch_f1 += compute_f1_batch(true_answers, pred_answers)
+              running_metrics['correct_answers'] += compute_exact_batch(true_answers, pred_answers)
+              running_metrics['batch_f1'] += compute_f1_batch(true_answers, pred_answers)
 
 
 
               # keep track of train examples used for QA
-              nb_tr_examples_qa = Counter(task_order[:step+1])[current_task] * batch_size
+              nb_tr_examples_qa = task_scheduler.counts[current_task] * batch_size
 
-              current_batch_acc = round(100 * (correct_answers / nb_tr_examples_qa), 3)
-              current_batch_f1 = round(100 * (batch_f1 / nb_tr_examples_qa), 3)
+              current_batch_acc = round(100 * (running_metrics['correct_answers'] / nb_tr_examples_qa), 3)
+              current_batch_f1 = round(100 * (running_metrics['batch_f1'] / nb_tr_examples_qa), 3)
               
               print("--------------------------------------------")
               print("----- Current batch {} exact-match: {} % -----".format(current_task, current_batch_acc))
@@ -667,11 +797,7 @@ def train(
                   else:
                     batch_loss += sbj_loss_func(sbj_logits, b_sbj)
   
-                  batch_acc_sbj += accuracy(probas=F.log_softmax(sbj_logits, dim=1), y_true=b_sbj, task='multi-way')  
-                  batch_f1_sbj += f1(probas=F.log_softmax(sbj_logits, dim=1), y_true=b_sbj, task='multi-way')
-
-                  batch_acc_aux = batch_acc_sbj
-                  batch_f1_aux = batch_f1_sbj
+                  conf_mats[current_task][0].update(y_pred=hard_predictions(sbj_logits, task='multi-way'), y_true=b_sbj)
 
                 else:
 
@@ -697,19 +823,8 @@ def train(
                   else:
                     batch_loss += sbj_loss_func(sbj_logits, b_sbj)
       
-                  current_sbj_acc = 0
-                  current_sbj_f1 = 0
-
                   for k in range(b_sbj.size(1)):
-
-                    current_sbj_acc += accuracy(probas=torch.sigmoid(sbj_logits[:, k]), y_true=b_sbj[:, k], task='binary')  
-                    current_sbj_f1 += f1(probas=torch.sigmoid(sbj_logits[:, k]), y_true=b_sbj[:, k], task='binary')
-
-                  batch_acc_sbj += (current_sbj_acc / b_sbj.size(1))
-                  batch_f1_sbj += (current_sbj_f1 / b_sbj.size(1))
-
-                  batch_acc_aux = batch_acc_sbj
-                  batch_f1_aux = batch_f1_sbj
+                    conf_mats[current_task][k].update(y_pred=hard_predictions(torch.sigmoid(sbj_logits[:, k]), task='binary'), y_true=b_sbj[:, k])
 
               elif current_task == 'Domain_Class':
 
@@ -733,11 +848,7 @@ def train(
                 else:
                   batch_loss += domain_loss_func(domain_logits, b_domains)
 
-                batch_acc_domain += accuracy(probas=F.log_softmax(domain_logits, dim=1), y_true=b_domains, task='multi-way')  
-                batch_f1_domain += f1(probas=F.log_softmax(domain_logits, dim=1), y_true=b_domains, task='multi-way')
-
-                batch_acc_aux = batch_acc_domain
-                batch_f1_aux = batch_f1_domain
+                conf_mats[current_task][0].update(y_pred=hard_predictions(domain_logits, task='multi-way'), y_true=b_domains)
 
               elif current_task == 'Dataset_Class':
 
@@ -764,26 +875,20 @@ def train(
                 else:
                   batch_loss += ds_loss_func(ds_logits, b_ds)
 
-                  batch_acc_ds += accuracy(probas=torch.sigmoid(ds_logits), y_true=b_ds, task='binary')  
-                  batch_f1_ds += f1(probas=torch.sigmoid(ds_logits), y_true=b_ds, task='binary')
-
-                batch_acc_aux = batch_acc_ds
-                batch_f1_aux = batch_f1_ds
-              
-              # keep track of steps taken per task (don't use overall steps)
-              nb_tr_steps_aux = Counter(task_order[:step+1])[current_task]
-              current_batch_acc_aux = round(100 * (batch_acc_aux / nb_tr_steps_aux), 3)
-              current_batch_f1_aux = round(100 * (batch_f1_aux / nb_tr_steps_aux), 3)
-
-              print("--------------------------------------------")
-              print("----- Current batch {} acc: {} % -----".format(current_task, current_batch_acc_aux))
-              print("----- Current batch {} F1: {} % -----".format(current_task, current_batch_f1_aux))
-              print("--------------------------------------------")
-              print()
+                conf_mats[current_task][0].update(y_pred=hard_predictions(torch.sigmoid(ds_logits), task='binary'), y_true=b_ds)
 
               # we don't want to save F1 scores and exact-match accuracies at the very beginning of training
               if step > (steps_until_eval // 2):
                 if current_task in running_tasks:
+                  # acc and F1 are reduced from the running (per epoch) confusion counts once per logging interval
+                  current_batch_acc_aux, current_batch_f1_aux = reduce_conf_mats(conf_mats[current_task])
+
+                  print("--------------------------------------------")
+                  print("----- Current {} acc: {} % -----".format(current_task, current_batch_acc_aux))
+                  print("----- Current {} F1: {} % -----".format(current_task, current_batch_f1_aux))
+                  print("--------------------------------------------")
+                  print()
+
                   if current_task == 'Sbj_Class':
                     batch_accs_sbj.append(current_batch_acc_aux)
                     batch_f1s_sbj.append(current_batch_f1_aux)
@@ -798,22 +903,24 @@ def train(
 
                   running_tasks.pop(running_tasks.index(current_task))
 
-            nb_tr_examples += b_input_ids.size(0)
-            nb_tr_steps += 1
+            running_metrics['nb_tr_examples'] += b_input_ids.size(0)
+            running_metrics['nb_tr_steps'] += 1
 
             print("------------------------------------")
             print("----- Current {} loss: {} -----".format(current_task, abs(round(batch_loss.item(), 3))))
             print("------------------------------------")
             print()
 
+            task_scheduler.update_loss(current_task, batch_loss.item())
+
             # in any MTL setting, we exclusively want to store QA losses (there's no need to store losses for auxiliary tasks since we want to observe effect on main task)
             if isinstance(n_aux_tasks, int):
               if current_task == 'QA':
                 batch_loss_total = batch_loss.item() + cosine_loss.item() if compute_cosine_loss else batch_loss.item()
-                tr_loss += batch_loss_total
+                running_metrics['tr_loss'] += batch_loss_total
                 batch_losses.append(batch_loss_total)
             else:
-                tr_loss += batch_loss.item()
+                running_metrics['tr_loss'] += batch_loss.item()
                 batch_losses.append(batch_loss.item())
 
             if current_task == 'QA' and compute_cosine_loss:
@@ -853,7 +960,7 @@ def train(
               optimizer_dom.zero_grad()
 
             if args['n_evals'] == 'multiple_per_epoch':
-              if step > 0 and step % steps_until_eval == 0:
+              if eval_controller.is_due(step):
                 val_losses, val_accs, val_f1s, model = val(
                                                           model=model,
                                                           tokenizer=tokenizer,
@@ -867,6 +974,7 @@ def train(
                                                           val_f1s=val_f1s,
                                                           loss_func=loss_func,
                                                           multi_qa_type_class=multi_qa_type_class,
+                                                          eval_controller=eval_controller,
                                                           )
 
                 # we want to store train exact-match accuracies and F1 scores for each task as often as we evaluate model on validation set
@@ -875,65 +983,84 @@ def train(
                 # after evaluation on dev set, move model back to train mode
                 model.train()
 
-                # we want to train the model at least for one epoch
-                if epoch > 0 and early_stopping:
-                  # if loss has not decreased for the past args['early_stopping_thresh'] eval steps, stop training
-                  if np.argmin(val_losses[::-1]) > args['early_stopping_thresh']:
-                    stop_training = True
-                    break
+                # if loss has not decreased for the past args['early_stopping_thresh'] eval steps (and model was trained for at least one epoch), stop training
+                if early_stopping and eval_controller.should_stop(epoch):
+                  stop_training = True
+                  break
+
+            # periodically store full training state (written to disk off the training thread)
+            if not isinstance(checkpointer, type(None)) and checkpointer.is_due():
+              checkpointer.save({
+                                 'model': model.state_dict(),
+                                 'optimizers': {task: optimizer.state_dict() for task, optimizer in optimizers.items()},
+                                 'schedulers': {task: scheduler.state_dict() for task, scheduler in schedulers.items()},
+                                 'task_scheduler': task_scheduler.state_dict(),
+                                 'eval_controller': eval_controller.state_dict(),
+                                 'history': history,
+                                 'running_metrics': running_metrics,
+                                 'conf_mats': {task: [conf_mat.state_dict() for conf_mat in task_conf_mats] for task, task_conf_mats in conf_mats.items()},
+                                 'running_tasks': running_tasks,
+                                 'epoch': epoch,
+                                 'step': step,
+                                 })
 
         if args['task'] == 'QA':
-          tr_loss /= task_distrib['QA']
+          running_metrics['tr_loss'] /= task_distrib['QA']
         elif args['task'] == 'Sbj_Classification': 
-          tr_loss /= task_distrib['Sbj_Class']
+          running_metrics['tr_loss'] /= task_distrib['Sbj_Class']
         elif args['task'] == 'Domain_Classification': 
-          tr_loss /= task_distrib['Domain_Class']
+          running_metrics['tr_loss'] /= task_distrib['Domain_Class']
 
         print("------------------------------------")
         print("---------- EPOCH {} ----------".format(epoch + 1))
-        print("----- Train loss: {} -----".format(round(tr_loss, 3)))
+        print("----- Train loss: {} -----".format(round(running_metrics['tr_loss'], 3)))
 
         if args['task'] == 'QA':
-          train_exact_match = round(100 * (correct_answers / (task_distrib['QA'] * batch_size)), 3)
-          train_f1 = round(100 * (batch_f1 / (task_distrib['QA'] * batch_size)), 3)
+          train_exact_match = round(100 * (running_metrics['correct_answers'] / (task_distrib['QA'] * batch_size)), 3)
+          train_f1 = round(100 * (running_metrics['batch_f1'] / (task_distrib['QA'] * batch_size)), 3)
           print("----- Train QA exact-match: {} % -----".format(round(train_exact_match, 3)))
           print("----- Train QA F1: {} % -----".format(round(train_f1, 3)))
 
-          if isinstance(n_aux_tasks, int) and (len(batch_accs_sbj) > 0 and len(batch_f1s_sbj) > 0):
-
+          if 'Sbj_Class' in conf_mats:
+             train_acc_aux, train_f1_aux = reduce_conf_mats(conf_mats['Sbj_Class'])
              print("------------------------------------")
-             print("----- Train sbj acc: {} % -----".format(batch_accs_sbj[-1]))
-             print("----- Train sbj F1: {} % -----".format(batch_f1s_sbj[-1]))
+             print("----- Train sbj acc: {} % -----".format(train_acc_aux))
+             print("----- Train sbj F1: {} % -----".format(train_f1_aux))
              print("------------------------------------")
              print()
 
-             if n_aux_tasks == 2 and dataset_agnostic:
-
-                print("------------------------------------")
-                print("----- Train dataset acc: {} % -----".format(batch_accs_ds[-1]))
-                print("----- Train dataset F1: {} % -----".format(batch_f1s_ds[-1]))
-                print("------------------------------------")
-                print()
+          if 'Dataset_Class' in conf_mats:
+             train_acc_aux, train_f1_aux = reduce_conf_mats(conf_mats['Dataset_Class'])
+             print("------------------------------------")
+             print("----- Train dataset acc: {} % -----".format(train_acc_aux))
+             print("----- Train dataset F1: {} % -----".format(train_f1_aux))
+             print("------------------------------------")
+             print()
 
-             elif n_aux_tasks == 2 and not dataset_agnostic:  
-                print("------------------------------------")
-                print("----- Train domain acc: {} % -----".format(batch_accs_domain[-1]))
-                print("----- Train domain F1: {} % -----".format(batch_f1s_domain[-1]))
-                print("------------------------------------")
-                print()
+          if 'Domain_Class' in conf_mats:
+             train_acc_aux, train_f1_aux = reduce_conf_mats(conf_mats['Domain_Class'])
+             print("------------------------------------")
+             print("----- Train domain acc: {} % -----".format(train_acc_aux))
+             print("----- Train domain F1: {} % -----".format(train_f1_aux))
+             print("------------------------------------")
+             print()
 
         elif args['task'] == 'Sbj_Classification':
-          print("----- Train Sbj acc: {} % -----".format(batch_accs_sbj[-1]))
-          print("----- Train Sbj F1: {} % -----".format(batch_f1s_sbj[-1]))
+          train_acc_aux, train_f1_aux = reduce_conf_mats(conf_mats['Sbj_Class'])
+          print("----- Train Sbj acc: {} % -----".format(train_acc_aux))
+          print("----- Train Sbj F1: {} % -----".format(train_f1_aux))
 
         elif args['task'] == 'Domain_Classification':
-          print("----- Train Domain acc: {} % -----".format(batch_accs_domain[-1]))
-          print("----- Train Domain F1: {} % -----".format(batch_f1s_domain[-1]))
+          train_acc_aux, train_f1_aux = reduce_conf_mats(conf_mats['Domain_Class'])
+          print("----- Train Domain acc: {} % -----".format(train_acc_aux))
+          print("----- Train Domain F1: {} % -----".format(train_f1_aux))
 
         print("----------------------------------")
         print()
         
         if args['n_evals'] == 'one_per_epoch':
+          # evaluations at the end of an epoch are always performed on the full dev set
+          eval_controller.next_check(full=True)
           val_losses, val_accs, val_f1s, model = val(
                                                     model=model,
                                                     tokenizer=tokenizer,
@@ -947,6 +1074,7 @@ def train(
                                                     val_f1s=val_f1s,
                                                     loss_func=loss_func,
                                                     multi_qa_type_class=multi_qa_type_class,
+                                                    eval_controller=eval_controller,
                                                     )
 
           # we want to store train exact-match accuracies and F1 scores for each task as often as we evaluate model on validation set
@@ -958,16 +1086,45 @@ def train(
           if epoch > 0 and early_stopping:
             if val_losses[-1] > val_losses[-2]:
               print("------------------------------------------")
-              print("----- Early stopping after {} steps -----".format(nb_tr_steps + len(train_dl) * epoch))
+              print("----- Early stopping after {} steps -----".format(running_metrics['nb_tr_steps'] + len(train_dl) * epoch))
               print("------------------------------------------")
               break
         else:
+          # evaluate on the full dev set at the end of an epoch (and before stopping early), if frequent checks were only performed on the dev subsample
+          if eval_controller.full_eval_pending():
+            eval_controller.next_check(full=True)
+            val_losses, val_accs, val_f1s, model = val(
+                                                      model=model,
+                                                      tokenizer=tokenizer,
+                                                      val_dl=val_dl,
+                                                      args=args,
+                                                      current_step=step,
+                                                      epoch=epoch,
+                                                      batch_size=batch_size,
+                                                      val_losses=val_losses,
+                                                      val_accs=val_accs,
+                                                      val_f1s=val_f1s,
+                                                      loss_func=loss_func,
+                                                      multi_qa_type_class=multi_qa_type_class,
+                                                      eval_controller=eval_controller,
+                                                      )
+
+            # we want to store train exact-match accuracies and F1 scores for each task as often as we evaluate model on validation set
+            running_tasks = tasks[:]
+
+            # after evaluation on dev set, move model back to train mode
+            model.train()
+
           if stop_training:
             print("------------------------------------------")
-            print("----- Early stopping after {} steps -----".format(nb_tr_steps + len(train_dl) * epoch))
+            print("----- Early stopping after {} steps -----".format(running_metrics['nb_tr_steps'] + len(train_dl) * epoch))
             print("------------------------------------------")
             break
 
+    # make sure that last checkpoint is written to disk
+    if not isinstance(checkpointer, type(None)):
+      checkpointer.wait()
+
     # return model in eval mode
     model.eval()
     if isinstance(n_aux_tasks, type(None)) and args['task'] == 'QA':
@@ -998,12 +1155,20 @@ def val(
         sequential_transfer:bool=False,
         evaluation_strategy:str=None,
         multi_qa_type_class:bool=False,
+        eval_controller=None,
 ):
     ### Validation ###
 
     # set model to eval mode
     model.eval()
 
+    # frequent checks are performed on a fixed subsample of the dev set (only full evaluations are stored and decide whether model is saved)
+    if not isinstance(eval_controller, type(None)):
+      val_dl = eval_controller.get_val_dl(val_dl)
+      is_full_eval = eval_controller.full
+    else:
+      is_full_eval = True
+
     # n_features in DistilBERT transformer layers
     distilbert_hidden_size = 768
 
@@ -1013,11 +1178,12 @@ def val(
     if args['task'] == 'QA':
       correct_answers_val = 0
 
+    ## NOTE: classification metrics are reduced once from confusion counts that are accumulated on device (one matrix per sbj head in the binary setting) ##
     elif args['task'] == 'Sbj_Classification':
-      batch_acc_sbj = 0
+      conf_mats = [ConfusionMatrix(model.n_qa_type_labels)] if multi_qa_type_class else [ConfusionMatrix(2) for _ in range(2)]
 
     elif args['task'] == 'Domain_Classification':
-      batch_acc_domain = 0
+      conf_mats = [ConfusionMatrix(args['n_domains'])]
     
     batch_f1_val = 0
     val_loss = 0
@@ -1194,8 +1360,7 @@ def val(
 
                   batch_loss_val += loss_func(sbj_logits, b_sbj)
 
-                  batch_acc_sbj += accuracy(probas=F.log_softmax(sbj_logits, dim=1), y_true=b_sbj, task='multi-way')  
-                  batch_f1_val += f1(probas=F.log_softmax(sbj_logits, dim=1), y_true=b_sbj, task='multi-way')
+                  conf_mats[0].update(y_pred=hard_predictions(sbj_logits, task='multi-way'), y_true=b_sbj)
 
               else:
                   sbj_logits_a, sbj_logits_q = model(
@@ -1212,16 +1377,8 @@ def val(
 
                   batch_loss_val += loss_func(sbj_logits, b_sbj)
 
-                  current_sbj_acc = 0
-                  current_sbj_f1 = 0
-
                   for k in range(b_sbj.size(1)):
-
-                    current_sbj_acc += accuracy(probas=torch.sigmoid(sbj_logits[:, k]), y_true=b_sbj[:, k], task='binary')  
-                    current_sbj_f1 += f1(probas=torch.sigmoid(sbj_logits[:, k]), y_true=b_sbj[:, k], task='binary')
-
-                  batch_acc_sbj += (current_sbj_acc / b_sbj.size(1))
-                  batch_f1_val += (current_sbj_f1 / b_sbj.size(1))
+                    conf_mats[k].update(y_pred=hard_predictions(torch.sigmoid(sbj_logits[:, k]), task='binary'), y_true=b_sbj[:, k])
 
           elif args['task'] == 'Domain_Classification':
 
@@ -1236,8 +1393,7 @@ def val(
 
             batch_loss_val += loss_func(domain_logits, b_domains)
 
-            batch_acc_domain += accuracy(probas=F.log_softmax(domain_logits, dim=1), y_true=b_domains, task='multi-way')  
-            batch_f1_val += f1(probas=F.log_softmax(domain_logits, dim=1), y_true=b_domains, task='multi-way')
+            conf_mats[0].update(y_pred=hard_predictions(domain_logits, task='multi-way'), y_true=b_domains)
 
           print("----------------------------------------")
           print("----- Current val batch loss: {} -----".format(round(batch_loss_val.item(), 3)))
@@ -1248,21 +1404,10 @@ def val(
           nb_val_examples += b_input_ids.size(0)
           nb_val_steps += 1
 
-          current_batch_f1 = 100 * (batch_f1_val / nb_val_examples) if args['task'] == 'QA' else 100 * (batch_f1_val / nb_val_steps )
-
-          if args['task'] == 'QA':
-            current_batch_acc = 100 * (correct_answers_val / nb_val_examples)
-
-          elif args['task'] == 'Sbj_Classification':
-            current_batch_acc = 100 * (batch_acc_sbj / nb_val_steps)
-
-          elif args['task'] == 'Domain_Classification':
-            current_batch_acc = 100 * (batch_acc_domain / nb_val_steps)
-
     val_loss /= nb_val_steps
     print("----------------------------------")
     print("-------- Train step {} --------".format(current_step + 1))
-    print("----- Val loss: {} -----".format(round(val_loss, 3)))
+    print("----- Val loss{}: {} -----".format('' if is_full_eval else ' (subsample)', round(val_loss, 3)))
 
     if args['task'] == 'QA':
       val_exact_match = 100 * (correct_answers_val / nb_val_examples)
@@ -1272,28 +1417,34 @@ def val(
       print("----- Val QA F1: {} % -----".format(round(val_f1, 3)))
     
     elif args['task'] == 'Sbj_Classification':
-      val_acc = 100 * (batch_acc_sbj / nb_val_steps)
-      val_f1 = 100 * (batch_f1_val / nb_val_steps)
+      val_acc = 100 * np.mean([conf_mat.accuracy() for conf_mat in conf_mats])
+      val_f1 = 100 * np.mean([conf_mat.f1() for conf_mat in conf_mats])
 
       print("----- Val Sbj acc: {} % -----".format(round(val_acc, 3)))
       print("----- Val Sbj F1: {} % -----".format(round(val_f1, 3)))
 
     elif args['task'] == 'Domain_Classification':
-      val_acc = 100 * (batch_acc_domain / nb_val_steps)
-      val_f1 = 100 * (batch_f1_val / nb_val_steps)
+      val_acc = 100 * conf_mats[0].accuracy()
+      val_f1 = 100 * conf_mats[0].f1()
 
       print("----- Val Domain acc: {} % -----".format(round(val_acc, 3)))
       print("----- Val Domain F1: {} % -----".format(round(val_f1, 3)))
 
-    if epoch == 0 or val_loss < min(val_losses):
+    if isinstance(eval_controller, type(None)):
+      save_model = epoch == 0 or val_loss < min(val_losses)
+    else:
+      save_model = eval_controller.update(val_loss)
+
+    if save_model:
       torch.save(model.state_dict(), model_path + '/%s' % (args['model_name']))
 
     print("----------------------------------")
     print()
 
-    val_losses.append(val_loss)
-    val_accs.append(val_exact_match if args['task'] == 'QA' else val_acc)
-    val_f1s.append(val_f1)
+    if is_full_eval:
+      val_losses.append(val_loss)
+      val_accs.append(val_exact_match if args['task'] == 'QA' else val_acc)
+      val_f1s.append(val_f1)
 
     return val_losses, val_accs, val_f1s, model
 
@@ -1322,10 +1473,31 @@ def test(
         get_erroneous_predictions:bool=False,
         error_analysis_simple:bool=False,
         source=None,
+        features:list=None,
+        examples:list=None,
+        max_answer_length:int=30,
+        backend=None,
+        n_bootstrap:int=0,
+        output_conf_mat:bool=False,
 ):
     n_steps = len(test_dl)
     n_examples = n_steps * batch_size
     distilbert_hidden_size = 768
+
+    ## NOTE: if features and examples are provided, window-level predictions are merged into a single answer per question ##
+    aggregate_windows = task == 'QA' and not isinstance(features, type(None))
+
+    if aggregate_windows:
+      assert not isinstance(examples, type(None)), 'Examples must be provided to map answer spans back onto the original reviews'
+      max_seq_length = len(features[0].input_ids)
+      all_start_logits = np.zeros((n_examples, max_seq_length), dtype=np.float32)
+      all_end_logits = np.zeros((n_examples, max_seq_length), dtype=np.float32)
+
+    ## NOTE: a backend (e.g., an exported ONNX graph) only computes logits for the QA and Sbj_Class paths ##
+    if not isinstance(backend, type(None)):
+      assert not (not_finetuned or sequential_transfer), 'Backends can only be used for models fine-tuned on a single task'
+      assert not (output_last_hiddens_cls or output_all_hiddens_cls or output_all_hiddens or output_all_hiddens_cls_q_words), 'Backends do not return hidden representations'
+      assert not (task == 'Sbj_Classification' and multi_qa_type_class) and task != 'Domain_Classification', 'Backends support binary Sbj_Class only'
     
     #################
     ### Inference ###
@@ -1339,15 +1511,16 @@ def test(
       correct_answers_test = 0
       loss_func = nn.CrossEntropyLoss()
 
+    ## NOTE: classification metrics are reduced once from confusion counts that are accumulated on device (one matrix per sbj head in the binary setting) ##
     elif task == 'Sbj_Classification':
-      batch_acc_test = 0
+      conf_mats = [ConfusionMatrix(model.n_qa_type_labels)] if multi_qa_type_class else [ConfusionMatrix(2) for _ in range(2)]
       if multi_qa_type_class:
         loss_func = nn.CrossEntropyLoss()
       else:
         loss_func = nn.BCEWithLogitsLoss()
 
     elif task == 'Domain_Classification':
-      batch_acc_test = 0
+      conf_mats = [ConfusionMatrix(n_domains)]
       loss_func = nn.CrossEntropyLoss()
 
     ######################################################################  
@@ -1378,23 +1551,22 @@ def test(
 
     elif detailed_results_sbj:
         assert task == 'QA', 'Model must perform QA, if we want to compute exact-match per question type'
-        results_sbj = defaultdict(dict)
+        grouped_metrics = GroupedMetrics({'sbj': ['obj', 'sbj']}, store_scores=['sbj'])
 
     elif detailed_results_q_words:
         assert task == 'QA', 'Model must perform QA, if we want to compute exact-match scores per top k interrogative word'
         q_words = ['how', 'what', 'is', 'where', 'does', 'do']
-        results_per_q_word = defaultdict(dict)
+        grouped_metrics = GroupedMetrics({'q_word': q_words})
 
     elif detailed_results_domains:
         assert task == 'QA', 'Model must perform QA, if we want to compute exact-match scores per review domain'
         domains = ['books', 'tripadvisor', 'grocery', 'electronics', 'movies', 'restaurants']
-        idx_to_domain = dict(enumerate(domains))
-        results_per_domain = defaultdict(dict)
+        grouped_metrics = GroupedMetrics({'domain': domains}, store_scores=['domain'])
 
     elif detailed_results_q_type:
         assert task == 'QA', 'Model must perform QA, if we want to compute exact-match for unanswerable and answerable questions respectively'
         q_types = ['answerable_single', 'answerable_multi', 'unanswerable']
-        results_per_q_type = defaultdict(dict)
+        grouped_metrics = GroupedMetrics({'q_type': q_types})
 
     elif get_erroneous_predictions:
         assert task == 'QA', 'Model must perform QA, if we want to store erroneous answer span predictions'
@@ -1406,7 +1578,10 @@ def test(
     ######### DETAILED ANALYSIS ###########
 
     if detailed_analysis_sbj_class:
-      results_per_ds = defaultdict(dict)
+      grouped_metrics_ds = GroupedMetrics({'ds_sbj': [(ds, sbj) for ds in ['SQuAD', 'SubjQA'] for sbj in ['obj', 'sbj']]})
+
+    if output_conf_mat:
+      assert task in ['Sbj_Classification', 'Domain_Classification'], 'Confusion matrix can only be computed for Sbj_Classification or Domain_Classification'
 
     ########################################
     
@@ -1552,6 +1727,12 @@ def test(
                                      )
                   else:
                     raise ValueError('Incorrect name for inference strategy in sequential transfer setting provided.')
+                elif not isinstance(backend, type(None)):
+                    outputs = backend(
+                                      input_ids=b_input_ids,
+                                      attention_masks=b_attn_masks,
+                                      task='QA',
+                                      )
                 else:
                     outputs = model(
                                      input_ids=b_input_ids,
@@ -1598,6 +1779,11 @@ def test(
               #############################################################################
               #############################################################################
 
+              if aggregate_windows:
+                # features are presented sequentially, hence the n-th mini-batch corresponds to features[n*batch_size:(n+1)*batch_size]
+                all_start_logits[n * batch_size: (n + 1) * batch_size] = to_cpu(start_logits_test, detach=True)
+                all_end_logits[n * batch_size: (n + 1) * batch_size] = to_cpu(end_logits_test, detach=True)
+
               # move true start and end positions of answer span to CPU
               start_true_test = to_cpu(b_start_pos)
               end_true_test = to_cpu(b_end_pos)
@@ -1627,7 +1813,9 @@ def test(
                                          predictions=False,
               )
 
-              correct_answers_test += compute_exact_batch(b_true_answers, b_pred_answers)
+              # exact-match per example is computed once and shared by all (detailed) scores
+              b_exact = [compute_exact(true_ans, pred_ans) for true_ans, pred_ans in zip(b_true_answers, b_pred_answers)]
+              correct_answers_test += sum(b_exact)
               batch_f1_test += compute_f1_batch(b_true_answers, b_pred_answers)
 
               #### SAVE MODEL'S PRED ANSWERS, GOLD ANSWERS, QUESTIONS, AND CONTEXTS ####
@@ -1714,46 +1902,30 @@ def test(
                         feat_reps['Layer' + '_' + str(l + 1)].append(hidden.tolist())
 
 
-              if detailed_results_q_words:
-                b_sent_pairs = get_answers(
-                                           tokenizer=tokenizer,
-                                           b_input_ids=b_input_ids,
-                                           start_logs=torch.zeros(batch_size).type_as(b_start_pos).to(device),
-                                           end_logs=torch.tensor([seq_len - 1 for seq_len in b_input_lengths]).type_as(b_end_pos).to(device),
-                                           predictions=False,
-                                           )
+              ## NOTE: all detailed scores are updated with a single grouped update per mini-batch ##
+              if detailed_results_q_words or detailed_results_sbj or detailed_results_q_type or detailed_results_domains:
+                b_keys = {}
 
-                results_per_q_word = compute_batch_score_per_q_word(
-                                                                    results_per_q_word,
-                                                                    b_sent_pairs,
-                                                                    b_true_answers,
-                                                                    b_pred_answers,
-                                                                    q_words,
-                                                                    )
-              if detailed_results_sbj:
-                results_sbj = compute_batch_score_sbj(
-                                                      results_sbj,
-                                                      b_true_answers,
-                                                      b_pred_answers,
-                                                      b_sbj,
-                                                      )
+                if detailed_results_q_words:
+                  b_sent_pairs = get_answers(
+                                             tokenizer=tokenizer,
+                                             b_input_ids=b_input_ids,
+                                             start_logs=torch.zeros(batch_size).type_as(b_start_pos).to(device),
+                                             end_logs=torch.tensor([seq_len - 1 for seq_len in b_input_lengths]).type_as(b_end_pos).to(device),
+                                             predictions=False,
+                                             )
+                  b_keys['q_word'] = get_q_word_keys(b_sent_pairs, q_words)
+
+                if detailed_results_sbj:
+                  b_keys['sbj'] = (b_sbj[:, 1] == 1).long()
+
+                if detailed_results_q_type:
+                  b_keys['q_type'] = get_q_type_keys(b_true_answers)
+
+                if detailed_results_domains:
+                  b_keys['domain'] = b_domains
 
-              if detailed_results_q_type:
-                results_per_q_type = compute_batch_score_per_q_type(
-                                                                    results_per_q_type,
-                                                                    b_true_answers,
-                                                                    b_pred_answers,
-                                                                    q_types,
-                                                                    )
-
-              if detailed_results_domains:
-                results_per_domain = compute_batch_score_per_domain(
-                                                                    results_per_domain=results_per_domain,
-                                                                    idx_to_domain=idx_to_domain,
-                                                                    b_true_answers=b_true_answers,
-                                                                    b_pred_answers=b_pred_answers,
-                                                                    b_domains=b_domains,
-                                                                    )
+                grouped_metrics.update(torch.tensor(b_exact, dtype=torch.long), **b_keys)
 
               ##################################################
               #### MODEL'S PREDICTED ANSWERS & TRUE ANSWERS ####
@@ -1842,8 +2014,7 @@ def test(
 
                   sbj_log_probas = F.log_softmax(sbj_logits, dim=1)
 
-                  batch_acc_test += accuracy(probas=sbj_log_probas, y_true=b_sbj, task='multi-way')  
-                  batch_f1_test += f1(probas=sbj_log_probas, y_true=b_sbj, task='multi-way')
+                  conf_mats[0].update(y_pred=hard_predictions(sbj_log_probas, task='multi-way'), y_true=b_sbj)
 
                   ###########################################
                   #### MODEL'S PREDICTIONS & TRUE LABELS ####
@@ -1861,13 +2032,20 @@ def test(
                   ###########################################
                   
               else:
-                  sbj_logits_a, sbj_logits_q = model(
-                                                     input_ids=b_input_ids,
-                                                     attention_masks=b_attn_masks,
-                                                     token_type_ids=b_token_type_ids,
-                                                     input_lengths=b_input_lengths,
-                                                     task='Sbj_Class',
-                                                     )
+                  if not isinstance(backend, type(None)):
+                      sbj_logits_a, sbj_logits_q = backend(
+                                                           input_ids=b_input_ids,
+                                                           attention_masks=b_attn_masks,
+                                                           task='Sbj_Class',
+                                                           )
+                  else:
+                      sbj_logits_a, sbj_logits_q = model(
+                                                         input_ids=b_input_ids,
+                                                         attention_masks=b_attn_masks,
+                                                         token_type_ids=b_token_type_ids,
+                                                         input_lengths=b_input_lengths,
+                                                         task='Sbj_Class',
+                                                         )
 
                   sbj_logits = torch.stack((sbj_logits_a, sbj_logits_q), dim=1)
                   
@@ -1875,19 +2053,15 @@ def test(
 
                   batch_loss_test += loss_func(sbj_logits, b_sbj)
 
-                  current_sbj_acc = 0
-                  current_sbj_f1 = 0
-
                   for k in range(b_sbj.size(1)):
 
-                    current_sbj_acc += accuracy(probas=torch.sigmoid(sbj_logits[:, k]), y_true=b_sbj[:, k], task='binary')  
-                    current_sbj_f1 += f1(probas=torch.sigmoid(sbj_logits[:, k]), y_true=b_sbj[:, k], task='binary')
+                    y_pred_sbj = hard_predictions(torch.sigmoid(sbj_logits[:, k]), task='binary')
+                    conf_mats[k].update(y_pred=y_pred_sbj, y_true=b_sbj[:, k])
 
                     if detailed_analysis_sbj_class:
-                      results_per_ds = get_detailed_scores(probas=torch.sigmoid(sbj_logits[:, k]), y_true=b_sbj[:, k], y_ds=b_ds, results_per_ds=results_per_ds)
-
-                  batch_acc_test += (current_sbj_acc / b_sbj.size(1))
-                  batch_f1_test += (current_sbj_f1 / b_sbj.size(1))
+                      y_true_sbj = (b_sbj[:, k] == 1).long()
+                      # key w.r.t. (dataset, sbj label) pairs (i.e., ds * 2 + sbj)
+                      grouped_metrics_ds.update(y_pred_sbj == y_true_sbj, ds_sbj=(b_ds == 1).long() * 2 + y_true_sbj)
 
             elif task == 'Domain_Classification':
 
@@ -1933,8 +2107,7 @@ def test(
 
               domain_log_probas = F.log_softmax(domain_logits, dim=1)
 
-              batch_acc_test += accuracy(probas=domain_log_probas, y_true=b_domains, task='multi-way')  
-              batch_f1_test += f1(probas=domain_log_probas, y_true=b_domains, task='multi-way')
+              conf_mats[0].update(y_pred=hard_predictions(domain_log_probas, task='multi-way'), y_true=b_domains)
 
               ###########################################
               #### MODEL'S PREDICTIONS & TRUE LABELS ####
@@ -1955,8 +2128,8 @@ def test(
             nb_test_examples += b_input_ids.size(0)
             nb_test_steps += 1
             
-            current_batch_f1 = 100 * (batch_f1_test / nb_test_examples) if task == 'QA' else 100 * (batch_f1_test / nb_test_steps)
-            current_batch_acc = 100 * (correct_answers_test / nb_test_examples) if task == 'QA' else 100 *(batch_acc_test / nb_test_steps)
+            current_batch_f1 = 100 * (batch_f1_test / nb_test_examples) if task == 'QA' else 100 * np.mean([conf_mat.f1() for conf_mat in conf_mats])
+            current_batch_acc = 100 * (correct_answers_test / nb_test_examples) if task == 'QA' else 100 * np.mean([conf_mat.accuracy() for conf_mat in conf_mats])
 
             print("--------------------------------------------")
             print("----- Current batch exact-match: {} % -----".format(round(current_batch_acc, 3)))
@@ -1977,11 +2150,23 @@ def test(
 
       print("----- Test QA exact-match: {} % -----".format(round(test_acc, 3)))
       print("----- Test QA F1: {} % -----".format(round(test_f1, 3)))
+
+      if aggregate_windows:
+        _, test_acc, test_f1 = aggregate_answers_across_windows(
+                                                                features=features,
+                                                                examples=examples,
+                                                                start_logits=all_start_logits[:nb_test_examples],
+                                                                end_logits=all_end_logits[:nb_test_examples],
+                                                                max_answer_length=max_answer_length,
+                                                                )
+
+        print("----- Test QA exact-match (per question): {} % -----".format(round(test_acc, 3)))
+        print("----- Test QA F1 (per question): {} % -----".format(round(test_f1, 3)))
     
     else:
 
-      test_acc = 100 * (batch_acc_test / nb_test_steps)
-      test_f1 = 100 * (batch_f1_test / nb_test_steps)
+      test_acc = 100 * np.mean([conf_mat.accuracy() for conf_mat in conf_mats])
+      test_f1 = 100 * np.mean([conf_mat.f1() for conf_mat in conf_mats])
 
       if task == 'Sbj_Classification':
 
@@ -1997,6 +2182,9 @@ def test(
     print()
 
     if detailed_analysis_sbj_class:
+      results_per_ds = defaultdict(dict)
+      for (ds, sbj), score in grouped_metrics_ds.results('ds_sbj').items():
+        results_per_ds[ds][sbj] = score
       results_per_ds = compute_acc_nested(results_per_ds)
       return test_loss, test_acc, test_f1, results_per_ds
 
@@ -2013,19 +2201,22 @@ def test(
       return test_loss, test_acc, test_f1, erroneous_preds_distribution
 
     elif task == 'QA' and detailed_results_sbj:
-      results_sbj = sort_dict(compute_acc(results_sbj))
+      ## NOTE: if n_bootstrap > 0, exact-match scores are returned together with bootstrap confidence intervals ##
+      results_sbj = grouped_metrics.results('sbj')
+      results_sbj = compute_acc_with_cis(results_sbj, n_bootstrap) if n_bootstrap > 0 else sort_dict(compute_acc(results_sbj))
       return test_loss, test_acc, test_f1, results_sbj
 
     elif task == 'QA' and detailed_results_q_type:
-      results_per_q_type = sort_dict(compute_acc(results_per_q_type))
+      results_per_q_type = sort_dict(compute_acc(grouped_metrics.results('q_type')))
       return test_loss, test_acc, test_f1, results_per_q_type
 
     elif task == 'QA' and detailed_results_domains:
-      results_per_domain = sort_dict(compute_acc(results_per_domain))
+      results_per_domain = grouped_metrics.results('domain')
+      results_per_domain = compute_acc_with_cis(results_per_domain, n_bootstrap) if n_bootstrap > 0 else sort_dict(compute_acc(results_per_domain))
       return test_loss, test_acc, test_f1, results_per_domain
 
     elif task == 'QA' and detailed_results_q_words:
-      results_per_q_word = sort_dict(compute_acc(results_per_q_word))
+      results_per_q_word = sort_dict(compute_acc(grouped_metrics.results('q_word')))
       return test_loss, test_acc, test_f1, results_per_q_word
 
     elif task == 'QA' and estimate_preds_wrt_hiddens:
@@ -2070,6 +2261,10 @@ def test(
       true_labels = np.array(true_labels).flatten().tolist()
       return test_loss, test_acc, test_f1, predictions, true_labels, feat_reps
 
+    elif output_conf_mat:
+      # binary predictions w.r.t. both answer and question subjectivity are summed up in the same (2 x 2) confusion matrix
+      return test_loss, test_acc, test_f1, sum(conf_mat.to_numpy() for conf_mat in conf_mats)
+
     else:
       return test_loss, test_acc, test_f1
 
@@ -2116,8 +2311,12 @@ def train_all(
     val_accs_all_tasks = []
     val_f1s_all_tasks = []
 
+    # every metric list is registered in history s.t. it can be stored in (and restored from) checkpoints
+    history = {'batch_losses': batch_losses, 'val_losses_all_tasks': val_losses_all_tasks, 'val_accs_all_tasks': val_accs_all_tasks, 'val_f1s_all_tasks': val_f1s_all_tasks}
+
     qa_loss_func = nn.CrossEntropyLoss()
     batch_accs_qa, batch_f1s_qa = [], []
+    history.update(batch_accs_qa=batch_accs_qa, batch_f1s_qa=batch_f1s_qa)
 
     if args['dataset'] == 'combined':
         assert isinstance(qa_type_weights, torch.Tensor), 'Tensor of class weights for question-answer types is not provided'
@@ -2130,10 +2329,13 @@ def train_all(
         sbj_loss_func = nn.BCEWithLogitsLoss(pos_weight=torch.ones(2).to(device))
 
     batch_accs_sbj, batch_f1s_sbj = [], []
+
+    history.update(batch_accs_sbj=batch_accs_sbj, batch_f1s_sbj=batch_f1s_sbj)
       
     assert isinstance(domain_weights, torch.Tensor), 'Tensor of class weights for different domains is not provided'
     domain_loss_func = nn.CrossEntropyLoss(weight=domain_weights.to(device))
     batch_accs_domain, batch_f1s_domain = [], []
+    history.update(batch_accs_domain=batch_accs_domain, batch_f1s_domain=batch_f1s_domain)
 
     tasks = ['Domain_Class', 'Sbj_Class', 'QA']
     running_tasks = tasks[:]
@@ -2153,8 +2355,34 @@ def train_all(
     sbj_logits_all = []
     domain_logits_all = []
 
+    # running (per epoch) losses and exact-match scores (stored in checkpoints to resume an interrupted epoch)
+    running_metrics = {}
+
+    ## NOTE: auxiliary heads accumulate confusion counts on device every step, acc and F1 are only reduced when they are logged (same definition as in val and test) ##
+    conf_mats = {'Sbj_Class': [ConfusionMatrix(2) for _ in range(2)], 'Domain_Class': [ConfusionMatrix(args['n_domains'])]}
+
+    #################################################
+    ######## RESUME FROM LATEST CHECKPOINT ##########
+    #################################################
+
+    checkpointer = create_checkpointer(args)
+    resume_state = checkpointer.load() if not isinstance(checkpointer, type(None)) else None
+    start_task, start_epoch, start_step = 0, 0, 0
+
+    if not isinstance(resume_state, type(None)):
+        for name, values in resume_state['history'].items():
+            history[name].extend(values)
+        # model's output logits for auxiliary tasks are required for QA (soft targets regime)
+        sbj_logits_all.extend([sbj_logits.to(device) for sbj_logits in resume_state['sbj_logits_all']])
+        domain_logits_all.extend([domain_logits.to(device) for domain_logits in resume_state['domain_logits_all']])
+        start_task, start_epoch, start_step = resume_state['task_idx'], resume_state['epoch'], resume_state['step'] + 1
+
     for i, task in enumerate(tqdm(tasks, desc="Task")):
 
+        # skip tasks the model was already fine-tuned on before training was interrupted
+        if i < start_task:
+            continue
+
         #############################################################################################################################
         ################################################ SEQUENTIAL TRANSFER ########################################################
         ############## Fine-tune model on every task sequentially (i.e., sequential transfer / soft-parameter sharing) ##############
@@ -2181,12 +2409,14 @@ def train_all(
         # initialize task-specific optimizers on the fly
         optimizer = create_optimizer(model=model, task=task, eta=5e-5 if task == 'QA' else args['lr_adam'])
 
+        # learning rate is decreased linearly for all tasks but the first (i.e., there is no scheduler for the first task)
+        schedulers = {}
         if i > 0:
-            scheduler = get_linear_schedule_with_warmup(
-                                                        optimizer, 
-                                                        num_warmup_steps=args['warmup_steps'], 
-                                                        num_training_steps=args['t_total'],
-                                                        )
+            schedulers[task] = get_linear_schedule_with_warmup(
+                                                              optimizer, 
+                                                              num_warmup_steps=args['warmup_steps'], 
+                                                              num_training_steps=args['t_total'],
+                                                              )
 
         eval_round = False
         stop_training = False
@@ -2213,28 +2443,61 @@ def train_all(
         val_accs = []
         val_f1s = []
 
+        # evaluation cadence, best dev loss and patience are tracked separately for each task
+        eval_controller = create_eval_controller(args, steps_until_eval if args['n_evals'] == 'multiple_per_epoch' else 0)
+
+        if not isinstance(resume_state, type(None)):
+            model.load_state_dict(resume_state['model'])
+            optimizer.load_state_dict(resume_state['optimizer'])
+            for current_task, scheduler in schedulers.items():
+                scheduler.load_state_dict(resume_state['schedulers'][current_task])
+            val_losses.extend(resume_state['val_losses'])
+            val_accs.extend(resume_state['val_accs'])
+            val_f1s.extend(resume_state['val_f1s'])
+            eval_controller.load_state_dict(resume_state['eval_controller'])
+
         for j, epoch in enumerate(trange(args['n_epochs'],  desc="Epoch")):
 
+            # skip epochs that were completed before training was interrupted
+            if i == start_task and epoch < start_epoch:
+                continue
+
             # make sure we fine-tune model on every task sequentially
             model.train()
             
+            # metrics of the previous task (or epoch) are discarded
+            running_metrics.clear()
+
             if task == 'QA':
                 args['task'] = task
-                correct_answers, batch_f1 = 0, 0
+                running_metrics.update(correct_answers=0, batch_f1=0)
             
             elif task == 'Sbj_Class':
                 args['task'] = 'Sbj_Classification'
-                batch_acc_sbj, batch_f1_sbj = 0, 0
             
             elif task == 'Domain_Class':
                 args['task'] = 'Domain_Classification'
-                batch_acc_domain, batch_f1_domain = 0, 0
 
-            tr_loss = 0
-            nb_tr_examples, nb_tr_steps = 0, 0
+            for conf_mat in conf_mats.get(task, []):
+                conf_mat.reset()
+
+            running_metrics.update(tr_loss=0, nb_tr_examples=0, nb_tr_steps=0)
+
+            if not isinstance(resume_state, type(None)):
+                # restore running metrics (and confusion counts) of interrupted epoch
+                running_metrics.update(resume_state['running_metrics'])
+                for current_task, task_conf_mats in conf_mats.items():
+                    for conf_mat, state in zip(task_conf_mats, resume_state['conf_mats'][current_task]):
+                        conf_mat.load_state_dict(state)
+                running_tasks = resume_state['running_tasks']
+                set_rng_states(resume_state['rng_states'])
+                resume_state = None
+
+            # skip steps that were already performed before training was interrupted
+            first_step = start_step if i == start_task and epoch == start_epoch else 0
 
             # n_steps == n_updates per epoch (n_iters = n_epochs * n_steps per epoch)
-            for step, batch in enumerate(tqdm(train_dl, desc="Step")):
+            for step, batch in enumerate(tqdm(resume_batches(train_dl, first_step), desc="Step", total=len(train_dl) - first_step), start=first_step):
                 
                 batch = tuple(t.to(device) for t in batch)
         
@@ -2306,14 +2569,14 @@ def train_all(
                                                predictions=False,
                     )
 
-                    correct_answers += compute_exact_batch(true_answers, pred_answers)
-                    batch_f1 += compute_f1_batch(true_answers, pred_answers)
+                    running_metrics['correct_answers'] += compute_exact_batch(true_answers, pred_answers)
+                    running_metrics['batch_f1'] += compute_f1_batch(true_answers, pred_answers)
 
-                    nb_tr_examples += b_input_ids.size(0)
-                    nb_tr_steps += 1
+                    running_metrics['nb_tr_examples'] += b_input_ids.size(0)
+                    running_metrics['nb_tr_steps'] += 1
 
-                    current_batch_acc = round(100 * (correct_answers / nb_tr_examples), 3)
-                    current_batch_f1 = round(100 * (batch_f1 / nb_tr_examples), 3)
+                    current_batch_acc = round(100 * (running_metrics['correct_answers'] / running_metrics['nb_tr_examples']), 3)
+                    current_batch_f1 = round(100 * (running_metrics['batch_f1'] / running_metrics['nb_tr_examples']), 3)
 
                     print("=================================================")
                     print("===== Current batch {} exact-match: {} % =====".format(task, current_batch_acc))
@@ -2367,18 +2630,8 @@ def train_all(
                             else:
                                 batch_loss += loss_func(sbj_logits, b_sbj)
                                 
-                            current_sbj_acc = 0
-                            current_sbj_f1 = 0
-                            
                             for k in range(b_sbj.size(1)):
-                                current_sbj_acc += accuracy(probas=torch.sigmoid(sbj_logits[:, k]), y_true=b_sbj[:, k], task='binary')  
-                                current_sbj_f1 += f1(probas=torch.sigmoid(sbj_logits[:, k]), y_true=b_sbj[:, k], task='binary')
-
-                            batch_acc_sbj += (current_sbj_acc / b_sbj.size(1))
-                            batch_f1_sbj += (current_sbj_f1 / b_sbj.size(1))
-
-                            batch_acc_aux = batch_acc_sbj
-                            batch_f1_aux = batch_f1_sbj
+                                conf_mats[task][k].update(y_pred=hard_predictions(torch.sigmoid(sbj_logits[:, k]), task='binary'), y_true=b_sbj[:, k])
 
                     elif task == 'Domain_Class':
                         # unpack inputs from main data loader to perform context-domain classification on (q, c) sequence pairs
@@ -2413,28 +2666,24 @@ def train_all(
                             else:
                                 batch_loss += loss_func(domain_logits, b_domains)
                                 
-                            batch_acc_domain += accuracy(probas=F.log_softmax(domain_logits, dim=1), y_true=b_domains, task='multi-way')
-                            batch_f1_domain += f1(probas=F.log_softmax(domain_logits, dim=1), y_true=b_domains, task='multi-way')
-
-                            batch_acc_aux = batch_acc_domain
-                            batch_f1_aux = batch_f1_domain
+                            conf_mats[task][0].update(y_pred=hard_predictions(domain_logits, task='multi-way'), y_true=b_domains)
           
                     if not eval_round:
-                        nb_tr_examples += b_input_ids.size(0)
-                        nb_tr_steps += 1
-                        
-                        current_batch_acc_aux = round(100 * (batch_acc_aux / nb_tr_steps), 3)
-                        current_batch_f1_aux = round(100 * (batch_f1_aux / nb_tr_steps), 3)
-
-                        print("============================================")
-                        print("===== Current batch {} acc: {} % =====".format(task, current_batch_acc_aux))
-                        print("===== Current batch {} F1: {} % =====".format(task, current_batch_f1_aux))
-                        print("============================================")
-                        print()
+                        running_metrics['nb_tr_examples'] += b_input_ids.size(0)
+                        running_metrics['nb_tr_steps'] += 1
 
                         # we don't want to save F1 scores and exact-match accuracies at the very beginning of training
                         if step > (steps_until_eval // 2):
                             if task in running_tasks:
+                                # acc and F1 are reduced from the running (per epoch) confusion counts once per logging interval
+                                current_batch_acc_aux, current_batch_f1_aux = reduce_conf_mats(conf_mats[task])
+
+                                print("============================================")
+                                print("===== Current {} acc: {} % =====".format(task, current_batch_acc_aux))
+                                print("===== Current {} F1: {} % =====".format(task, current_batch_f1_aux))
+                                print("============================================")
+                                print()
+
                                 if task == 'Sbj_Class':
                                     batch_accs_sbj.append(current_batch_acc_aux)
                                     batch_f1s_sbj.append(current_batch_f1_aux)
@@ -2454,7 +2703,7 @@ def train_all(
                     ## in any MTL setting, we exclusively want to store QA losses
                     ## there's no need to store losses for auxiliary tasks since we want to observe the effect of sequential transfer on main task
                     if task == 'QA':
-                        tr_loss += batch_loss.item()
+                        running_metrics['tr_loss'] += batch_loss.item()
                         batch_losses.append(batch_loss.item())
                         
                     # backpropagate error
@@ -2467,14 +2716,14 @@ def train_all(
                     optimizer.step()
 
                     # decrease learning rate linearly for all tasks but the first
-                    if i > 0:
+                    for scheduler in schedulers.values():
                         scheduler.step()
 
                     # after each training step, zero-out gradients
                     optimizer.zero_grad()
 
                     if args['n_evals'] == 'multiple_per_epoch':
-                        if step > 0 and step % steps_until_eval == 0:
+                        if eval_controller.is_due(step):
                             if task == 'QA' and args['evaluation_strategy'] == 'no_aux_targets':
                                 # save model's current weights for aux targets (in current setting, we evaluate model without information about aux targets)
                                 current_main_weights = model.qa_head.fc_qa.weight[:, :768]
@@ -2494,7 +2743,7 @@ def train_all(
                                                                        loss_func=loss_func,
                                                                        sequential_transfer=True,
                                                                        evaluation_strategy=args['evaluation_strategy'],
-
+                                                                       eval_controller=eval_controller,
                             )
                             if task == 'QA' and args['evaluation_strategy'] == 'no_aux_targets':
                                 with torch.no_grad():
@@ -2508,32 +2757,53 @@ def train_all(
                             # after evaluation on dev set, set model back to train mode
                             model.train()
 
-                            # we want to train the model at least for one epoch
-                            if epoch > 0 and early_stopping:
-                                # if loss has not decreased for the past args['early_stopping_thresh'] eval steps, stop training early
-                                if np.argmin(val_losses[::-1]) > args['early_stopping_thresh']:
-                                    stop_training = True
-                                    break
+                            # if loss has not decreased for the past args['early_stopping_thresh'] eval steps (and model was trained for at least one epoch), stop training early
+                            if early_stopping and eval_controller.should_stop(epoch):
+                                stop_training = True
+                                break
+
+                    # periodically store full training state (written to disk off the training thread)
+                    if not isinstance(checkpointer, type(None)) and checkpointer.is_due():
+                        checkpointer.save({
+                                           'model': model.state_dict(),
+                                           'optimizer': optimizer.state_dict(),
+                                           'schedulers': {current_task: scheduler.state_dict() for current_task, scheduler in schedulers.items()},
+                                           'history': history,
+                                           'val_losses': val_losses,
+                                           'val_accs': val_accs,
+                                           'val_f1s': val_f1s,
+                                           'eval_controller': eval_controller.state_dict(),
+                                           'sbj_logits_all': sbj_logits_all,
+                                           'domain_logits_all': domain_logits_all,
+                                           'running_metrics': running_metrics,
+                                           'conf_mats': {current_task: [conf_mat.state_dict() for conf_mat in task_conf_mats] for current_task, task_conf_mats in conf_mats.items()},
+                                           'running_tasks': running_tasks,
+                                           'task_idx': i,
+                                           'epoch': epoch,
+                                           'step': step,
+                                           })
 
             if not eval_round:
-                tr_loss /= nb_tr_steps
+                running_metrics['tr_loss'] /= running_metrics['nb_tr_steps']
                 print("=====================================")
                 print("========== EPOCH {} ==========".format(epoch + 1))
-                print("===== Train loss: {} =====".format(round(tr_loss, 3)))
+                print("===== Train loss: {} =====".format(round(running_metrics['tr_loss'], 3)))
 
                 if args['task'] == 'QA':
-                    train_exact_match = round(100 * (correct_answers / nb_tr_examples), 3)
-                    train_f1 = round(100 * (batch_f1 / nb_tr_examples), 3)
+                    train_exact_match = round(100 * (running_metrics['correct_answers'] / running_metrics['nb_tr_examples']), 3)
+                    train_f1 = round(100 * (running_metrics['batch_f1'] / running_metrics['nb_tr_examples']), 3)
                     print("===== Train {} exact-match: {} % =====".format(args['task'], train_exact_match))
                     print("===== Train {} F1: {} % =====".format(args['task'], train_f1))
 
                 elif args['task'] == 'Sbj_Classification':
-                    print("===== Train Sbj acc: {} % =====".format(batch_accs_sbj[-1]))
-                    print("===== Train Sbj F1: {} % =====".format(batch_f1s_sbj[-1]))
+                    train_acc_aux, train_f1_aux = reduce_conf_mats(conf_mats['Sbj_Class'])
+                    print("===== Train Sbj acc: {} % =====".format(train_acc_aux))
+                    print("===== Train Sbj F1: {} % =====".format(train_f1_aux))
 
                 elif args['task'] == 'Domain_Classification':
-                    print("===== Train Domain acc: {} % =====".format(batch_accs_domain[-1]))
-                    print("===== Train Domain F1: {} % =====".format(batch_f1s_domain[-1]))
+                    train_acc_aux, train_f1_aux = reduce_conf_mats(conf_mats['Domain_Class'])
+                    print("===== Train Domain acc: {} % =====".format(train_acc_aux))
+                    print("===== Train Domain F1: {} % =====".format(train_f1_aux))
 
                 print("=====================================")
                 print()
@@ -2543,7 +2813,9 @@ def train_all(
                         # save model's current weights for aux targets (we evaluate model without information about aux targets)
                         current_main_weights = model.qa_head.fc_qa.weight[:, :768]
                         current_aux_weights = model.qa_head.fc_qa.weight[:, 768:]
-                            
+
+                    # evaluations at the end of an epoch are always performed on the full dev set
+                    eval_controller.next_check(full=True)
                     val_losses, val_accs, val_f1s, model = val(
                                                                model=model,
                                                                tokenizer=tokenizer,
@@ -2558,6 +2830,7 @@ def train_all(
                                                                loss_func=loss_func,
                                                                sequential_transfer=True,
                                                                evaluation_strategy=args['evaluation_strategy'],
+                                                               eval_controller=eval_controller,
                                                                )
 
                     if task == 'QA' and args['evaluation_strategy'] == 'no_aux_targets':
@@ -2575,7 +2848,7 @@ def train_all(
                     if epoch > 0 and early_stopping:
                         if val_losses[-1] > val_losses[-2] or epoch >= args['n_epochs'] - 2:
                             print("===============================================")
-                            print("==== Stopping training after {} steps ====".format(nb_tr_steps + len(train_dl) * epoch))
+                            print("==== Stopping training after {} steps ====".format(running_metrics['nb_tr_steps'] + len(train_dl) * epoch))
                             print("===============================================")
                             print()
 
@@ -2594,9 +2867,46 @@ def train_all(
                         else:
                             break
                 else:
+                    # evaluate on the full dev set at the end of an epoch (and before stopping early), if frequent checks were only performed on the dev subsample
+                    if eval_controller.full_eval_pending():
+                        if task == 'QA' and args['evaluation_strategy'] == 'no_aux_targets':
+                            # save model's current weights for aux targets (we evaluate model without information about aux targets)
+                            current_main_weights = model.qa_head.fc_qa.weight[:, :768]
+                            current_aux_weights = model.qa_head.fc_qa.weight[:, 768:]
+
+                        eval_controller.next_check(full=True)
+                        val_losses, val_accs, val_f1s, model = val(
+                                                                   model=model,
+                                                                   tokenizer=tokenizer,
+                                                                   val_dl=val_dl,
+                                                                   args=args,
+                                                                   current_step=step,
+                                                                   epoch=epoch,
+                                                                   batch_size=batch_size,
+                                                                   val_losses=val_losses,
+                                                                   val_accs=val_accs,
+                                                                   val_f1s=val_f1s,
+                                                                   loss_func=loss_func,
+                                                                   sequential_transfer=True,
+                                                                   evaluation_strategy=args['evaluation_strategy'],
+                                                                   eval_controller=eval_controller,
+                                                                   )
+
+                        if task == 'QA' and args['evaluation_strategy'] == 'no_aux_targets':
+                            with torch.no_grad():
+                                model.qa_head.fc_qa.in_features += add_features
+                                model.qa_head.fc_qa.weight = nn.Parameter(torch.cat((current_main_weights.to(device), current_aux_weights.to(device)), 1))
+
+                        # we want to store train exact-match accuracies and F1 scores for each task
+                        # as often as we evaluate model on validation set
+                        running_tasks = tasks[:]
+
+                        # after evaluation on dev set, move model back to train mode
+                        model.train()
+
                     if stop_training or epoch >= args['n_epochs'] - 2:
                         print("===============================================")
-                        print("==== Stopping training after {} steps ====".format(nb_tr_steps + len(train_dl) * epoch))
+                        print("==== Stopping training after {} steps ====".format(running_metrics['nb_tr_steps'] + len(train_dl) * epoch))
                         print("===============================================")
                         print()
 
@@ -2621,6 +2931,10 @@ def train_all(
                 print()
                 break
 
+    # make sure that last checkpoint is written to disk
+    if not isinstance(checkpointer, type(None)):
+        checkpointer.wait()
+
     # return model in eval mode
     model.eval()
     return batch_losses, batch_accs_qa, batch_f1s_qa, batch_accs_sbj, batch_f1s_sbj, batch_accs_domain, batch_f1s_domain, val_losses_all_tasks, val_accs_all_tasks, val_f1s_all_tasks, model
\ No newline at end of file
@@ -123,8 +123,8 @@ def get_random_sent_hidden_reps(
     
     special_tok_indices = np.array(special_tok_indices)
     
-    #extract feat reps for random sent on token level and convert to NumPy matrix
-    feat_reps_per_layer = {l: np.array(hiddens)[rnd_sent_idx] for l, hiddens in feat_reps.items()}
+    #extract feat reps for random sent on token level and convert to NumPy matrix (only the random sent must be converted)
+    feat_reps_per_layer = {l: np.array(hiddens[rnd_sent_idx]) for l, hiddens in feat_reps.items()}
     
     # create synthetic labels for token sequence
     T = len(rnd_sent)
@@ -148,6 +148,12 @@ if __name__ == '__main__':
             help='Define dataset split. Must be one of {train, test}')
     parser.add_argument('--text_annotations', action='store_true',
             help='If provided, annotate token labels along each data point in the projected hidden representations')
+    parser.add_argument('--workers', type=int, default=1,
+            help='Number of worker processes across which projections and plots (i.e., layers x sentences) are distributed')
+    parser.add_argument('--dpi', type=int, default=300,
+            help='Resolution of rendered plots (the higher the dpi the better the resolution of the plot)')
+    parser.add_argument('--fmt', type=str, default='png',
+            help='File format of rendered plots. Must be one of {png, pdf, svg}')
 
     args = parser.parse_args()
 
@@ -170,35 +176,56 @@ if __name__ == '__main__':
     rnd_seed = rnd_state
     file_name_copy = file_name[:]
     
+    #draw all random sentences first s.t. projections w.r.t. every (sentence, layer) pair can be computed in parallel
+    sents = []
     for k, pred in enumerate(predictions):
 
         if k > 0 and k % 2 == 0:
             rnd_seed += 1
         
         feat_reps_per_layer, token_labels, rnd_sent = get_random_sent_hidden_reps(results, pred, rnd_seed)
+        sents.append((feat_reps_per_layer, token_labels, rnd_sent))
+
+    print("================================================================")
+    print("=========== Started projecting hidden reps ====================")
+    print("================================================================")
+    print()
+    #NOTE: projections are cached on disk (re-running the script with the same hyperparameters only renders plots)
+    projections = compute_projections(
+                                      feat_reps_list=[feat_reps for feat_reps_per_layer, _, _ in sents for feat_reps in feat_reps_per_layer.values()],
+                                      retained_variance=retained_variance,
+                                      rnd_state=rnd_state,
+                                      workers=args.workers,
+                                      )
+    
+    #collect render jobs for all sentences s.t. plots w.r.t. every (sentence, layer) pair can be rendered in parallel
+    render_jobs = []
+    for k, (pred, (feat_reps_per_layer, token_labels, rnd_sent)) in enumerate(zip(predictions, sents)):
+        layers = list(feat_reps_per_layer.keys())
+        projections_per_layer = dict(zip(layers, projections[k*len(layers):(k+1)*len(layers)]))
         
         file_name = file_name_copy + '_' + str(retained_variance).lstrip('0.') + '_' + 'var' + '_' + pred + '_' + str(k)
-
-        print("================================================================")
-        print("=========== Started plotting: {} prediction =============".format(pred))
-        print("================================================================")
-        print()
-        plot_feat_reps_per_layer(
-                                 y_true=token_labels,
-                                 feat_reps_per_layer=feat_reps_per_layer,
-                                 class_to_idx=class_to_idx,
-                                 retained_variance=retained_variance,
-                                 rnd_state=rnd_state,
-                                 file_name=file_name,
-                                 source=args.source,
-                                 version=args.version,
-                                 combined_ds=combined_ds,
-                                 plot_qa=True,
-                                 sent_pair=rnd_sent,
-                                 text_annotations=args.text_annotations,
-
-        )
-        print("================================================================")
-        print("=========== Finished plotting: {} prediction =============".format(pred))
-        print("================================================================")
-        print()
+        render_jobs.extend(get_render_jobs_per_layer(
+                                                     y_true=token_labels,
+                                                     projections_per_layer=projections_per_layer,
+                                                     class_to_idx=class_to_idx,
+                                                     file_name=file_name,
+                                                     source=args.source,
+                                                     version=args.version,
+                                                     combined_ds=combined_ds,
+                                                     plot_qa=True,
+                                                     sent_pair=rnd_sent,
+                                                     text_annotations=args.text_annotations,
+                                                     dpi=args.dpi,
+                                                     fmt=args.fmt,
+        ))
+
+    print("================================================================")
+    print("=========== Started plotting: {} figures =============".format(len(render_jobs)))
+    print("================================================================")
+    print()
+    render_figures(render_jobs, workers=args.workers)
+    print("================================================================")
+    print("=========== Finished plotting: {} figures =============".format(len(render_jobs)))
+    print("================================================================")
+    print()
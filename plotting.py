@@ -2,10 +2,16 @@
 # -*- coding: utf-8 -*-
 
 __all__ = [
+           'compute_projections',
            'conf_mat',
            'plot_confusion_matrix',
+           'get_render_jobs_per_layer',
+           'new_figure',
            'plot_feat_reps_per_layer',
            'plot_reps_projected_via_tsne',
+           'plot_task_distribution',
+           'project_feat_reps',
+           'render_figures',
 ]
 
 import numpy as np
@@ -14,12 +20,16 @@ import matplotlib as mpl
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+import hashlib
 import json
+import multiprocessing
 import os
 import re
 
 from collections import defaultdict
 from itertools import islice, product
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from mpl_toolkits.mplot3d import Axes3D
 
 from sklearn.decomposition import PCA
@@ -31,6 +41,67 @@ from sklearn.utils.multiclass import unique_labels
 from tqdm import trange, tqdm
 
 
+###########################################
+############### RENDERING ################
+###########################################
+
+def new_figure(
+               figsize:tuple,
+               dpi:int=300,
+):
+    #NOTE: figures are attached to an Agg canvas directly (i.e., no pyplot global state) s.t. they can be rendered concurrently and without a display
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+def save_figure(
+                fig,
+                file_path:str,
+                dpi:int=300,
+                fmt:str='png',
+):
+    #fmt must be a raster (e.g., png) or vector (e.g., pdf, svg) format supported by matplotlib (for vector formats, dpi only affects rasterized artists)
+    fig.tight_layout()
+    fig.savefig(file_path + '.' + fmt, dpi=dpi, format=fmt)
+
+def _render_figure(render_job:tuple):
+    plot_func, kwargs = render_job
+    return plot_func(**kwargs)
+
+def render_figures(
+                   render_jobs:list,
+                   workers:int=1,
+):
+    """
+        - render a list of (plot function, kwargs) jobs (e.g., all layers of several sentences)
+        - figures are independent of each other and are hence rendered in parallel worker processes
+    """
+    if workers > 1 and len(render_jobs) > 1:
+        with multiprocessing.Pool(min(workers, len(render_jobs))) as pool:
+            return pool.map(_render_figure, render_jobs)
+    return list(map(_render_figure, render_jobs))
+
+def plot_task_distribution(
+                           task_distrib:dict,
+                           tasks:list,
+                           file_name:str,
+                           dpi:int=300,
+                           fmt:str='png',
+):
+    fig = new_figure(figsize=(6, 4), dpi=dpi)
+    ax = fig.add_subplot(111)
+    ax.bar(tasks, [task_distrib[task] for task in tasks], alpha=0.5, edgecolor='black')
+    ax.set_xticks(range(len(tasks)))
+    ax.set_xticklabels(tasks)
+    ax.set_xlabel('Tasks', fontsize=12)
+    ax.set_ylabel('Frequency per epoch', fontsize=12)
+    ax.set_title('Task distribution in MTL setting')
+
+    PATH = './plots/task_distrib/'
+    if not os.path.exists(PATH):
+        os.makedirs(PATH, exist_ok=True)
+    save_figure(fig, PATH + file_name, dpi=dpi, fmt=fmt)
+
 ###########################################
 ################## t-SNE ##################
 ###########################################
@@ -50,11 +121,13 @@ def plot_reps_projected_via_tsne(
                                  sent_pair:list=None,
                                  support_labels=None,
                                  text_annotations:bool=False,
+                                 dpi:int=300,
+                                 fmt:str='png',
 ):
-    #NOTE: uncomment line below if you want to use a dark background for plots
+    #NOTE: uncomment line below if you want to use a dark background for plots (style must be set before the figure is created)
     #plt.style.use('dark_background')
-    plt.figure(figsize=(16,10), dpi=300) #NOTE: the higher the dpi the better the resolution of the plot
-    ax = plt.subplot(111)
+    fig = new_figure(figsize=(16,10), dpi=dpi) #NOTE: the higher the dpi the better the resolution of the plot
+    ax = fig.add_subplot(111)
     
     dataset = '$D_{SubjQA} \: \cup \: D_{SQuAD}$' if combined_ds else '$D_{SubjQA}$'
     
@@ -139,13 +212,116 @@ def plot_reps_projected_via_tsne(
     
     PATH = './plots/hidden_reps/layer_wise/' + subfolder + source.lower() + '/' + version.lower() + '/'
     if not os.path.exists(PATH):
-        os.makedirs(PATH)
+        os.makedirs(PATH, exist_ok=True)
 
     layer = n_layer.split('_')
     layer = ' '.join(layer).capitalize()
-    plt.tight_layout()
-    plt.savefig(PATH + file_name + '_' + n_layer.lower() + '.png')
-    plt.close()
+    save_figure(fig, PATH + file_name + '_' + n_layer.lower(), dpi=dpi, fmt=fmt)
+
+###########################################
+########### PROJECTION STAGE #############
+###########################################
+
+def get_projection_key(
+                       feat_reps:np.ndarray,
+                       retained_variance:float,
+                       rnd_state:int,
+):
+    #projections are identified by a hash of the hidden reps and the projection hyperparameters
+    feat_reps = np.ascontiguousarray(feat_reps)
+    key = hashlib.sha1(feat_reps.tobytes())
+    key.update(str((feat_reps.shape, feat_reps.dtype.str, retained_variance, rnd_state)).encode('utf-8'))
+    return key.hexdigest()
+
+def project_feat_reps(
+                      feat_reps:np.ndarray,
+                      retained_variance:float,
+                      rnd_state:int,
+                      cache_dir:str='./plots/hidden_reps/projections/',
+):
+    """
+        - project hidden reps onto n principal components that explain XY% of the original representation's variance and subsequently into R^2 via t-SNE
+        - 2-D coordinates are cached on disk (keyed on hidden reps and hyperparameters) s.t. every projection is computed only once
+    """
+    feat_reps = np.asarray(feat_reps)
+    cache_file = cache_dir + get_projection_key(feat_reps, retained_variance, rnd_state) + '.npy'
+    if os.path.exists(cache_file):
+        return np.load(cache_file)
+
+    #NOTE: uncomment line below, if you don't want to exploit t-SNE
+    #pca = PCA(n_components=2, svd_solver='auto', random_state=rnd_state)
+    pca = PCA(n_components=retained_variance, svd_solver='full', random_state=rnd_state)
+    transformed_feats = pca.fit_transform(feat_reps)
+    #initiliase TSNE
+    tsne = TSNE(n_components=2, random_state=rnd_state)
+    #transform projected hidden reps via t-SNE into R^2
+    tsne_embeds = tsne.fit_transform(transformed_feats)
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    #write to temporary file first s.t. concurrent workers never read a partially written projection
+    tmp_file = cache_file[:-len('.npy')] + '_' + str(os.getpid()) + '.tmp.npy'
+    np.save(tmp_file, tsne_embeds)
+    os.replace(tmp_file, cache_file)
+    return tsne_embeds
+
+def _project_feat_reps(args:tuple):
+    return project_feat_reps(*args)
+
+def compute_projections(
+                        feat_reps_list:list,
+                        retained_variance:float,
+                        rnd_state:int,
+                        workers:int=1,
+                        cache_dir:str='./plots/hidden_reps/projections/',
+):
+    """
+        - project a list of hidden rep matrices (e.g., all layers of several sentences) into R^2
+        - projections are independent of each other and are hence computed in parallel worker processes
+    """
+    jobs = [(feat_reps, retained_variance, rnd_state, cache_dir) for feat_reps in feat_reps_list]
+    if workers > 1 and len(jobs) > 1:
+        with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+            return pool.map(_project_feat_reps, jobs)
+    return list(map(_project_feat_reps, jobs))
+
+def get_render_jobs_per_layer(
+                              y_true:np.ndarray,
+                              projections_per_layer:dict,
+                              class_to_idx:dict,
+                              file_name:str,
+                              source:str,
+                              version:str,
+                              combined_ds:bool=False,
+                              plot_qa:bool=False,
+                              sent_pair:list=None,
+                              support_labels=None,
+                              text_annotations:bool=False,
+                              dpi:int=300,
+                              fmt:str='png',
+):
+    #one render job per layer (plots are rendered from 2-D coordinates only)
+    render_jobs = []
+    for layer, tsne_embeds in projections_per_layer.items():
+        render_jobs.append((plot_reps_projected_via_tsne, dict(
+                                                               tsne_embed_x=tsne_embeds[:, 0],
+                                                               tsne_embed_y=tsne_embeds[:, 1],
+                                                               y_true=y_true,
+                                                               class_to_idx=class_to_idx,
+                                                               file_name=file_name,
+                                                               source=source,
+                                                               version=version,
+                                                               combined_ds=combined_ds,
+                                                               layer_wise=True,
+                                                               n_layer=layer,
+                                                               plot_qa=plot_qa,
+                                                               sent_pair=sent_pair,
+                                                               support_labels=support_labels,
+                                                               text_annotations=text_annotations,
+                                                               dpi=dpi,
+                                                               fmt=fmt,
+                                                               )))
+    return render_jobs
 
 def plot_feat_reps_per_layer(
                              y_true:np.ndarray,
@@ -161,42 +337,57 @@ def plot_feat_reps_per_layer(
                              sent_pair:list=None,
                              support_labels=None,
                              text_annotations:bool=False,
+                             projections_per_layer=None,
+                             workers:int=1,
+                             dpi:int=300,
+                             fmt:str='png',
 ):
-    for layer, feat_reps in feat_reps_per_layer.items():
-        #NOTE: uncomment line below, if you don't want to exploit t-SNE
-        #pca = PCA(n_components=2, svd_solver='auto', random_state=rnd_state)
-        pca = PCA(n_components=retained_variance, svd_solver='full', random_state=rnd_state)
-        #project hidden reps onto n principal components that explain XY% of the original representation's variance
-        transformed_feats = pca.fit_transform(feat_reps)
-        #initiliase TSNE
-        tsne = TSNE(n_components=2, random_state=rnd_state)
-        #transform projected hidden reps via t-SNE into R^2
-        tsne_embeds = tsne.fit_transform(transformed_feats)
-        #get x_pos and y_pos of transformed data
-        tsne_embed_x = tsne_embeds[:, 0]
-        tsne_embed_y = tsne_embeds[:, 1]
-        #plot model's hidden representations (in 2D space) for layer l 
-        plot_reps_projected_via_tsne(
-                                     tsne_embed_x,
-                                     tsne_embed_y,
-                                     y_true,
-                                     class_to_idx,
-                                     file_name,
-                                     source=source,
-                                     version=version,
-                                     combined_ds=combined_ds,
-                                     layer_wise=True,
-                                     n_layer=layer,
-                                     plot_qa=plot_qa,
-                                     sent_pair=sent_pair,
-                                     support_labels=support_labels,
-                                     text_annotations=text_annotations,
-                                     )
+    #NOTE: plots are rendered from 2-D coordinates only (projections might have been computed beforehand, see compute_projections)
+    if isinstance(projections_per_layer, type(None)):
+        projections_per_layer = dict(zip(feat_reps_per_layer.keys(), compute_projections(
+                                                                                         feat_reps_list=list(feat_reps_per_layer.values()),
+                                                                                         retained_variance=retained_variance,
+                                                                                         rnd_state=rnd_state,
+                                                                                         workers=workers,
+                                                                                         )))
+    #plot model's hidden representations (in 2D space) for every layer l
+    render_jobs = get_render_jobs_per_layer(
+                                            y_true=y_true,
+                                            projections_per_layer=projections_per_layer,
+                                            class_to_idx=class_to_idx,
+                                            file_name=file_name,
+                                            source=source,
+                                            version=version,
+                                            combined_ds=combined_ds,
+                                            plot_qa=plot_qa,
+                                            sent_pair=sent_pair,
+                                            support_labels=support_labels,
+                                            text_annotations=text_annotations,
+                                            dpi=dpi,
+                                            fmt=fmt,
+                                            )
+    render_figures(render_jobs, workers=workers)
     
 ##########################################
 ########## CONFUSION MATRIX ##############
 ##########################################
     
+def normalize_conf_mat(
+                       conf_mat:np.ndarray,
+                       metric:str,
+):
+    #NOTE: conf_mat might have been accumulated during inference (see models.metrics.ConfusionMatrix)
+    precision_scores = conf_mat.astype('float') / conf_mat.sum(axis=0)[:, np.newaxis]
+    recall_scores = conf_mat.astype('float') / conf_mat.sum(axis=1)[:, np.newaxis]
+    f1_scores = 2 * (precision_scores * recall_scores) / (precision_scores + recall_scores)
+    
+    if metric == 'precision':
+        return precision_scores
+    elif metric == 'recall':
+        return recall_scores
+    elif metric == 'f1':
+        return f1_scores
+
 def conf_mat(
              y_pred:np.ndarray,
              y_true:np.ndarray,
@@ -204,22 +395,12 @@ def conf_mat(
              metric=None,
 ):
     n = len(np.unique(y_true))
-    conf_mat = np.zeros((n, n), dtype=int)
-    for i, pred in enumerate(y_pred):
-        conf_mat[y_true[i], pred] += 1
+    #count (true, pred) pairs with a single bincount over true * n + pred
+    conf_mat = np.bincount(np.asarray(y_true) * n + np.asarray(y_pred), minlength=n * n).reshape(n, n)
     
     if normalize:
         assert isinstance(metric, str), 'If normalized confusion matrix, metric must be defined'
-        precision_scores = conf_mat.astype('float') / conf_mat.sum(axis=0)[:, np.newaxis]
-        recall_scores = conf_mat.astype('float') / conf_mat.sum(axis=1)[:, np.newaxis]
-        f1_scores = 2 * (precision_scores * recall_scores) / (precision_scores + recall_scores)
-        
-        if metric == 'precision':
-            return precision_scores
-        elif metric == 'recall':
-            return recall_scores
-        elif metric == 'f1':
-            return f1_scores
+        return normalize_conf_mat(conf_mat, metric)
         
     return conf_mat
 
@@ -237,12 +418,18 @@ def plot_confusion_matrix(
                           values_format=None,
                           cmap='viridis',
                           ax=None,
+                          cm=None,
                          ):
     """
     This function prints and plots the confusion matrix.
     Normalization can be applied by setting `normalize=True`.
+    If `cm` (i.e., confusion counts accumulated during inference) is provided, y_pred and y_true are not required.
     """
-    if custom_conf_mat:
+    if isinstance(cm, np.ndarray):
+        if normalize:
+            assert isinstance(metric, str), 'If normalized confusion matrix, metric must be defined'
+            cm = normalize_conf_mat(cm, metric)
+    elif custom_conf_mat:
         if normalize:
             assert isinstance(metric, str), 'If normalized confusion matrix, metric must be defined'
         cm = conf_mat(
@@ -322,10 +509,9 @@ class ConfusionMatrixDisplay:
         """
         check_matplotlib_support("ConfusionMatrixDisplay.plot")
         
-        plt.figure(figsize=(14, 10), dpi=300)
-
         if ax is None:
-            fig, ax = plt.subplots()
+            fig = new_figure(figsize=(14, 10), dpi=300)
+            ax = fig.add_subplot(111)
         else:
             fig = ax.figure
 
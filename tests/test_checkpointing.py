@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+checkpointing = pytest.importorskip('models.checkpointing')
+utils = pytest.importorskip('models.utils')
+
+from torch.utils.data import TensorDataset
+
+from utils import BatchGenerator
+
+def test_checkpoints_round_trip_and_only_last_k_are_kept(tmp_path):
+    checkpointer = checkpointing.Checkpointer(str(tmp_path), 'model', save_every=2, keep_last=2)
+    running_metrics = {'tr_loss': 0., 'nb_tr_steps': 0}
+    history = {'batch_losses': []}
+    for step in range(10):
+        running_metrics['tr_loss'] += step
+        running_metrics['nb_tr_steps'] += 1
+        history['batch_losses'].append(float(step))
+        if checkpointer.is_due():
+            checkpointer.save({'history': history, 'running_metrics': running_metrics, 'step': step, 'weights': torch.full((2,), float(step))})
+    checkpointer.wait()
+    assert [os.path.basename(path) for path in checkpointer.get_checkpoints()] == ['model_step_8.pt', 'model_step_10.pt']
+
+    state = checkpointing.Checkpointer(str(tmp_path), 'model', save_every=2, resume=True).load()
+    assert state['step'] == 9 and state['global_step'] == 10
+    assert state['running_metrics'] == {'tr_loss': 45., 'nb_tr_steps': 10}
+    assert state['history']['batch_losses'] == [float(step) for step in range(10)]
+    assert torch.equal(state['weights'], torch.full((2,), 9.))
+
+def test_rng_states_are_restored():
+    rng_states = checkpointing.get_rng_states()
+    expected = (np.random.rand(), torch.rand(1))
+    checkpointing.set_rng_states(rng_states)
+    assert np.random.rand() == expected[0]
+    assert torch.equal(torch.rand(1), expected[1])
+
+@pytest.mark.parametrize('sort_batch', [False, True])
+@pytest.mark.parametrize('start_step', [0, 2, 4])
+def test_resumed_batches_match_skipped_iteration(sort_batch, start_step):
+    rnd = torch.Generator().manual_seed(0)
+    dataset = TensorDataset(torch.arange(26).view(13, 2), torch.ones(13), torch.ones(13), torch.randint(1, 10, (13,), generator=rnd))
+    train_dl = BatchGenerator(dataset, batch_size=3, sort_batch=sort_batch)
+    # reference: iterate over all mini-batches and skip the ones that were already seen
+    expected = [batch for step, batch in enumerate(train_dl) if step >= start_step]
+    for dl in [train_dl, list(train_dl)]:
+        resumed = list(utils.resume_batches(dl, start_step))
+        assert len(resumed) == len(expected)
+        for batch, expected_batch in zip(resumed, expected):
+            assert all(torch.equal(t, expected_t) for t, expected_t in zip(batch, expected_batch))
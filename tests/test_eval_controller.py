@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from torch.utils.data import TensorDataset
+
+from models.eval_controller import EvalController
+from utils import BatchGenerator
+
+def make_val_dl(n_examples=23, batch_size=4):
+    dataset = TensorDataset(torch.arange(n_examples * 2).view(n_examples, 2), torch.ones(n_examples), torch.ones(n_examples), torch.randint(1, 10, (n_examples,)))
+    return BatchGenerator(dataset, batch_size=batch_size, sort_batch=False)
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('patience', [1, 3])
+def test_full_evals_match_argmin_reference(seed, patience):
+    # reference: previous implementation saved the model on a new minimum and stopped, if the minimum was more than patience checks ago (after the first epoch)
+    val_losses = list(np.random.RandomState(seed).rand(30))
+    eval_controller = EvalController(check_every=5, patience=patience)
+    for i, val_loss in enumerate(val_losses):
+        epoch = i // 10
+        assert eval_controller.is_due(step=5 * (i % 10 + 1))
+        assert eval_controller.full
+        is_saved = eval_controller.update(val_loss)
+        assert is_saved == (i == 0 or val_loss < min(val_losses[:i]))
+        assert eval_controller.should_stop(epoch) == (epoch > 0 and np.argmin(val_losses[:i+1][::-1]) > patience)
+
+def test_cadence_in_steps():
+    eval_controller = EvalController(check_every=3)
+    assert [step for step in range(10) if eval_controller.is_due(step)] == [3, 6, 9]
+    assert eval_controller.n_checks == 3
+    assert not any(EvalController().is_due(step) for step in range(10))
+
+def test_cadence_in_seconds():
+    eval_controller = EvalController(check_every=1, check_every_secs=3600.)
+    assert not any(eval_controller.is_due(step) for step in range(10))
+    eval_controller = EvalController(check_every_secs=1e-9)
+    assert eval_controller.is_due(0)
+
+def test_subsample_is_fixed_and_a_multiple_of_the_batch_size():
+    val_dl = make_val_dl()
+    eval_controller = EvalController(subsample_size=10, full_eval_every=3)
+    eval_controller.next_check()
+    assert not eval_controller.full
+    subsample_dl = eval_controller.get_val_dl(val_dl)
+    assert len(subsample_dl.dataset) == 8
+    assert eval_controller.get_val_dl(val_dl) is subsample_dl
+    indices = subsample_dl.dataset.tensors[0][:, 0] // 2
+    assert len(set(indices.tolist())) == 8
+    assert torch.equal(subsample_dl.dataset.tensors[0], val_dl.dataset.tensors[0][indices])
+    # every full_eval_every-th check is performed on the full dev set
+    fulls = []
+    for _ in range(5):
+        eval_controller.next_check()
+        fulls.append(eval_controller.full)
+    assert fulls == [False, True, False, False, True]
+    assert eval_controller.get_val_dl(val_dl) is val_dl
+    # subsample never exceeds the dev set
+    eval_controller = EvalController(subsample_size=100, full_eval_every=2)
+    eval_controller.next_check()
+    assert len(eval_controller.get_val_dl(val_dl).dataset) == len(val_dl.dataset)
+
+def test_patience_is_counted_per_kind_and_only_full_evals_save():
+    eval_controller = EvalController(subsample_size=8, full_eval_every=2, patience=1)
+    results = []
+    for loss in [1.0, 0.5, 1.1, 0.6, 1.2, 0.7]:
+        eval_controller.next_check()
+        results.append((eval_controller.full, eval_controller.update(loss)))
+    # subsample losses 1.0, 1.1, 1.2 (two bad checks), full losses 0.5, 0.6, 0.7 (two bad checks)
+    assert results == [(False, False), (True, True), (False, False), (True, False), (False, False), (True, False)]
+    assert eval_controller.n_bad_checks == {'subsample': 2, 'full': 2}
+    assert eval_controller.best_losses == {'subsample': 1.0, 'full': 0.5}
+    assert not eval_controller.should_stop(epoch=0)
+    assert eval_controller.should_stop(epoch=1)
+    # a decreasing full loss does not reset the subsample patience
+    eval_controller.next_check(full=True)
+    assert eval_controller.update(0.1)
+    assert eval_controller.n_bad_checks == {'subsample': 2, 'full': 0}
+    assert eval_controller.should_stop(epoch=1)
+    assert not EvalController(patience=None).should_stop(epoch=10)
+
+def test_min_delta():
+    eval_controller = EvalController(min_delta=0.1)
+    eval_controller.next_check()
+    assert eval_controller.update(1.0)
+    eval_controller.next_check()
+    assert not eval_controller.update(0.95)
+    eval_controller.next_check()
+    assert eval_controller.update(0.85)
+
+def test_full_eval_pending():
+    eval_controller = EvalController(subsample_size=8, full_eval_every=3)
+    assert eval_controller.full_eval_pending()
+    eval_controller.next_check(full=True)
+    eval_controller.update(1.0)
+    assert not eval_controller.full_eval_pending()
+    eval_controller.next_check()
+    eval_controller.update(0.9)
+    assert eval_controller.full_eval_pending()
+    eval_controller.next_check(full=True)
+    eval_controller.update(0.9)
+    assert not eval_controller.full_eval_pending()
+
+def test_state_dict_round_trip():
+    losses = [1.0, 0.5, 1.1, 0.6, 1.2, 0.4, 0.3]
+    eval_controller = EvalController(subsample_size=8, full_eval_every=2, patience=2)
+    for loss in losses[:4]:
+        eval_controller.next_check()
+        eval_controller.update(loss)
+    resumed = EvalController(subsample_size=8, full_eval_every=2, patience=2)
+    resumed.load_state_dict(eval_controller.state_dict())
+    for loss in losses[4:]:
+        eval_controller.next_check()
+        resumed.next_check()
+        assert resumed.full == eval_controller.full
+        assert resumed.update(loss) == eval_controller.update(loss)
+    assert resumed.state_dict() == eval_controller.state_dict()
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('statsmodels')
+# models.utils must be imported first (eval_hidden_reps and models.utils import each other)
+pytest.importorskip('models.utils')
+import eval_hidden_reps
+
+# cos sims lie in [-1, 1], hence absolute tolerances (Gram matrix vs. one dot product per pair only differ in summation order)
+ATOL = {np.float32: 1e-6, np.float64: 1e-12}
+
+def compute_ans_similarities_loop(a_hiddens):
+    # reference: previous implementation (one cosine_sim call per pair i < j)
+    a_dists = []
+    for i, a_i in enumerate(a_hiddens):
+        for j, a_j in enumerate(a_hiddens):
+            if i != j and j > i:
+                a_dists.append(eval_hidden_reps.cosine_sim(u=a_i, v=a_j))
+    return np.max(a_dists), np.min(a_dists), np.mean(a_dists), np.std(a_dists)
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('seed', range(5))
+def test_ans_similarities_match_loop(dtype, seed):
+    rnd = np.random.RandomState(seed)
+    a_hiddens = rnd.randn(rnd.randint(2, 30), 768).astype(dtype)
+    np.testing.assert_allclose(eval_hidden_reps.compute_ans_similarities(a_hiddens), compute_ans_similarities_loop(a_hiddens), rtol=0, atol=ATOL[dtype])
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_cosine_sim_matrix_matches_pairwise_cosine_sim(dtype):
+    hiddens = np.random.RandomState(0).randn(12, 64).astype(dtype)
+    expected = np.array([[eval_hidden_reps.cosine_sim(u, v) for v in hiddens] for u in hiddens])
+    np.testing.assert_allclose(eval_hidden_reps.cosine_sim_matrix(hiddens), expected, rtol=0, atol=ATOL[dtype])
+
+def test_ans_similarities_batch_match_loop():
+    rnd = np.random.RandomState(0)
+    hiddens = rnd.randn(40, 32)
+    s_positions = np.array([0, 3, 10, 5, 39, 20])
+    e_positions = np.array([4, 3, 25, 6, 39, 39])
+    max_cos, min_cos, mean_cos, std_cos = eval_hidden_reps.compute_ans_similarities_batch(hiddens, s_positions, e_positions)
+    for k, (s, e) in enumerate(zip(s_positions, e_positions)):
+        if s == e:
+            # single-token spans have no pairs
+            assert np.isnan(max_cos[k]) and np.isnan(min_cos[k])
+            continue
+        expected = compute_ans_similarities_loop(hiddens[s:e+1])
+        np.testing.assert_allclose((max_cos[k], min_cos[k], mean_cos[k], std_cos[k]), expected, rtol=0, atol=1e-12)
+
+def test_ans_similarities_batch_only_use_tokens_within_spans():
+    rnd = np.random.RandomState(1)
+    hiddens = rnd.randn(30, 16)
+    # padding tokens (zero vectors) outside of the window [min start, max end] must not be touched
+    hiddens[:5] = hiddens[20:] = 0
+    s_positions, e_positions = np.array([[8, 5, 12]]), np.array([[15, 9, 19]])
+    with np.errstate(all='raise'):
+        stats = eval_hidden_reps.compute_ans_similarities_batch(hiddens, s_positions, e_positions)
+    for k, (s, e) in enumerate(zip(s_positions.ravel(), e_positions.ravel())):
+        np.testing.assert_allclose([stat[k] for stat in stats], compute_ans_similarities_loop(hiddens[s:e+1]), rtol=0, atol=1e-12)
+
+def compute_n_gram_overlap_loop(q, a_candidate):
+    # reference: previous implementation (unique n-grams as sets of tuples)
+    n_gram_overlaps = []
+    def compute_unique_n_grams(sent, n_gram):
+        return set(tuple(sent[i:i+n_gram]) for i in range(len(sent)) if i <= len(sent)-n_gram)
+    for n_gram in range(1, 4):
+        q_n_grams = compute_unique_n_grams(q, n_gram)
+        a_n_grams = compute_unique_n_grams(a_candidate, n_gram)
+        try:
+            overlap_prop_q = len(q_n_grams.intersection(a_n_grams))/len(q_n_grams)
+            overlap_prop_a = len(a_n_grams.intersection(q_n_grams))/len(a_n_grams)
+        except ZeroDivisionError:
+            overlap_prop_q = float(0)
+            overlap_prop_a = float(0)
+        n_gram_overlaps.append((overlap_prop_q, overlap_prop_a))
+    return np.asarray(n_gram_overlaps).flatten()
+
+def make_sentence_pairs(n_pairs=60, seed=0):
+    rnd = np.random.RandomState(seed)
+    # small vocabulary s.t. there are repeated n-grams (clipping) and higher-order matches
+    vocab = ['what', 'is', 'the', 'battery', 'life', 'like', '?', 'great', 'bad']
+    questions = [list(rnd.choice(vocab, size=rnd.randint(1, 12))) for _ in range(n_pairs)]
+    a_candidates = [list(q[rnd.randint(0, len(q)):]) + list(rnd.choice(vocab, size=rnd.randint(0, 5))) for q in questions]
+    # candidate answers without any tokens and without any overlap
+    a_candidates[0], a_candidates[1] = [], ['none']
+    return questions, a_candidates
+
+@pytest.mark.parametrize('seed', range(3))
+def test_n_gram_features_match_nltk_and_loop(seed):
+    bleu_score = pytest.importorskip('nltk.translate.bleu_score')
+    questions, a_candidates = make_sentence_pairs(seed=seed)
+    X = eval_hidden_reps.compute_n_gram_features(questions, a_candidates)
+    assert X.shape == (len(questions), 7)
+    for i, (q, a_candidate) in enumerate(zip(questions, a_candidates)):
+        expected_bleu = bleu_score.sentence_bleu([q], a_candidate) if len(a_candidate) > 0 else 0
+        assert X[i, 0] == pytest.approx(expected_bleu, rel=1e-12, abs=1e-300)
+        expected_overlaps = compute_n_gram_overlap_loop(q, a_candidate) if len(a_candidate) > 0 else np.zeros(6)
+        np.testing.assert_allclose(X[i, 1:], expected_overlaps, rtol=1e-12, atol=0)
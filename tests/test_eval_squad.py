@@ -0,0 +1,185 @@
+import json
+
+import numpy as np
+import pytest
+
+import eval_squad
+
+def make_dataset(n_articles=7, seed=0):
+    rnd = np.random.RandomState(seed)
+    words = ['the', 'battery', 'life', 'is', 'great', 'a', 'bad', 'screen', 'über', '"quoted"', '{', '}', '[', ']', ',']
+    data, preds = [], {}
+    for i in range(n_articles):
+        paragraphs = []
+        for j in range(rnd.randint(1, 4)):
+            qas = []
+            for k in range(rnd.randint(1, 4)):
+                qid = 'q_{}_{}_{}'.format(i, j, k)
+                answers = [{'text': ' '.join(rnd.choice(words, size=rnd.randint(1, 4))), 'answer_start': int(rnd.randint(100))} for _ in range(rnd.randint(0, 3))]
+                qas.append({'id': qid, 'question': 'q?', 'answers': answers, 'score': float(rnd.rand())})
+                if rnd.rand() > 0.1:
+                    preds[qid] = ' '.join(rnd.choice(words, size=rnd.randint(0, 4)))
+            paragraphs.append({'context': ' '.join(rnd.choice(words, size=20)), 'qas': qas})
+        data.append({'title': 'article {}'.format(i), 'paragraphs': paragraphs})
+    return data, preds
+
+@pytest.fixture
+def data_file(tmp_path):
+    data, preds = make_dataset()
+    path = tmp_path / 'data.json'
+    # version is a number at the very end of the file s.t. a truncated read would be decoded incorrectly
+    path.write_text(json.dumps({'data': data, 'version': 20}, indent=1))
+    return str(path), data, preds
+
+@pytest.mark.parametrize('block_size', [1, 7, 64, 1 << 16])
+def test_iter_articles_matches_json_load(data_file, block_size):
+    path, data, _ = data_file
+    assert list(eval_squad.iter_articles(path, block_size=block_size)) == data
+
+def test_iter_articles_skips_leading_entries(tmp_path):
+    data, _ = make_dataset(n_articles=2)
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'version': 'v2.0', 'data': data}))
+    assert list(eval_squad.iter_articles(str(path), block_size=5)) == data
+
+def test_iter_articles_raises_on_truncated_file(tmp_path):
+    data, _ = make_dataset(n_articles=2)
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'data': data})[:-30])
+    with pytest.raises(ValueError):
+        list(eval_squad.iter_articles(str(path), block_size=16))
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('chunk_size', [1, 3, 20])
+def test_load_raw_scores_matches_official_scores(data_file, workers, chunk_size):
+    path, data, preds = data_file
+    # reference: official script (entire dataset via json.load)
+    with open(path) as f:
+        dataset = json.load(f)['data']
+    expected = (eval_squad.make_qid_to_has_ans(dataset),) + eval_squad.get_raw_scores(dataset, preds)
+    actual = eval_squad.load_raw_scores(path, preds, workers=workers, chunk_size=chunk_size)
+    for expected_scores, actual_scores in zip(expected, actual):
+        assert actual_scores == expected_scores
+        assert list(actual_scores) == list(expected_scores)
+
+def make_pr_inputs(n_qids=200, seed=0, n_levels=None):
+    rnd = np.random.RandomState(seed)
+    qids = ['q{}'.format(i) for i in range(n_qids)]
+    qid_to_has_ans = {k: bool(rnd.rand() > 0.4) for k in qids}
+    # ties in no-answer probabilities (n_levels) must be handled as in the official loop
+    probs = rnd.randint(0, n_levels, size=n_qids) / float(n_levels) if n_levels else rnd.rand(n_qids)
+    na_probs = {k: float(p) for k, p in zip(qids, probs)}
+    exact_raw = {k: int(rnd.rand() > 0.5) for k in qids}
+    f1_raw = {k: float(rnd.rand()) if exact_raw[k] == 0 else 1.0 for k in qids}
+    preds = {k: '' if rnd.rand() > 0.7 else 'answer' for k in qids}
+    return preds, exact_raw, f1_raw, na_probs, qid_to_has_ans
+
+def make_precision_recall_eval_loop(scores, na_probs, num_true_pos, qid_to_has_ans):
+    # reference: official SQuAD v2 implementation
+    qid_list = sorted(na_probs, key=lambda k: na_probs[k])
+    true_pos = 0.0
+    precisions = [1.0]
+    recalls = [0.0]
+    avg_prec = 0.0
+    for i, qid in enumerate(qid_list):
+        if qid_to_has_ans[qid]:
+            true_pos += scores[qid]
+        cur_p = true_pos / float(i+1)
+        cur_r = true_pos / float(num_true_pos)
+        if i == len(qid_list) - 1 or na_probs[qid] != na_probs[qid_list[i+1]]:
+            avg_prec += cur_p * (cur_r - recalls[-1])
+            precisions.append(cur_p)
+            recalls.append(cur_r)
+    return {'ap': 100.0 * avg_prec}
+
+def find_best_thresh_loop(preds, scores, na_probs, qid_to_has_ans):
+    # reference: official SQuAD v2 implementation
+    num_no_ans = sum(1 for k in qid_to_has_ans if not qid_to_has_ans[k])
+    cur_score = num_no_ans
+    best_score = cur_score
+    best_thresh = 0.0
+    qid_list = sorted(na_probs, key=lambda k: na_probs[k])
+    for qid in qid_list:
+        if qid not in scores: continue
+        if qid_to_has_ans[qid]:
+            diff = scores[qid]
+        else:
+            diff = -1 if preds[qid] else 0
+        cur_score += diff
+        if cur_score > best_score:
+            best_score = cur_score
+            best_thresh = na_probs[qid]
+    return 100.0 * best_score / len(scores), best_thresh
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('n_levels', [None, 5])
+def test_precision_recall_matches_official_loop(seed, n_levels):
+    _, exact_raw, f1_raw, na_probs, qid_to_has_ans = make_pr_inputs(seed=seed, n_levels=n_levels)
+    num_true_pos = sum(qid_to_has_ans.values())
+    oracle = {k: float(v) for k, v in qid_to_has_ans.items()}
+    for scores in [exact_raw, f1_raw, oracle]:
+        expected = make_precision_recall_eval_loop(scores, na_probs, num_true_pos, qid_to_has_ans)
+        actual = eval_squad.make_precision_recall_eval(scores, na_probs, num_true_pos, qid_to_has_ans)
+        assert actual['ap'] == expected['ap']
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('n_levels', [None, 5])
+def test_best_thresh_matches_official_loop(seed, n_levels):
+    preds, exact_raw, f1_raw, na_probs, qid_to_has_ans = make_pr_inputs(seed=seed, n_levels=n_levels)
+    main_eval = {}
+    eval_squad.find_all_best_thresh(main_eval, preds, exact_raw, f1_raw, na_probs, qid_to_has_ans)
+    for name, scores in [('exact', exact_raw), ('f1', f1_raw)]:
+        best_score, best_thresh = find_best_thresh_loop(preds, scores, na_probs, qid_to_has_ans)
+        assert eval_squad.find_best_thresh(preds, scores, na_probs, qid_to_has_ans) == (best_score, best_thresh)
+        assert main_eval['best_%s' % name] == best_score
+        assert main_eval['best_%s_thresh' % name] == best_thresh
+
+def test_precision_recall_analysis_matches_official_loop(monkeypatch, tmp_path):
+    # curves are not plotted (matplotlib is only imported by main)
+    curves = {}
+    monkeypatch.setattr(eval_squad, 'plot_pr_curve', lambda precisions, recalls, out_image, title: curves.update({out_image: (precisions, recalls)}))
+    _, exact_raw, f1_raw, na_probs, qid_to_has_ans = make_pr_inputs(n_levels=7)
+    num_true_pos = sum(qid_to_has_ans.values())
+    main_eval = {}
+    eval_squad.run_precision_recall_analysis(main_eval, exact_raw, f1_raw, na_probs, qid_to_has_ans, str(tmp_path))
+    oracle = {k: float(v) for k, v in qid_to_has_ans.items()}
+    for name, scores in [('pr_exact', exact_raw), ('pr_f1', f1_raw), ('pr_oracle', oracle)]:
+        assert main_eval['%s_ap' % name] == make_precision_recall_eval_loop(scores, na_probs, num_true_pos, qid_to_has_ans)['ap']
+    assert len(curves) == 3
+
+@pytest.mark.parametrize('n_resamples', [1, 999, 2500])
+def test_resample_means_match_loop(n_resamples):
+    scores = np.random.RandomState(0).rand(57) * 100
+    # reference: one bootstrap sample (of question indices) per iteration with the same random stream
+    rng = np.random.RandomState(42)
+    expected = np.array([scores[rng.randint(0, len(scores), size=len(scores))].mean() for _ in range(n_resamples)])
+    np.testing.assert_allclose(eval_squad.resample_means(scores, n_resamples, seed=42), expected, rtol=1e-12)
+
+def test_bootstrap_ci():
+    scores = 100.0 * (np.random.RandomState(1).rand(300) > 0.3)
+    mean, lower, upper = eval_squad.bootstrap_ci(scores, n_resamples=2000)
+    rng = np.random.RandomState(42)
+    means = [scores[rng.randint(0, len(scores), size=len(scores))].mean() for _ in range(2000)]
+    assert mean == scores.mean()
+    assert (lower, upper) == pytest.approx(tuple(np.percentile(means, [2.5, 97.5])), rel=1e-12)
+    assert lower < mean < upper
+
+def test_paired_bootstrap_test():
+    rnd = np.random.RandomState(2)
+    scores_a = 100.0 * (rnd.rand(400) > 0.3)
+    same = eval_squad.paired_bootstrap_test(scores_a, scores_a, n_resamples=500)
+    assert same['delta'] == 0 and same['ci'] == [0, 0] and same['p_value'] == 1
+    # model b is wrong on a fifth of the questions a answers correctly
+    scores_b = np.where(rnd.rand(400) > 0.2, scores_a, 0)
+    better = eval_squad.paired_bootstrap_test(scores_a, scores_b, n_resamples=2000)
+    assert better['delta'] == pytest.approx(np.mean(scores_a - scores_b))
+    assert 0 < better['ci'][0] < better['delta'] < better['ci'][1]
+    assert better['p_value'] < 0.01
+
+def test_bootstrap_eval_per_subset():
+    _, exact_raw, f1_raw, _, qid_to_has_ans = make_pr_inputs()
+    has_ans_qids = [k for k, v in qid_to_has_ans.items() if v]
+    bootstrap_eval = eval_squad.make_bootstrap_eval(exact_raw, f1_raw, 500, qid_list=has_ans_qids)
+    _, lower, upper = eval_squad.bootstrap_ci([100.0 * exact_raw[k] for k in has_ans_qids], 500)
+    assert bootstrap_eval['exact_ci'] == [lower, upper]
+    assert list(bootstrap_eval) == ['exact_ci', 'f1_ci']
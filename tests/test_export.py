@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+export = pytest.importorskip('models.export')
+
+class LinearBackend(object):
+    # backend that returns deterministic (start, end) logits; noise is added to mimic numerical differences across backends
+
+    def __init__(self, weight, noise=0.):
+        self.weight = weight
+        self.noise = noise
+
+    def __call__(self, input_ids, attention_masks, task):
+        logits = input_ids.float().unsqueeze(-1) * self.weight + self.noise
+        if task == 'QA':
+            return logits[..., 0], logits[..., 1]
+        return logits[:, 0, 0]
+
+def make_batches(n_batches=4, batch_size=3, max_seq_length=5):
+    rnd = torch.Generator().manual_seed(0)
+    return [(torch.randint(0, 10, (batch_size, max_seq_length), generator=rnd), torch.ones(batch_size, max_seq_length, dtype=torch.long)) for _ in range(n_batches)]
+
+@pytest.mark.parametrize('task', ['QA', 'Sbj_Class'])
+def test_check_logits_parity_reports_max_abs_diff(task):
+    weight = torch.tensor([0.5, -1.5])
+    backends = {'pytorch': LinearBackend(weight), 'onnx': LinearBackend(weight, noise=1e-3)}
+    max_abs_diff = export.check_logits_parity(backends, make_batches(), task=task)
+    assert max_abs_diff == pytest.approx(1e-3, rel=1e-3)
+
+def test_check_logits_parity_only_uses_first_n_batches():
+    weight = torch.tensor([0.5, -1.5])
+    batches = make_batches()
+    # last mini-batch deviates strongly, but is not part of the parity check
+    batches[-1] = (batches[-1][0] + 1000, batches[-1][1])
+    backends = {'pytorch': LinearBackend(weight), 'onnx': LinearBackend(weight * (1 + 1e-6))}
+    max_abs_diff = export.check_logits_parity(backends, batches, n_batches=3)
+    assert max_abs_diff < 1e-4
+
+def test_onnx_path_per_task():
+    assert export.get_onnx_path('results/model', 'QA') == 'results/model.onnx'
+    assert export.get_onnx_path('results/model', 'Sbj_Class') == 'results/model_sbj_class.onnx'
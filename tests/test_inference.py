@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+inference = pytest.importorskip('models.inference')
+
+import torch.nn as nn
+
+class TinyQA(nn.Module):
+    # minimal model with the QA interface of DistilBertForQA (linear QA head on top of an embedding layer)
+
+    def __init__(self, vocab_size=20, hidden_size=8):
+        super(TinyQA, self).__init__()
+        self.encoder = False
+        self.embeddings = nn.Embedding(vocab_size, hidden_size)
+        self.dropout = nn.Dropout(0.5)
+        self.fc_qa = nn.Linear(hidden_size, 2)
+
+    def forward(self, input_ids, attention_masks, token_type_ids=None, task='QA', input_lengths=None):
+        logits = self.fc_qa(self.dropout(self.embeddings(input_ids)))
+        logits = logits.masked_fill(attention_masks.unsqueeze(-1) == 0, -1e4)
+        return logits[..., 0], logits[..., 1]
+
+class Tokenizer(object):
+
+    def convert_ids_to_tokens(self, ids):
+        return ['t{}'.format(int(i)) for i in ids]
+
+def make_batches(n_batches=3, batch_size=4, max_seq_length=10, last_batch_size=2, seed=0):
+    rnd = torch.Generator().manual_seed(seed)
+    batches = []
+    for i in range(n_batches):
+        size = last_batch_size if i == n_batches - 1 else batch_size
+        input_ids = torch.randint(1, 20, (size, max_seq_length), generator=rnd)
+        attn_masks = torch.ones(size, max_seq_length, dtype=torch.long)
+        attn_masks[:, -2:] = 0
+        input_lengths = attn_masks.sum(1)
+        start_pos = torch.randint(0, 4, (size,), generator=rnd)
+        end_pos = start_pos + torch.randint(0, 4, (size,), generator=rnd)
+        batches.append((input_ids, attn_masks, None, input_lengths, start_pos, end_pos))
+    return batches
+
+def predict_loop(model, batches, batch_size):
+    # reference: per-batch forward passes of the model in eval mode (last incomplete mini-batch is skipped, as in test)
+    model.eval()
+    start_logits, end_logits = [], []
+    with torch.no_grad():
+        for batch in batches:
+            if batch[0].size(0) != batch_size:
+                continue
+            start_log, end_log = model(input_ids=batch[0], attention_masks=batch[1], token_type_ids=None, task='QA')
+            start_logits.append(start_log)
+            end_logits.append(end_log)
+    return torch.cat(start_logits), torch.cat(end_logits)
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_predict_matches_forward_loop(jit):
+    torch.manual_seed(0)
+    model = TinyQA()
+    batches = make_batches()
+    engine = inference.InferenceEngine(model, batch_size=4, max_seq_length=10, jit=jit, device=torch.device('cpu'))
+    start_logits, end_logits = engine.predict(batches)
+    ref_start, ref_end = predict_loop(model, batches, batch_size=4)
+    assert start_logits.shape == (8, 10)
+    np.testing.assert_allclose(start_logits.numpy(), ref_start.numpy(), rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(end_logits.numpy(), ref_end.numpy(), rtol=1e-6, atol=1e-6)
+
+def test_engine_leaves_requires_grad_untouched():
+    model = TinyQA()
+    model.embeddings.weight.requires_grad = False
+    inference.InferenceEngine(model, batch_size=4, max_seq_length=10, device=torch.device('cpu')).predict(make_batches())
+    assert [p.requires_grad for p in model.parameters()] == [False, True, True]
+
+def test_buffers_are_reused_across_test_sets():
+    engine = inference.InferenceEngine(TinyQA(), batch_size=4, max_seq_length=10, device=torch.device('cpu'))
+    engine.predict(make_batches(n_batches=4))
+    buffer = engine.start_logits
+    start_logits, _ = engine.predict(make_batches(n_batches=2, seed=1))
+    assert engine.start_logits is buffer
+    assert start_logits.size(0) == 4
+
+def test_evaluate_matches_per_batch_metrics():
+    torch.manual_seed(0)
+    model = TinyQA()
+    batches = make_batches()
+    tokenizer = Tokenizer()
+    engine = inference.InferenceEngine(model, batch_size=4, max_seq_length=10, device=torch.device('cpu'))
+    test_loss, test_acc, test_f1 = engine.evaluate(tokenizer, batches)
+    # reference: loss and answers are computed per (complete) mini-batch, as in test
+    losses, exact, f1 = [], 0, 0
+    with torch.no_grad():
+        for batch in batches[:2]:
+            start_log, end_log = model(input_ids=batch[0], attention_masks=batch[1])
+            losses.append(((nn.functional.cross_entropy(start_log, batch[4]) + nn.functional.cross_entropy(end_log, batch[5])) / 2).item())
+            pred_answers = inference.get_answers(tokenizer, batch[0], start_log, end_log, predictions=True)
+            true_answers = inference.get_answers(tokenizer, batch[0], batch[4], batch[5], predictions=False)
+            exact += inference.compute_exact_batch(true_answers, pred_answers)
+            f1 += inference.compute_f1_batch(true_answers, pred_answers)
+    assert test_loss == pytest.approx(np.mean(losses), rel=1e-6)
+    assert test_acc == pytest.approx(100 * exact / 8)
+    assert test_f1 == pytest.approx(100 * f1 / 8)
+
+def test_quantize_model_leaves_fp32_model_untouched():
+    model = TinyQA()
+    model.train()
+    state = {k: v.clone() for k, v in model.state_dict().items()}
+    q_model = inference.quantize_model(model)
+    assert model.training
+    assert isinstance(model.fc_qa, nn.Linear) and not isinstance(q_model.fc_qa, nn.Linear)
+    assert all(torch.equal(state[k], v) for k, v in model.state_dict().items())
+
+def test_quantized_checkpoint_round_trip(tmp_path):
+    torch.manual_seed(0)
+    model = TinyQA()
+    batches = make_batches()
+    q_model = inference.quantize_model(model)
+    model_path = str(tmp_path / 'tiny_int8')
+    inference.save_quantized_model(q_model, model_path)
+    loaded = inference.load_quantized_model(TinyQA(), model_path)
+    predict = lambda m: inference.InferenceEngine(m, batch_size=4, max_seq_length=10, device=torch.device('cpu')).predict(batches)
+    for expected, actual in zip(predict(q_model), predict(loaded)):
+        assert torch.equal(expected, actual)
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+import torch
+
+from models.metrics import ConfusionMatrix, GroupedMetrics, confusion_counts, hard_predictions
+
+def make_batches(n_labels, n_batches=5, seed=0):
+    rnd = np.random.RandomState(seed)
+    batches = []
+    for _ in range(n_batches):
+        batch_size = rnd.randint(1, 17)
+        # restrict true labels and predictions to a subset of the labels s.t. some labels never occur
+        y_true = rnd.randint(0, max(n_labels - 1, 1), size=batch_size)
+        y_pred = np.where(rnd.rand(batch_size) > 0.4, y_true, rnd.randint(0, n_labels, size=batch_size))
+        batches.append((torch.from_numpy(y_pred), torch.from_numpy(y_true)))
+    return batches
+
+@pytest.mark.parametrize('n_labels', [2, 3, 5])
+@pytest.mark.parametrize('seed', range(3))
+def test_confusion_matrix_matches_sklearn(n_labels, seed):
+    metrics = pytest.importorskip('sklearn.metrics')
+    batches = make_batches(n_labels, seed=seed)
+    conf_mat = ConfusionMatrix(n_labels, device=torch.device('cpu'))
+    for y_pred, y_true in batches:
+        conf_mat.update(y_pred, y_true)
+    y_pred = torch.cat([y_pred for y_pred, _ in batches]).numpy()
+    y_true = torch.cat([y_true for _, y_true in batches]).numpy()
+    np.testing.assert_array_equal(conf_mat.to_numpy(), metrics.confusion_matrix(y_true, y_pred, labels=list(range(n_labels))))
+    assert conf_mat.accuracy() == pytest.approx(metrics.accuracy_score(y_true, y_pred), rel=1e-12)
+    for avg in ['macro', 'weighted', 'micro']:
+        assert conf_mat.f1(avg) == pytest.approx(metrics.f1_score(y_true, y_pred, average=avg), rel=1e-12)
+
+def test_confusion_counts_match_loop():
+    y_pred, y_true = make_batches(n_labels=4, n_batches=1)[0]
+    counts = np.zeros((4, 4), dtype=int)
+    for t, p in zip(y_true.tolist(), y_pred.tolist()):
+        counts[t, p] += 1
+    np.testing.assert_array_equal(confusion_counts(y_pred, y_true, 4).numpy(), counts)
+
+def test_confusion_matrix_reset_and_empty():
+    conf_mat = ConfusionMatrix(3, device=torch.device('cpu'))
+    assert conf_mat.accuracy() == 0 and conf_mat.f1() == 0
+    conf_mat.update(torch.tensor([0, 1, 2]), torch.tensor([0, 1, 1]))
+    assert conf_mat.to_numpy().sum() == 3
+    conf_mat.reset()
+    assert conf_mat.to_numpy().sum() == 0
+
+def test_hard_predictions():
+    probas = torch.tensor([0.2, 0.5, 0.7, 0.4999])
+    assert hard_predictions(probas, 'binary').tolist() == [0, 1, 1, 0]
+    probas = torch.tensor([[0.1, 0.6, 0.3], [0.5, 0.2, 0.3]])
+    assert hard_predictions(probas, 'multiway').tolist() == [1, 0]
+
+def grouped_scores_loop(correct, keys, categories, store_scores):
+    # reference: previous per-example dict updates
+    results = {}
+    for is_correct, key in zip(correct, keys):
+        if key < 0:
+            continue
+        category = categories[key]
+        if category not in results:
+            results[category] = {'freq': 0, 'correct': 0}
+            if store_scores:
+                results[category]['scores'] = []
+        results[category]['freq'] += 1
+        results[category]['correct'] += is_correct
+        if store_scores:
+            results[category]['scores'].append(is_correct)
+    return results
+
+@pytest.mark.parametrize('seed', range(3))
+def test_grouped_metrics_match_loop(seed):
+    rnd = np.random.RandomState(seed)
+    groupings = {'domain': ['books', 'electronics', 'grocery', 'movies', 'restaurants', 'tripadvisor'], 'q_type': ['one', 'many', 'none']}
+    grouped_metrics = GroupedMetrics(groupings, store_scores=('domain',), device=torch.device('cpu'))
+    correct, domains, q_types = [], [], []
+    for _ in range(6):
+        batch_size = rnd.randint(1, 9)
+        b_correct = rnd.randint(0, 2, size=batch_size)
+        # the last domain never occurs and negative keys are not part of a grouping
+        b_domains = rnd.randint(0, len(groupings['domain']) - 1, size=batch_size)
+        b_q_types = rnd.randint(-1, len(groupings['q_type']), size=batch_size)
+        grouped_metrics.update(torch.from_numpy(b_correct), domain=torch.from_numpy(b_domains), q_type=b_q_types.tolist())
+        correct.extend(b_correct.tolist())
+        domains.extend(b_domains.tolist())
+        q_types.extend(b_q_types.tolist())
+    assert grouped_metrics.results('domain') == grouped_scores_loop(correct, domains, groupings['domain'], store_scores=True)
+    assert grouped_metrics.results('q_type') == grouped_scores_loop(correct, q_types, groupings['q_type'], store_scores=False)
+
+def test_grouped_metrics_store_scores_default_is_not_shared():
+    grouped_metrics = GroupedMetrics({'sbj': ['obj', 'sbj']}, device=torch.device('cpu'))
+    grouped_metrics.update(torch.tensor([1, 0]), sbj=torch.tensor([0, 1]))
+    assert grouped_metrics.scores == {}
+    assert grouped_metrics.results('sbj') == {'obj': {'freq': 1, 'correct': 1}, 'sbj': {'freq': 1, 'correct': 0}}
+    assert GroupedMetrics({'sbj': ['obj', 'sbj']}, device=torch.device('cpu')).results('sbj') == {}
+
+def test_confusion_matrix_state_dict_round_trip():
+    batches = make_batches(n_labels=3)
+    conf_mat = ConfusionMatrix(3, device=torch.device('cpu'))
+    for y_pred, y_true in batches[:2]:
+        conf_mat.update(y_pred, y_true)
+    resumed = ConfusionMatrix(3, device=torch.device('cpu'))
+    resumed.load_state_dict(conf_mat.state_dict())
+    for y_pred, y_true in batches[2:]:
+        conf_mat.update(y_pred, y_true)
+        resumed.update(y_pred, y_true)
+    np.testing.assert_array_equal(resumed.to_numpy(), conf_mat.to_numpy())
+
+def test_reduced_train_metrics_are_averaged_across_heads():
+    import models.utils
+    metrics = pytest.importorskip('sklearn.metrics')
+    conf_mats = [ConfusionMatrix(2, device=torch.device('cpu')) for _ in range(2)]
+    accs, f1s = [], []
+    for k, conf_mat in enumerate(conf_mats):
+        batches = make_batches(n_labels=2, seed=k)
+        for y_pred, y_true in batches:
+            conf_mat.update(y_pred, y_true)
+        y_pred = torch.cat([y_pred for y_pred, _ in batches]).numpy()
+        y_true = torch.cat([y_true for _, y_true in batches]).numpy()
+        accs.append(metrics.accuracy_score(y_true, y_pred))
+        f1s.append(metrics.f1_score(y_true, y_pred, average='macro'))
+    assert models.utils.reduce_conf_mats(conf_mats) == (round(100 * np.mean(accs), 3), round(100 * np.mean(f1s), 3))
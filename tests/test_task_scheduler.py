@@ -0,0 +1,94 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from models.task_scheduler import TaskScheduler
+
+TASKS = ['QA', 'Sbj_Class', 'Domain_Class']
+DISTRIB = [2/3, 1/6, 1/6]
+
+def test_task_order_matches_single_draw_without_reweighting():
+    # reference: previous implementation drew the task order once via np.random.choice w.r.t. the base distribution
+    np.random.seed(42)
+    expected = np.random.choice(TASKS, size=50, replace=True, p=DISTRIB)
+    task_scheduler = TaskScheduler(TASKS, DISTRIB, n_steps=50, n_epochs=3)
+    np.random.seed(42)
+    task_scheduler.start_epoch(0)
+    assert list(task_scheduler.task_order) == list(expected)
+    assert task_scheduler.task_distrib == Counter(expected)
+
+def test_counts_match_counter_over_prefix():
+    # reference: previous implementation counted steps per task via Counter(task_order[:step+1])
+    np.random.seed(0)
+    task_scheduler = TaskScheduler(TASKS, DISTRIB, n_steps=40, n_epochs=1)
+    task_scheduler.start_epoch(0)
+    for step in range(40):
+        current_task = task_scheduler.next_task(step)
+        assert current_task == task_scheduler.task_order[step]
+        assert task_scheduler.counts[current_task] == Counter(task_scheduler.task_order[:step+1])[current_task]
+    assert task_scheduler.counts == task_scheduler.task_distrib
+
+@pytest.mark.parametrize('temperature', [0.5, 1.0, 2.0])
+def test_temperature_and_annealing(temperature):
+    n_epochs = 5
+    task_scheduler = TaskScheduler(TASKS, DISTRIB, n_steps=10, n_epochs=n_epochs, temperature=temperature, anneal=True)
+    for epoch in range(n_epochs):
+        T = temperature + (1 - temperature) * epoch / (n_epochs - 1)
+        expected = np.array(DISTRIB) ** (1 / T)
+        np.testing.assert_allclose(task_scheduler.get_distrib(epoch), expected / expected.sum(), rtol=1e-12)
+    # annealing ends at the base distribution
+    np.testing.assert_allclose(task_scheduler.get_distrib(n_epochs - 1), DISTRIB, rtol=1e-12)
+    task_scheduler.anneal = False
+    assert task_scheduler.get_temperature(n_epochs - 1) == temperature
+
+def test_loss_based_weighting():
+    momentum = 0.9
+    task_scheduler = TaskScheduler(TASKS, DISTRIB, n_steps=10, n_epochs=1, loss_weighting=True, momentum=momentum)
+    np.testing.assert_allclose(task_scheduler.get_distrib(0), DISTRIB, rtol=1e-12)
+    losses = [('QA', 2.0), ('Sbj_Class', -0.5), ('QA', 1.0), ('Sbj_Class', 0.7)]
+    expected_losses = {}
+    for task, loss in losses:
+        task_scheduler.update_loss(task, loss)
+        expected_losses[task] = abs(loss) if task not in expected_losses else momentum * expected_losses[task] + (1 - momentum) * abs(loss)
+    assert task_scheduler.losses == pytest.approx(expected_losses)
+    # tasks without a loss yet are weighted by the mean loss across all other tasks
+    weights = np.array([expected_losses['QA'], expected_losses['Sbj_Class'], np.mean(list(expected_losses.values()))])
+    expected = np.array(DISTRIB) * weights
+    np.testing.assert_allclose(task_scheduler.get_distrib(0), expected / expected.sum(), rtol=1e-12)
+
+def test_task_order_is_resampled_once_per_epoch():
+    np.random.seed(1)
+    task_scheduler = TaskScheduler(TASKS, DISTRIB, n_steps=30, n_epochs=2)
+    task_scheduler.start_epoch(0)
+    task_order = list(task_scheduler.task_order)
+    task_scheduler.next_task(0)
+    task_scheduler.start_epoch(0)
+    assert list(task_scheduler.task_order) == task_order
+    assert sum(task_scheduler.counts.values()) == 1
+    task_scheduler.start_epoch(1)
+    assert list(task_scheduler.task_order) != task_order
+    assert sum(task_scheduler.counts.values()) == 0
+
+def test_state_dict_round_trip_resumes_interrupted_epoch():
+    np.random.seed(2)
+    task_scheduler = TaskScheduler(TASKS, DISTRIB, n_steps=20, n_epochs=2, loss_weighting=True)
+    task_scheduler.start_epoch(0)
+    for step in range(8):
+        task_scheduler.update_loss(task_scheduler.next_task(step), float(step))
+    resumed = TaskScheduler(TASKS, DISTRIB, n_steps=20, n_epochs=2, loss_weighting=True)
+    resumed.load_state_dict(task_scheduler.state_dict())
+    # the task order of a resumed epoch is restored instead of being resampled
+    np.random.seed(3)
+    resumed.start_epoch(0)
+    assert list(resumed.task_order) == list(task_scheduler.task_order)
+    assert resumed.losses == task_scheduler.losses
+    for step in range(8, 20):
+        assert resumed.next_task(step) == task_scheduler.next_task(step)
+    assert resumed.counts == task_scheduler.counts
+
+def test_invalid_arguments():
+    with pytest.raises(AssertionError):
+        TaskScheduler(TASKS, DISTRIB[:2], n_steps=10, n_epochs=1)
+    with pytest.raises(AssertionError):
+        TaskScheduler(TASKS, DISTRIB, n_steps=10, n_epochs=1, temperature=0)
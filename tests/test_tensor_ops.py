@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import torch
+
+from models import tensor_ops
+from models.tensor_ops import reverse_sequences, soft_to_hard, to_cat
+
+# reference: previous loop-based implementations
+
+def to_cat_loop(true_labels, n_labels):
+    cat_mat = torch.zeros(true_labels.size(0), n_labels)
+    for i, l in enumerate(true_labels):
+        cat_mat[i, l] += 1
+    return cat_mat
+
+def soft_to_hard_loop(probas):
+    return torch.tensor(list(map(lambda p: 1 if p >= 0.5 else 0, probas.cpu().numpy())), dtype=torch.double)
+
+def reverse_sequences_loop(batch):
+    return torch.tensor(list(map(lambda feat_reps: feat_reps[::-1], batch.cpu().numpy().tolist())), dtype=torch.double)
+
+@pytest.mark.parametrize('n_labels', [2, 6])
+@pytest.mark.parametrize('batch_size', [1, 13])
+def test_to_cat_matches_loop(n_labels, batch_size):
+    labels = torch.from_numpy(np.random.RandomState(batch_size).randint(0, n_labels, size=batch_size))
+    one_hot = to_cat(labels, n_labels)
+    assert one_hot.dtype == torch.float
+    assert one_hot.device.type == tensor_ops.device.type
+    assert torch.equal(one_hot.cpu(), to_cat_loop(labels, n_labels))
+
+def test_to_cat_accepts_int_labels():
+    labels = torch.tensor([2, 0, 1], dtype=torch.int)
+    assert torch.equal(to_cat(labels, 3).cpu(), to_cat_loop(labels.long(), 3))
+
+@pytest.mark.parametrize('dtype', [torch.float, torch.double])
+def test_soft_to_hard_matches_loop(dtype):
+    probas = torch.tensor(np.concatenate((np.random.RandomState(0).rand(32), [0., 0.5, 1.])), dtype=dtype)
+    hard = soft_to_hard(probas)
+    assert hard.dtype == torch.double
+    assert hard.device == probas.device
+    assert torch.equal(hard, soft_to_hard_loop(probas))
+
+def test_soft_to_hard_threshold_boundary():
+    # probabilities of exactly 0.5 are mapped onto the positive class
+    probas = torch.tensor([np.nextafter(0.5, 0.), 0.5, np.nextafter(0.5, 1.)], dtype=torch.double)
+    assert soft_to_hard(probas).tolist() == [0., 1., 1.]
+    assert torch.equal(soft_to_hard(probas), soft_to_hard_loop(probas))
+
+def test_soft_to_hard_does_not_track_gradients():
+    probas = torch.rand(5, requires_grad=True)
+    assert not soft_to_hard(probas).requires_grad
+
+@pytest.mark.parametrize('batch_size,seq_len,hidden_size', [(1, 1, 1), (4, 7, 3), (3, 24, 8)])
+def test_reverse_sequences_matches_loop(batch_size, seq_len, hidden_size):
+    batch = torch.randn(batch_size, seq_len, hidden_size)
+    reversed_batch = reverse_sequences(batch)
+    assert reversed_batch.dtype == torch.double
+    assert reversed_batch.device.type == tensor_ops.device.type
+    assert torch.equal(reversed_batch.cpu(), reverse_sequences_loop(batch))
+
+def test_reverse_sequences_of_variable_length():
+    # sequences of different lengths are zero-padded to the max length, the padded time axis is reversed as a whole (same as the loop)
+    input_lengths = [5, 2, 4]
+    batch = torch.zeros(len(input_lengths), max(input_lengths), 3)
+    for i, input_length in enumerate(input_lengths):
+        batch[i, :input_length] = torch.randn(input_length, 3)
+    reversed_batch = reverse_sequences(batch).cpu()
+    assert torch.equal(reversed_batch, reverse_sequences_loop(batch))
+    for i, input_length in enumerate(input_lengths):
+        assert torch.equal(reversed_batch[i, max(input_lengths) - input_length:], batch[i, :input_length].flip(0).double())
+        assert not reversed_batch[i, :max(input_lengths) - input_length].any()
+
+def test_reverse_sequences_accepts_numpy_arrays():
+    batch = np.random.RandomState(0).randn(2, 5, 4)
+    assert torch.equal(reverse_sequences(batch).cpu(), reverse_sequences_loop(torch.from_numpy(batch)))
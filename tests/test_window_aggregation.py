@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+utils = pytest.importorskip('models.utils')
+
+from collections import namedtuple
+
+Feature = namedtuple('Feature', ['example_index', 'token_to_orig_map', 'token_is_max_context'])
+Example = namedtuple('Example', ['qas_id', 'doc_tokens', 'orig_answer_text'])
+
+def best_span_loop(start_logits, end_logits, feature, max_answer_length):
+    # reference: exhaustive search over all valid (start, end) pairs of a single window
+    best = (-np.inf, 0, 0)
+    for start in range(len(start_logits)):
+        for end in range(start, min(start + max_answer_length, len(end_logits))):
+            if start not in feature.token_to_orig_map or end not in feature.token_to_orig_map:
+                continue
+            if not feature.token_is_max_context.get(start, False):
+                continue
+            score = start_logits[start] + end_logits[end]
+            if score > best[0]:
+                best = (score, start, end)
+    return best
+
+def make_windows(seed, n_examples=4, seq_len=16, doc_len=20, stride=6):
+    rnd = np.random.RandomState(seed)
+    examples, features = [], []
+    for example_index in range(n_examples):
+        doc_tokens = ['w{}_{}'.format(example_index, i) for i in range(doc_len)]
+        examples.append(Example('q{}'.format(example_index), doc_tokens, ' '.join(doc_tokens[3:5])))
+        # context tokens start after [CLS] + 3 question tokens + [SEP]
+        for doc_start in range(0, doc_len - stride, stride):
+            n_ctx = min(seq_len - 6, doc_len - doc_start)
+            token_to_orig_map = {5 + i: doc_start + i for i in range(n_ctx)}
+            token_is_max_context = {pos: bool(rnd.rand() > 0.3) for pos in token_to_orig_map}
+            features.append(Feature(example_index, token_to_orig_map, token_is_max_context))
+    start_logits = rnd.randn(len(features), seq_len)
+    end_logits = rnd.randn(len(features), seq_len)
+    return features, examples, start_logits, end_logits
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('max_answer_length', [1, 3, 30])
+def test_best_valid_spans_match_exhaustive_search(seed, max_answer_length):
+    features, _, start_logits, end_logits = make_windows(seed)
+    start_mask, end_mask = utils.get_window_masks(features, start_logits.shape[1])
+    scores, starts, ends = utils.get_best_valid_spans(start_logits, end_logits, start_mask, end_mask, max_answer_length)
+    for i, feature in enumerate(features):
+        score, start, end = best_span_loop(start_logits[i], end_logits[i], feature, max_answer_length)
+        assert scores[i] == score
+        if np.isfinite(score):
+            assert (starts[i], ends[i]) == (start, end)
+
+def test_window_masks_match_feature_maps():
+    features, _, start_logits, _ = make_windows(0)
+    start_mask, end_mask = utils.get_window_masks(features, start_logits.shape[1])
+    for i, feature in enumerate(features):
+        for pos in range(start_logits.shape[1]):
+            assert end_mask[i, pos] == (pos in feature.token_to_orig_map)
+            assert start_mask[i, pos] == feature.token_is_max_context.get(pos, False)
+
+def test_aggregation_picks_best_window_per_question():
+    features, examples, start_logits, end_logits = make_windows(3)
+    # push the null score down s.t. every question gets a span
+    start_logits[:, 0] = end_logits[:, 0] = -1e3
+    predictions, _, _ = utils.aggregate_answers_across_windows(features, examples, start_logits, end_logits)
+    for example_index, example in enumerate(examples):
+        candidates = [(best_span_loop(start_logits[i], end_logits[i], f, 30), f) for i, f in enumerate(features) if f.example_index == example_index]
+        (_, start, end), feature = max(candidates, key=lambda c: c[0][0])
+        expected = ' '.join(example.doc_tokens[feature.token_to_orig_map[start]:feature.token_to_orig_map[end] + 1])
+        assert predictions[example.qas_id] == expected
+
+def test_questions_with_skipped_windows_are_dropped(capsys):
+    features, examples, start_logits, end_logits = make_windows(4)
+    # last mini-batch was skipped at inference time and cuts through the windows of the last question
+    n_kept = len(features) - 1
+    predictions, _, _ = utils.aggregate_answers_across_windows(features, examples, start_logits[:n_kept], end_logits[:n_kept])
+    assert set(predictions) == {example.qas_id for example in examples[:-1]}
+    assert '1 question(s)' in capsys.readouterr().out
@@ -969,15 +969,20 @@ class BatchGenerator(object):
     def __iter__(self):
         return create_batches(self.dataset, self.batch_size, self.n_batches, self.sort_batch)
 
+    def iter_from(self, start_batch:int):
+        # the first start_batch mini-batches are neither sliced nor sorted (e.g., when resuming an interrupted epoch)
+        return create_batches(self.dataset, self.batch_size, self.n_batches, self.sort_batch, start_batch)
+
 def create_batches(
                    dataset:torch.Tensor,
                    batch_size:int,
                    n_batches:int,
                    sort_batch:bool=False,
+                   start_batch:int=0,
 ):
     n_examples = len(dataset)
-    idx = 0
-    for _ in range(n_examples // batch_size):
+    idx = start_batch * batch_size
+    for _ in range(start_batch, n_examples // batch_size):
         batch = dataset[idx: idx + batch_size]
         idx += batch_size
         